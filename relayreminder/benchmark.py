@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+#
+# RelayReminder benchmark
+#
+# Measures relayreminder.py against generated channels served by
+# fakemattermost.py: wall time, number of API requests and peak memory of
+# MattermostChannel.__init__, post_records, main() and the slash-commands.
+# The results are written as JSON, to compare versions before upgrading.
+#
+# Lisence: GNU General Publice Lisence v3
+#
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.request
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+os.environ.setdefault("RELAYREMINDER_SLASHCOMMAND_MODE", "false")
+import relayreminder
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "fake-token"
+SLASH_TOKEN = "benchmark-slash-token"
+
+class FakeServer:
+    """
+    fakemattermost.py run in a subprocess, so that neither its CPU time nor
+    its memory is counted in the measurements.
+    """
+    def __init__(self, members: int, posts: int, thread_ratio: float, record_weeks: int, relaystop_posts: int, seed: int):
+        self.port = free_port()
+        self.command = [
+            sys.executable, os.path.join(HERE, "fakemattermost.py"),
+            "--port", str(self.port),
+            "--token", TOKEN,
+            "--members", str(members),
+            "--posts", str(posts),
+            "--thread-ratio", str(thread_ratio),
+            "--record-weeks", str(record_weeks),
+            "--relaystop-posts", str(relaystop_posts),
+            "--seed", str(seed),
+        ]
+        self.process = None
+
+    def __enter__(self) -> "FakeServer":
+        self.process = subprocess.Popen(self.command, stdout=subprocess.DEVNULL)
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"fakemattermost.py exited with {self.process.returncode}")
+            try:
+                self.reset_request_counts()
+                return self
+            except OSError:
+                time.sleep(0.2)
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+    def request(self, method: str, path: str, data: Any = None) -> Any:
+        body = None if data is None else json.dumps(data).encode()
+        req = urllib.request.Request(f"http://127.0.0.1:{self.port}{path}", data=body, method=method,
+                                     headers={"Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"})
+        with urllib.request.urlopen(req) as response:
+            return json.loads(response.read())
+
+    def reset_request_counts(self):
+        self.request("DELETE", "/fake/request_counts")
+
+    def request_counts(self) -> Dict[str, int]:
+        return self.request("GET", "/fake/request_counts")
+
+    def driver_params(self) -> Dict:
+        return {"url": "127.0.0.1", "scheme": "http", "port": self.port, "token": TOKEN}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def measure(server: FakeServer, func: Callable[[], Any], repeat: int, memory: bool, setup: Optional[Callable[[], Any]] = None) -> Dict:
+    """
+    Run `func` `repeat` times for the wall time and the requests, then once
+    more under tracemalloc for the peak memory. `setup`, if given, runs
+    before each call and is not measured; its result is passed to `func`.
+
+    Returns:
+        - (dict): wall time statistics in seconds, requests of the last run
+          (total and by route), and the peak memory in bytes (or None).
+    """
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        server.reset_request_counts()
+        start = time.perf_counter()
+        func(state) if setup else func()
+        times.append(time.perf_counter() - start)
+        counts = server.request_counts()
+
+    peak_memory = None
+    if memory:
+        state = setup() if setup else None
+        tracemalloc.start()
+        try:
+            func(state) if setup else func()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "wall_time": {
+            "min": min(times),
+            "median": statistics.median(times),
+            "max": max(times),
+            "runs": len(times),
+        },
+        "requests": sum(counts.values()),
+        "requests_by_route": counts,
+        "peak_memory": peak_memory,
+    }
+
+def relayreminder_args(server: FakeServer, argv: List[str]):
+    """relayreminder.parse_args() on the given command line, pointed at the fake server."""
+    saved_argv, saved_environ = sys.argv, dict(os.environ)
+    sys.argv = [
+        "relayreminder.py",
+        "--mm-url", "127.0.0.1",
+        "--scheme", "http",
+        "--port", str(server.port),
+        "--bot-token", TOKEN,
+        "--team", "main",
+        "--channel", "relaychannel",
+        "--message-file", os.path.join(HERE, "messages.tsv"),
+        "--post-cache", "",
+    ] + argv
+    try:
+        return relayreminder.parse_args()
+    finally:
+        # parse_args() mirrors the options into os.environ.
+        sys.argv = saved_argv
+        os.environ.clear()
+        os.environ.update(saved_environ)
+
+def run_scenarios(server: FakeServer, args: argparse.Namespace) -> Dict[str, Dict]:
+    results = {}
+    driver_params = server.driver_params()
+    after_weeksago = None if args.all_history else 100
+
+    def new_channel():
+        return relayreminder.MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=after_weeksago)
+
+    results["MattermostChannel.__init__"] = measure(server, new_channel, args.repeat, args.memory)
+
+    mm_channel = new_channel()
+    results["post_records"] = measure(server, lambda: relayreminder.post_records(mm_channel, "RelayReminder"), args.repeat, args.memory)
+
+    main_args = relayreminder_args(server, ["--stdout-mode"] + (["--all-history"] if args.all_history else []))
+    def run_main():
+        with contextlib.redirect_stdout(io.StringIO()):
+            channel_results = relayreminder.main(main_args)
+        for result in channel_results.values():
+            if result["error"] is not None:
+                raise result["error"]
+    results["main"] = measure(server, run_main, args.repeat, args.memory)
+
+    # Slash-commands, as sent by Mattermost.
+    channel_id = mm_channel.channel_id
+    admin_id = next(user["id"] for user in server.request("POST", "/api/v4/users/ids", mm_channel.user_ids) if "system_admin" in user["roles"])
+    form = {"token": SLASH_TOKEN, "channel_id": channel_id, "user_id": admin_id}
+    commands = {
+        "/blacklist": dict(form, text=""),
+        "/whenmylast": dict(form, text=""),
+        "/relayadmin": dict(form, text="status"),
+    }
+    for name in ("MATTERMOST_BLACKLIST_TOKEN", "MATTERMOST_WHENMYLAST_TOKEN", "MATTERMOST_RELAYADMIN_TOKEN"):
+        os.environ[name] = SLASH_TOKEN
+    slash_args = relayreminder_args(server, ["--refresh-interval", "0"] + (["--all-history"] if args.all_history else []))
+
+    def new_client():
+        return relayreminder.create_slashcommand_app(slash_args).test_client()
+
+    def post(client, path):
+        response = client.post(path, data=commands[path])
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}")
+
+    for path in commands:
+        # The first command of a server builds the channel snapshot, the later ones answer from it.
+        results[f"{path} (first)"] = measure(server, lambda client, path=path: post(client, path), args.repeat, args.memory, setup=new_client)
+        client = new_client()
+        post(client, path)
+        results[path] = measure(server, lambda path=path: post(client, path), args.repeat, args.memory)
+    return results
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark relayreminder.py against generated channels of fakemattermost.py.")
+    parser.add_argument("--members", type=int, nargs="+", default=[10, 100, 1000], help="Member counts to benchmark (default: %(default)s)")
+    parser.add_argument("--posts", type=int, nargs="+", default=[1000, 10000, 100000], help="Post counts to benchmark (default: %(default)s)")
+    parser.add_argument("--thread-ratio", type=float, nargs="+", default=[0.3], help="Fractions of the posts in threads (default: %(default)s)")
+    parser.add_argument("--record-weeks", type=int, default=26, help="Number of weeks with record posts of the app")
+    parser.add_argument("--relaystop-posts", type=int, default=5, help="Number of relaystop posts of the app")
+    parser.add_argument("--all-history", action="store_true", help="Search all history of the channel.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs of each scenario")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Skip the (slow) peak memory run under tracemalloc.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generated channels")
+    parser.add_argument("--label", default="", help="Free label stored in the results, e.g. the version under test")
+    parser.add_argument("--output", default="-", help="Path of the JSON results; '-' for stdout (default: %(default)s)")
+    return parser.parse_args()
+
+def main(args: argparse.Namespace) -> Dict:
+    report = {
+        "label": args.label,
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "runs": [],
+    }
+    for members, posts, thread_ratio in itertools.product(args.members, args.posts, args.thread_ratio):
+        params = {
+            "members": members,
+            "posts": posts,
+            "thread_ratio": thread_ratio,
+            "record_weeks": args.record_weeks,
+            "relaystop_posts": args.relaystop_posts,
+            "all_history": args.all_history,
+        }
+        print(f"Benchmarking {params}", file=sys.stderr)
+        with FakeServer(members, posts, thread_ratio, args.record_weeks, args.relaystop_posts, args.seed) as server:
+            results = run_scenarios(server, args)
+        for scenario, result in results.items():
+            print(f"  {scenario:32} {result['wall_time']['median']:9.3f} s {result['requests']:7d} requests", file=sys.stderr)
+        report["runs"].append({"params": params, "results": results})
+    return report
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = main(args)
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+#
+# FakeMattermost
+#
+# A local stand-in for the Mattermost server, for testing RelayReminder.
+# It serves the part of the REST API used by relayreminder.py, and the
+# websocket event stream.
+#
+# Lisence: GNU General Publice Lisence v3
+#
+
+from aiohttp import web, WSMsgType
+import argparse
+import asyncio
+import json
+import math
+import random
+import string
+import threading
+import time
+from datetime import datetime
+from typing import List, Dict, Optional
+
+def new_id() -> str:
+    """A random 26-character id, like the ones of Mattermost."""
+    return "".join(random.choices(string.ascii_lowercase + string.digits, k=26))
+
+def now_milliseconds() -> int:
+    return int(time.time() * 1000)
+
+def week_number(milliseconds: int) -> int:
+    """Week number of relayreminder.py (weeks since 0001-01-01, a Monday)."""
+    return (datetime.fromtimestamp(milliseconds / 1000) - datetime(1, 1, 1)).days // 7
+
+def json_response(data, status: int = 200) -> web.Response:
+    # The driver expects exactly "application/json", without a charset.
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={"Content-Type": "application/json"})
+
+class FakeMattermost:
+    """
+    In-memory Mattermost server with one team. It starts with one channel
+    (self.channel), and more can be added by add_channel().
+
+    The data methods (add_user, add_post, ...) are thread-safe, and broadcast
+    the corresponding websocket events to the connected clients.
+    """
+    def __init__(self, team_name: str = "main", channel_name: str = "relaychannel", token: str = "fake-token"):
+        self.token = token
+        self.team = {"id": new_id(), "name": team_name, "display_name": team_name}
+        self.channels = {}
+        self.members = {}
+        self.users = {}
+        self.posts = {}
+        self._sorted = {}
+        self._pending_posts = {}
+        # Like Mattermost, a pending_post_id is only remembered for a while (seconds).
+        self.pending_post_ttl = 30.0
+        self._failures = {}
+        self.request_counts = {}
+        self.rate_limit = None
+        self.lock = threading.Lock()
+        self.channel = self.add_channel(channel_name)
+        self.bot = self.add_user("relayreminder-bot", roles="system_user")
+
+        self._sockets = set()
+        self._seq = 0
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    # Data
+
+    def add_channel(self, channel_name: str) -> Dict:
+        channel = {
+            "id": new_id(),
+            "team_id": self.team["id"],
+            "name": channel_name,
+            "display_name": channel_name,
+            "type": "O",
+        }
+        with self.lock:
+            self.channels[channel["id"]] = channel
+            self.members[channel["id"]] = []
+        return channel
+
+    def add_user(self, username: str, **fields) -> Dict:
+        user = {
+            "id": new_id(),
+            "username": username,
+            "nickname": "",
+            "first_name": "",
+            "last_name": "",
+            "email": f"{username}@example.com",
+            "roles": "system_user",
+            "delete_at": 0,
+        }
+        user.update(fields)
+        with self.lock:
+            self.users[user["id"]] = user
+        return user
+
+    def add_member(self, user_id: str, channel_id: Optional[str] = None):
+        channel_id = channel_id or self.channel["id"]
+        with self.lock:
+            if user_id in self.members[channel_id]:
+                return
+            self.members[channel_id].append(user_id)
+        self.broadcast("user_added", {"team_id": self.team["id"], "user_id": user_id}, channel_id=channel_id)
+
+    def remove_member(self, user_id: str, channel_id: Optional[str] = None):
+        channel_id = channel_id or self.channel["id"]
+        with self.lock:
+            if user_id not in self.members[channel_id]:
+                return
+            self.members[channel_id].remove(user_id)
+        self.broadcast("user_removed", {"remover_id": self.bot["id"], "user_id": user_id}, channel_id=channel_id)
+
+    def add_post(self, user_id: str, message: str = "", create_at: Optional[int] = None, broadcast: bool = True, **fields) -> Dict:
+        create_at = now_milliseconds() if create_at is None else create_at
+        post = {
+            "id": new_id(),
+            "create_at": create_at,
+            "update_at": create_at,
+            "edit_at": 0,
+            "delete_at": 0,
+            "is_pinned": False,
+            "user_id": user_id,
+            "channel_id": self.channel["id"],
+            "root_id": "",
+            "original_id": "",
+            "message": message,
+            "type": "",
+            "props": {},
+            "hashtags": "",
+            "pending_post_id": "",
+            "reply_count": 0,
+            "metadata": {},
+        }
+        post.update(fields)
+        with self.lock:
+            self.posts[post["id"]] = post
+            self._sorted.pop(post["channel_id"], None)
+        if broadcast:
+            self.broadcast("posted", {"channel_type": "O", "post": json.dumps(post), "team_id": self.team["id"]}, channel_id=post["channel_id"])
+        return post
+
+    def edit_post(self, post_id: str, **fields) -> Dict:
+        with self.lock:
+            post = dict(self.posts[post_id], **fields)
+            post["edit_at"] = post["update_at"] = now_milliseconds()
+            self.posts[post_id] = post
+            self._sorted.pop(post["channel_id"], None)
+        self.broadcast("post_edited", {"post": json.dumps(post)}, channel_id=post["channel_id"])
+        return post
+
+    def delete_post(self, post_id: str) -> Dict:
+        with self.lock:
+            post = dict(self.posts[post_id])
+            post["delete_at"] = post["update_at"] = now_milliseconds()
+            self.posts[post_id] = post
+            self._sorted.pop(post["channel_id"], None)
+        self.broadcast("post_deleted", {"post": json.dumps(post)}, channel_id=post["channel_id"])
+        return post
+
+    def populate(self,
+        members: int = 10,
+        posts: int = 1000,
+        thread_ratio: float = 0.3,
+        important_ratio: float = 0.05,
+        record_weeks: int = 26,
+        relaystop_posts: int = 1,
+        app_name: str = "RelayReminder",
+        span_weeks: int = 104,
+        seed: int = 0,
+        channel_id: Optional[str] = None,
+    ):
+        """
+        Generate a channel: members joining it, their posts, and the record and
+        relaystop posts of RelayReminder. No websocket event is sent.
+
+        Args:
+            members: Number of channel members. The first one is a system admin.
+            posts: Number of posts by the members.
+            thread_ratio: Fraction of the posts which are replies in a thread.
+            important_ratio: Fraction of the posts with the 'important' priority.
+            record_weeks: Number of weeks having a thread of record posts.
+            relaystop_posts: Number of relaystop posts (one thread).
+            span_weeks: The posts are spread over this many weeks until now.
+        """
+        channel_id = channel_id or self.channel["id"]
+        rnd = random.Random(seed)
+        now = now_milliseconds()
+        week = 7 * 24 * 3600 * 1000
+        start = now - span_weeks * week
+
+        user_ids = []
+        for i in range(members):
+            user = self.add_user(f"user{i}", roles="system_user system_admin" if i == 0 else "system_user")
+            user_ids.append(user["id"])
+            with self.lock:
+                self.members[channel_id].append(user["id"])
+            # Members joined by themselves or were added by the first one.
+            join_at = start + rnd.randrange(week)
+            if i % 2:
+                self.add_post(user["id"], create_at=join_at, broadcast=False, channel_id=channel_id, type="system_join_channel")
+            else:
+                self.add_post(user_ids[0], create_at=join_at, broadcast=False, channel_id=channel_id,
+                              type="system_add_to_channel", props={"addedUserId": user["id"]})
+        if not user_ids:
+            return
+
+        roots = []
+        for create_at in sorted(rnd.randrange(start + week, now) for _ in range(posts)):
+            fields = {}
+            if rnd.random() < important_ratio:
+                fields["metadata"] = {"priority": {"priority": "important", "requested_ack": False}}
+            if roots and rnd.random() < thread_ratio:
+                fields["root_id"] = rnd.choice(roots[-1000:])
+            post = self.add_post(rnd.choice(user_ids), "relay post", create_at, broadcast=False, channel_id=channel_id, **fields)
+            if not post["root_id"]:
+                roots.append(post["id"])
+
+        current_week = week_number(now)
+        for k in range(record_weeks):
+            last_post_week = current_week - 4 - k
+            root_id = ""
+            for passed_weeks in range(4, 4 + rnd.randint(1, 3)):
+                create_at = now - (k + 1) * week + passed_weeks * 1000
+                post = self.add_post(
+                    self.bot["id"], f"reminder for week {last_post_week}", create_at, broadcast=False, channel_id=channel_id,
+                    root_id=root_id,
+                    props={
+                        "bot_app": app_name,
+                        "type": "record",
+                        "last_post_week": last_post_week,
+                        "passed_weeks": passed_weeks,
+                        "users": rnd.sample(user_ids, min(len(user_ids), 5)),
+                    },
+                )
+                root_id = root_id or post["id"]
+
+        root_id = ""
+        stop_data = {}
+        for i in range(relaystop_posts):
+            if i:
+                stop_data[rnd.choice(user_ids)] = "2099-01-01"
+            post = self.add_post(
+                self.bot["id"], "Administration thread." if not i else "/relayadmin stop", start + i, broadcast=False,
+                channel_id=channel_id, root_id=root_id,
+                props={"bot_app": app_name, "type": "relaystop", "data": dict(stop_data)},
+            )
+            root_id = root_id or post["id"]
+
+    def fail_requests(self, key: str, times: int = 1, status: int = 500, after_handling: bool = False):
+        """
+        Answer `status` to the next `times` requests of `key` ("METHOD /route",
+        as in request_counts). With `after_handling`, the request is handled
+        first, like a request whose response was lost.
+        """
+        with self.lock:
+            self._failures[key] = {"times": times, "status": status, "after_handling": after_handling}
+
+    def set_rate_limit(self, per_sec: Optional[float], max_burst: int = 100):
+        """
+        Limit the API requests like Mattermost's RateLimitSettings: a bucket of
+        `max_burst` requests refilled by `per_sec`, answering X-RateLimit-*
+        headers and 429 with Retry-After when empty. None disables the limit.
+        """
+        with self.lock:
+            self.rate_limit = None if per_sec is None else {
+                "per_sec": per_sec, "max_burst": max_burst, "tokens": float(max_burst), "updated": time.monotonic(),
+            }
+
+    def _rate_limit_headers(self) -> Optional[Dict]:
+        """Take a token of the rate limit. Returns the headers to answer, with 'Retry-After' if rejected."""
+        with self.lock:
+            limit = self.rate_limit
+            if limit is None:
+                return None
+            now = time.monotonic()
+            limit["tokens"] = min(limit["max_burst"], limit["tokens"] + (now - limit["updated"]) * limit["per_sec"])
+            limit["updated"] = now
+            headers = {"X-RateLimit-Limit": str(limit["max_burst"])}
+            if limit["tokens"] < 1:
+                headers["X-RateLimit-Remaining"] = "0"
+                headers["X-RateLimit-Reset"] = str(math.ceil(limit["max_burst"] / limit["per_sec"]))
+                headers["Retry-After"] = str(math.ceil((1 - limit["tokens"]) / limit["per_sec"]))
+                return headers
+            limit["tokens"] -= 1
+            headers["X-RateLimit-Remaining"] = str(int(limit["tokens"]))
+            headers["X-RateLimit-Reset"] = str(math.ceil((limit["max_burst"] - limit["tokens"]) / limit["per_sec"]))
+            return headers
+
+    # Websocket
+
+    def broadcast(self, event: str, data: Dict, channel_id: str = "", user_id: str = ""):
+        """Send a websocket event to all connected clients."""
+        if self._loop is None:
+            return
+        with self.lock:
+            self._seq += 1
+            message = json.dumps({
+                "event": event,
+                "data": data,
+                "broadcast": {"omit_users": None, "user_id": user_id, "channel_id": channel_id, "team_id": ""},
+                "seq": self._seq,
+            })
+        for websocket in list(self._sockets):
+            asyncio.run_coroutine_threadsafe(websocket.send_str(message), self._loop)
+
+    async def _websocket(self, request: web.Request) -> web.WebSocketResponse:
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        async for message in websocket:
+            if message.type != WSMsgType.TEXT:
+                break
+            action = json.loads(message.data)
+            if action.get("action") == "authentication_challenge":
+                if action.get("data", {}).get("token") != self.token:
+                    await websocket.send_str(json.dumps({"status": "FAIL", "seq_reply": action.get("seq")}))
+                    break
+                await websocket.send_str(json.dumps({
+                    "event": "hello",
+                    "data": {"server_version": "fake"},
+                    "broadcast": {"omit_users": None, "user_id": self.bot["id"], "channel_id": "", "team_id": ""},
+                    "seq": 0,
+                }))
+                await websocket.send_str(json.dumps({"status": "OK", "seq_reply": action.get("seq")}))
+                self._sockets.add(websocket)
+        self._sockets.discard(websocket)
+        return websocket
+
+    # REST API
+
+    def _sorted_posts(self, channel_id: str, include_deleted: bool = True) -> List[Dict]:
+        """Posts of the channel, newest first. Cached until the posts change."""
+        with self.lock:
+            if channel_id not in self._sorted:
+                posts = sorted(
+                    (post for post in self.posts.values() if post["channel_id"] == channel_id),
+                    key=lambda post: post["create_at"], reverse=True,
+                )
+                self._sorted[channel_id] = (posts, [post for post in posts if post["delete_at"] == 0])
+            return self._sorted[channel_id][0 if include_deleted else 1]
+
+    @staticmethod
+    def _page(request: web.Request, default_per_page: int = 60):
+        page = int(request.query.get("page", 0))
+        per_page = min(int(request.query.get("per_page", default_per_page)), 200)
+        return page, per_page
+
+    async def _get_me(self, request):
+        return json_response(self.bot)
+
+    async def _logout(self, request):
+        return json_response({"status": "OK"})
+
+    async def _get_channel_by_name(self, request):
+        if request.match_info["team_name"] == self.team["name"]:
+            for channel in list(self.channels.values()):
+                if channel["name"] == request.match_info["channel_name"]:
+                    return json_response(channel)
+        return json_response({"message": "Channel not found"}, status=404)
+
+    async def _get_channel(self, request):
+        channel = self.channels.get(request.match_info["channel_id"])
+        if channel is None:
+            return json_response({"message": "Channel not found"}, status=404)
+        return json_response(channel)
+
+    async def _get_channel_members(self, request):
+        channel_id = request.match_info["channel_id"]
+        page, per_page = self._page(request)
+        with self.lock:
+            members = self.members.get(channel_id, [])[page * per_page:(page + 1) * per_page]
+        return json_response([{"channel_id": channel_id, "user_id": user_id, "roles": "channel_user"} for user_id in members])
+
+    async def _get_users_by_ids(self, request):
+        user_ids = await request.json()
+        with self.lock:
+            return json_response([self.users[user_id] for user_id in user_ids if user_id in self.users])
+
+    async def _get_user(self, request):
+        user = self.users.get(request.match_info["user_id"])
+        if user is None:
+            return json_response({"message": "User not found"}, status=404)
+        return json_response(user)
+
+    async def _get_posts(self, request):
+        channel_id = request.match_info["channel_id"]
+        since = int(request.query.get("since", 0))
+        before = request.query.get("before", "")
+        if since > 0:
+            # Like the real server, 'since' ignores the paging and returns at most 1000 posts.
+            posts = [post for post in self._sorted_posts(channel_id) if post["update_at"] > since][:1000]
+        else:
+            page, per_page = self._page(request)
+            posts = self._sorted_posts(channel_id, include_deleted=False)
+            if before:
+                anchor = self.posts.get(before)
+                posts = [post for post in posts if anchor is not None and post["create_at"] < anchor["create_at"]]
+            posts = posts[page * per_page:(page + 1) * per_page]
+        return json_response({
+            "order": [post["id"] for post in posts],
+            "posts": {post["id"]: post for post in posts},
+            "next_post_id": "",
+            "prev_post_id": "",
+        })
+
+    async def _create_post(self, request):
+        payload = await request.json()
+        if payload.get("channel_id") not in self.channels:
+            return json_response({"message": "Channel not found"}, status=404)
+        # Like Mattermost, a pending_post_id repeated within pending_post_ttl returns the post created first.
+        pending_post_id = payload.get("pending_post_id", "")
+        with self.lock:
+            existing, created = self._pending_posts.get(pending_post_id, (None, 0)) if pending_post_id else (None, 0)
+        if existing is not None and time.monotonic() - created < self.pending_post_ttl:
+            return json_response(self.posts[existing], status=201)
+        post = self.add_post(
+            self.bot["id"],
+            payload.get("message", ""),
+            channel_id=payload["channel_id"],
+            root_id=payload.get("root_id", ""),
+            props=payload.get("props", {}),
+            pending_post_id=pending_post_id,
+        )
+        if pending_post_id:
+            with self.lock:
+                self._pending_posts[pending_post_id] = (post["id"], time.monotonic())
+        return json_response(post, status=201)
+
+    async def _follow_thread(self, request):
+        if request.match_info["user_id"] not in self.users:
+            return json_response({"message": "User not found"}, status=404)
+        return json_response({"status": "OK"})
+
+    async def _get_request_counts(self, request):
+        with self.lock:
+            return json_response(dict(self.request_counts))
+
+    async def _reset_request_counts(self, request):
+        with self.lock:
+            self.request_counts.clear()
+        return json_response({"status": "OK"})
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        if route.startswith("/fake/"):
+            return await handler(request)  # Control endpoints: neither counted nor authenticated.
+        with self.lock:
+            key = f"{request.method} {route}"
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+            failure = self._failures.get(key)
+            if failure is not None:
+                failure["times"] -= 1
+                if failure["times"] <= 0:
+                    del self._failures[key]
+        if failure is not None:
+            if failure["after_handling"]:
+                await handler(request)
+            return json_response({"message": "injected failure"}, status=failure["status"])
+        if route == "/api/v4/websocket":
+            return await handler(request)
+        if request.headers.get("Authorization") != f"Bearer {self.token}":
+            return json_response({"message": "Invalid or expired session"}, status=401)
+        rate_limit_headers = self._rate_limit_headers()
+        if rate_limit_headers is None:
+            return await handler(request)
+        if "Retry-After" in rate_limit_headers:
+            response = json_response({"message": "limit exceeded"}, status=429)
+        else:
+            response = await handler(request)
+        response.headers.update(rate_limit_headers)
+        return response
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/api/v4/websocket", self._websocket)
+        app.router.add_get("/api/v4/users/me", self._get_me)
+        app.router.add_post("/api/v4/users/logout", self._logout)
+        app.router.add_post("/api/v4/users/ids", self._get_users_by_ids)
+        app.router.add_get("/api/v4/users/{user_id}", self._get_user)
+        app.router.add_get("/api/v4/teams/name/{team_name}/channels/name/{channel_name}", self._get_channel_by_name)
+        app.router.add_get("/api/v4/channels/{channel_id}", self._get_channel)
+        app.router.add_get("/api/v4/channels/{channel_id}/members", self._get_channel_members)
+        app.router.add_get("/api/v4/channels/{channel_id}/posts", self._get_posts)
+        app.router.add_post("/api/v4/posts", self._create_post)
+        app.router.add_put("/api/v4/users/{user_id}/teams/{team_id}/threads/{thread_id}/following", self._follow_thread)
+        app.router.add_delete("/api/v4/users/{user_id}/teams/{team_id}/threads/{thread_id}/following", self._follow_thread)
+        app.router.add_get("/fake/request_counts", self._get_request_counts)
+        app.router.add_delete("/fake/request_counts", self._reset_request_counts)
+        return app
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """
+        Serve in a background thread.
+
+        Returns:
+            The listening port.
+        """
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self.make_app())
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, host, port)
+            self._loop.run_until_complete(site.start())
+            self.port = self._runner.addresses[0][1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.port
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def driver_params(self) -> Dict:
+        """Driver parameters of relayreminder.MattermostChannel for this server."""
+        return {"url": "127.0.0.1", "scheme": "http", "port": self.port, "token": self.token}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="FakeMattermost: a local stand-in for the Mattermost server.")
+    parser.add_argument("--host", default="127.0.0.1", help="Listening host (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8065, help="Listening port (default: %(default)s)")
+    parser.add_argument("--team", default="main", help="Team name")
+    parser.add_argument("--channel", default="relaychannel", help="Channel name")
+    parser.add_argument("--token", default="fake-token", help="Accepted bot token")
+    parser.add_argument("--members", type=int, default=10, help="Number of channel members")
+    parser.add_argument("--posts", type=int, default=1000, help="Number of generated posts by the members")
+    parser.add_argument("--thread-ratio", type=float, default=0.3, help="Fraction of the posts in threads")
+    parser.add_argument("--important-ratio", type=float, default=0.05, help="Fraction of the posts with the 'important' priority")
+    parser.add_argument("--record-weeks", type=int, default=26, help="Number of weeks with record posts of the app")
+    parser.add_argument("--relaystop-posts", type=int, default=1, help="Number of relaystop posts of the app")
+    parser.add_argument("--app-name", default="RelayReminder", help="Application name of the bot posts")
+    parser.add_argument("--span-weeks", type=int, default=104, help="Weeks over which the posts are spread")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Requests per second allowed, like RateLimitSettings.PerSec (default: unlimited)")
+    parser.add_argument("--max-burst", type=int, default=100, help="Burst of requests allowed with --rate-limit")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = FakeMattermost(args.team, args.channel, args.token)
+    server.populate(
+        members=args.members,
+        posts=args.posts,
+        thread_ratio=args.thread_ratio,
+        important_ratio=args.important_ratio,
+        record_weeks=args.record_weeks,
+        relaystop_posts=args.relaystop_posts,
+        app_name=args.app_name,
+        span_weeks=args.span_weeks,
+        seed=args.seed,
+    )
+    server.set_rate_limit(args.rate_limit, args.max_burst)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
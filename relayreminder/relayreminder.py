@@ -8,12 +8,14 @@
 # Lisence: GNU General Publice Lisence v3
 #
 
-from mattermostautodriver import Driver, endpoints
+from mattermostautodriver import Driver, AsyncDriver, Client, AsyncClient, Websocket, endpoints
 from datetime import datetime, date, timedelta
 import argparse
-from typing import List, Dict, Optional, Union, Any
+from typing import List, Dict, Optional, Union, Any, Callable, Iterator, Iterable
+from functools import lru_cache, wraps
 import warnings
-from bisect import bisect_right
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
 import re
 import os
 import sys
@@ -22,12 +24,46 @@ from dotenv import load_dotenv
 import subprocess
 from flask import Flask, request, jsonify, g
 from dateutil import parser
-import requests
 import shlex
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+import sqlite3
+import json
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+import time
+import traceback
+import inspect
+import contextvars
+import math
+import httpx
+import mmap
+import struct
+import urllib.parse
 
 BASE_TIME = datetime(1,1,1)
 BASE_DATE = BASE_TIME.date() # Monday
 ANCIENT = UNIX_EPOCH = datetime.utcfromtimestamp(0)
+MAX_PAGE_SIZE = 200 # The maximum per_page accepted by Mattermost.
+SINCE_POST_LIMIT = 1000 # The most posts Mattermost returns for a 'since' request, which ignores the paging.
+SENT_POST_LOOKBACK = 10 * 60 * 1000 # ms before a reminder post within which its earlier attempts are looked for
+DEFAULT_REQUEST_TIMEOUT = 30 # seconds
+MAX_CHANNEL_WORKERS = 8 # channels processed concurrently by main()
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30) # seconds
+SNAPSHOT_HEADER = struct.Struct("<8sQ") # magic, size of the JSON metadata
+SNAPSHOT_MAGIC = b"RRSNAP1\0"
+INTERACTIVE, BACKGROUND = 0, 1 # priorities of the Mattermost requests
 
 class either:
     def __init__(self, *values):
@@ -43,6 +79,1450 @@ class either:
         return iter(self.values)
 
 Anything = object()
+_MISSING = object()
+
+def _criteria_shape(criteria: Dict[str, Any], values: List[Any]) -> tuple:
+    """
+    Split `criteria` into its shape (keys and kinds of values), which is
+    hashable, and its leaf values, which are appended to `values`.
+    """
+    shape = []
+    for key, value in criteria.items():
+        if value is Anything:
+            shape.append((key, "anything", None))
+        elif isinstance(value, dict):
+            shape.append((key, "dict", _criteria_shape(value, values)))
+        elif isinstance(value, (set, list)):
+            shape.append((key, "subset", None))
+            values.append(value)
+        elif isinstance(value, either):
+            shape.append((key, "either", None))
+            values.append(value)
+        else:
+            shape.append((key, "equal", None))
+            values.append(value)
+    return tuple(shape)
+
+def _bind_criteria_shape(shape: tuple, values) -> Callable[[Dict[str, Any]], bool]:
+    checks = []
+    for key, kind, sub_shape in shape:
+        if kind == "anything":
+            def check(data, key=key):
+                return key in data
+        elif kind == "dict":
+            sub_match = _bind_criteria_shape(sub_shape, values)
+            def check(data, key=key, sub_match=sub_match):
+                sub_data = data.get(key, _MISSING)
+                return isinstance(sub_data, dict) and sub_match(sub_data)
+        elif kind == "subset":
+            value = next(values)
+            try:
+                value_set = frozenset(value)
+            except TypeError:
+                value_set = None
+            def check(data, key=key, value=value, value_set=value_set):
+                data_value = data.get(key, _MISSING)
+                if data_value is _MISSING:
+                    return False
+                if isinstance(data_value, list):
+                    if value_set is None:
+                        return all(val in data_value for val in value)
+                    return value_set.issubset(data_value)
+                return not data_value != value
+        elif kind == "either":
+            options = tuple(next(values))
+            try:
+                option_set = frozenset(options)
+            except TypeError:
+                option_set = None
+            def check(data, key=key, options=options, option_set=option_set):
+                data_value = data.get(key, _MISSING)
+                if data_value is _MISSING:
+                    return False
+                if option_set is not None:
+                    try:
+                        return data_value in option_set
+                    except TypeError:
+                        pass
+                return data_value in options
+        else:
+            value = next(values)
+            def check(data, key=key, value=value):
+                data_value = data.get(key, _MISSING)
+                return data_value is not _MISSING and not data_value != value
+        checks.append(check)
+
+    if len(checks) == 1:
+        return checks[0]
+    checks = tuple(checks)
+    def match(data):
+        for check in checks:
+            if not check(data):
+                return False
+        return True
+    return match
+
+@lru_cache(maxsize=256)
+def _compile_criteria_shape(shape: tuple) -> Callable[[List[Any]], Callable[[Dict[str, Any]], bool]]:
+    return lambda values: _bind_criteria_shape(shape, iter(values))
+
+def compile_criteria(criteria: Dict[str, Any]) -> Callable[[Dict[str, Any]], bool]:
+    """
+    Compile `criteria` into a predicate on posts.
+
+    The structure of the criteria is resolved once per shape and cached, so
+    that criteria differing only in their values share the compiled form.
+    """
+    values = []
+    shape = _criteria_shape(criteria, values)
+    return _compile_criteria_shape(shape)(values)
+
+class Post:
+    """
+    Compact record of a post, normalized from the API data at ingest.
+
+    Only the fields read by RelayReminder are kept. The props are kept whole
+    for the posts of bot apps, and reduced to POST_PROPS_KEPT for the others.
+    The record can be read like the API dictionary (post['root_id'],
+    post.get('props'), 'type' in post), so criteria apply to it unchanged.
+    """
+    __slots__ = ('id', 'user_id', 'create_at', 'update_at', 'delete_at', 'type', 'root_id', 'priority', 'props')
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self,
+        id: str,
+        user_id: str = '',
+        create_at: int = 0,
+        update_at: int = 0,
+        delete_at: int = 0,
+        type: str = '',
+        root_id: str = '',
+        priority: str = 'standard',
+        props: Optional[Dict] = None,
+    ):
+        self.id = id
+        self.user_id = user_id
+        self.create_at = create_at
+        self.update_at = update_at
+        self.delete_at = delete_at
+        self.type = type
+        self.root_id = root_id
+        self.priority = priority
+        self.props = _NO_PROPS if props is None else props
+
+    @classmethod
+    def from_dict(cls, data: Union[Dict, "Post"]) -> "Post":
+        """
+        Normalize the API data of a post (or the output of to_dict()).
+        """
+        if isinstance(data, Post):
+            return data
+        priority = data.get('priority')
+        if not isinstance(priority, str):
+            priority = ((data.get('metadata') or {}).get('priority') or {}).get('priority', 'standard')
+        props = data.get('props') or _NO_PROPS
+        if 'bot_app' not in props:
+            props = {key: props[key] for key in POST_PROPS_KEPT if key in props} or _NO_PROPS
+        create_at = data['create_at']
+        return cls(
+            data['id'],
+            sys.intern(data.get('user_id') or ''),
+            create_at,
+            data.get('update_at', create_at),
+            data.get('delete_at', 0),
+            sys.intern(data.get('type') or ''),
+            data.get('root_id') or '',
+            sys.intern(priority.lower() or 'standard'),
+            props,
+        )
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __getitem__(self, key: str):
+        if key in Post.FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in Post.FIELDS:
+            return getattr(self, key)
+        return default
+
+    def __contains__(self, key: str) -> bool:
+        return key in Post.FIELDS
+
+    def keys(self):
+        return self.__slots__
+
+    def __repr__(self) -> str:
+        return f"Post({self.to_dict()!r})"
+
+# Props kept for the posts not made by bot apps.
+POST_PROPS_KEPT = ('addedUserId',)
+# Shared by the posts without props; never modified.
+_NO_PROPS = {}
+
+class PostStore:
+    """
+    Local SQLite copy of the fetched channel posts.
+
+    For each channel the store remembers the `since` time its copy covers
+    and the latest `update_at` seen, so that later runs only need to fetch
+    the posts created, edited or deleted after that.
+
+    A channel has two copies, by `include_deleted`: the fetches since a time
+    return the deleted posts, while the paged fetches of the whole history
+    do not, so neither copy can stand for the other.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # The connection is shared by the threads of the channels using the store.
+        self.lock = threading.Lock()
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS posts ("
+                " channel_id TEXT NOT NULL,"
+                " include_deleted INTEGER NOT NULL,"
+                " id TEXT NOT NULL,"
+                " create_at INTEGER NOT NULL,"
+                " update_at INTEGER NOT NULL,"
+                " delete_at INTEGER NOT NULL,"
+                " data TEXT NOT NULL,"
+                " PRIMARY KEY (channel_id, include_deleted, id))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                " channel_id TEXT NOT NULL,"
+                " include_deleted INTEGER NOT NULL,"
+                " since INTEGER NOT NULL,"
+                " synced_at INTEGER NOT NULL,"
+                " PRIMARY KEY (channel_id, include_deleted))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS posts_by_create_at ON posts (channel_id, include_deleted, create_at, id)"
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_sync_state(self, channel_id: str, include_deleted: bool = True) -> Optional[tuple]:
+        """
+        Returns:
+            (since, synced_at) in Unix milliseconds, or None if the copy has never been synced.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT since, synced_at FROM sync_state WHERE channel_id = ? AND include_deleted = ?",
+                (channel_id, include_deleted),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def load_posts(self, channel_id: str, since: int, include_deleted: bool = True) -> Dict[str, Post]:
+        """
+        Load the stored posts modified at or after `since`, newest first.
+        """
+        query = "SELECT data FROM posts WHERE channel_id = ? AND include_deleted = ? AND update_at >= ?"
+        if not include_deleted:
+            query += " AND delete_at = 0"
+        query += " ORDER BY create_at DESC"
+        with self.lock:
+            rows = self.conn.execute(query, (channel_id, include_deleted, since)).fetchall()
+        posts = {}
+        for (data,) in rows:
+            post = Post.from_dict(json.loads(data))
+            posts[post.id] = post
+        return posts
+
+    def iter_posts(self, channel_id: str, since: int, include_deleted: bool = True, chunk_size: int = 1000) -> Iterator[Post]:
+        """
+        Like load_posts(), but read in chunks of `chunk_size` posts, so that
+        the whole channel is never held in memory.
+        """
+        query = "SELECT create_at, id, data FROM posts WHERE channel_id = ? AND include_deleted = ? AND update_at >= ?"
+        if not include_deleted:
+            query += " AND delete_at = 0"
+        last = None
+        while True:
+            if last is None:
+                chunk_query, params = query, (channel_id, include_deleted, since)
+            else:
+                chunk_query = query + " AND (create_at < ? OR (create_at = ? AND id < ?))"
+                params = (channel_id, include_deleted, since, last[0], last[0], last[1])
+            with self.lock:
+                rows = self.conn.execute(
+                    chunk_query + " ORDER BY create_at DESC, id DESC LIMIT ?", params + (chunk_size,)
+                ).fetchall()
+            for _, _, data in rows:
+                yield Post.from_dict(json.loads(data))
+            if len(rows) < chunk_size:
+                return
+            last = rows[-1][:2]
+
+    def clear(self, channel_id: str, include_deleted: bool = True):
+        """Drop the stored posts and the sync state of the copy."""
+        with self.lock, self.conn:
+            for table in ("posts", "sync_state"):
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE channel_id = ? AND include_deleted = ?", (channel_id, include_deleted)
+                )
+
+    def save_posts(self,
+        channel_id: str,
+        posts: List[Dict],
+        since: Optional[int],
+        replace: bool = False,
+        synced_at: Optional[int] = None,
+        include_deleted: bool = True,
+    ):
+        """
+        Upsert `posts` and record the sync state of the copy.
+
+        The sync state must only be recorded once a fetch is complete: the
+        next sync asks the server for the changes after its `synced_at`.
+
+        Args:
+        - since (int): The `since` time (Unix ms) the stored copy now covers.
+          None leaves the sync state as it is, as for posts from websocket
+          events, which do not show that nothing before them was missed.
+        - replace (bool): Drop the previously stored posts of the copy first.
+        - synced_at (int): The latest `update_at` seen by the fetch, if the
+          fetched posts were saved before (e.g. page by page).
+        - include_deleted (bool): The copy, see PostStore.
+        """
+        posts = [Post.from_dict(post) for post in posts]
+        with self.lock, self.conn:
+            if replace:
+                self.conn.execute(
+                    "DELETE FROM posts WHERE channel_id = ? AND include_deleted = ?", (channel_id, include_deleted)
+                )
+            # An older version of a post, e.g. from a fetch which raced with an edit, does not replace a newer one.
+            self.conn.executemany(
+                "INSERT INTO posts (channel_id, include_deleted, id, create_at, update_at, delete_at, data)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (channel_id, include_deleted, id) DO UPDATE SET"
+                " create_at = excluded.create_at, update_at = excluded.update_at,"
+                " delete_at = excluded.delete_at, data = excluded.data"
+                " WHERE excluded.update_at >= posts.update_at",
+                [
+                    (channel_id, include_deleted, post.id, post.create_at, post.update_at, post.delete_at, json.dumps(post.to_dict()))
+                    for post in posts
+                ],
+            )
+            if since is None:
+                return
+            latest_update_at = max([since, synced_at or 0] + [post.update_at for post in posts])
+            if not replace:
+                # The posts complete the changes after the recorded sync.
+                row = self.conn.execute(
+                    "SELECT synced_at FROM sync_state WHERE channel_id = ? AND include_deleted = ?",
+                    (channel_id, include_deleted),
+                ).fetchone()
+                if row:
+                    latest_update_at = max(latest_update_at, row[0])
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state (channel_id, include_deleted, since, synced_at) VALUES (?, ?, ?, ?)",
+                (channel_id, include_deleted, since, latest_update_at),
+            )
+
+# The posts held by a channel (PostMap, PostIndex, ColumnarPosts) and the tables
+# derived from them (StopTable, RecordTable, JoinTable, LastPostTable) are not
+# modified once built: `updated()` returns a new one with the changed posts,
+# sharing what it can, so that readers holding the previous one are not disturbed.
+
+class PostMap(Mapping):
+    """
+    Read-only mapping of post ids to posts, newest first: all_posts and the
+    buckets of PostIndex.
+
+    `updated()` keeps the changes in a layer over the dict of this map,
+    shared rather than copied, and merges them into a new dict once the layer
+    holds about the square root of the posts. A change thus costs O(sqrt(n))
+    amortized instead of a copy and a sort of all the posts.
+    """
+    MIN_LAYER_SIZE = 32
+
+    def __init__(self, posts: Optional[Dict[str, Post]] = None):
+        """
+        Args:
+        - posts (Dict[str, Post]): Newest first. Owned by the map from then on.
+        """
+        self.base = {} if posts is None else posts
+        self.changed = {}  # post_id -> Post, or None if removed, for the posts of base
+        self.added = {}  # post_id -> Post, for the posts not in base
+        self.length = len(self.base)
+        self._added_order = None
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __contains__(self, post_id) -> bool:
+        if post_id in self.added:
+            return True
+        if post_id in self.changed:
+            return self.changed[post_id] is not None
+        return post_id in self.base
+
+    def __getitem__(self, post_id: str) -> Post:
+        if post_id in self.added:
+            return self.added[post_id]
+        if post_id in self.changed:
+            post = self.changed[post_id]
+            if post is None:
+                raise KeyError(post_id)
+            return post
+        return self.base[post_id]
+
+    def __iter__(self) -> Iterator[str]:
+        if not self.changed and not self.added:
+            return iter(self.base)
+        return (post_id for post_id, _ in self._items())
+
+    def items(self):
+        if not self.changed and not self.added:
+            return self.base.items()
+        return super().items()
+
+    def values(self):
+        if not self.changed and not self.added:
+            return self.base.values()
+        return super().values()
+
+    def _items(self) -> Iterator[tuple]:
+        """The (post_id, post) pairs, newest first; on equal create_at, the posts of base first."""
+        if self._added_order is None:
+            self._added_order = sorted(self.added.items(), key=lambda item: item[1].create_at, reverse=True)
+        added = self._added_order
+        newest = next(iter(self.base.values()), None)
+        if not self.changed and (not added or newest is None or added[-1][1].create_at > newest.create_at):
+            # The usual case: only posts newer than all the others were added.
+            yield from added
+            yield from self.base.items()
+            return
+        i, n = 0, len(added)
+        for post_id, post in self.base.items():
+            while i < n and added[i][1].create_at > post.create_at:
+                yield added[i]
+                i += 1
+            if post_id in self.changed:
+                post = self.changed[post_id]
+                if post is None:
+                    continue
+            yield post_id, post
+        yield from added[i:]
+
+    def updated(self, new_posts: Dict[str, Optional[Post]]) -> "PostMap":
+        """
+        Returns a new map with `new_posts` applied.
+        A value of None removes the post.
+        """
+        post_map = PostMap(self.base)
+        post_map.changed = dict(self.changed)
+        post_map.added = dict(self.added)
+        post_map.length = self.length
+        for post_id, post in new_posts.items():
+            if post_id in self.base:
+                if (post_map.changed.get(post_id, self.base[post_id]) is None) != (post is None):
+                    post_map.length += 1 if post is not None else -1
+                post_map.changed[post_id] = post
+            elif post is not None:
+                if post_id not in post_map.added:
+                    post_map.length += 1
+                post_map.added[post_id] = post
+            elif post_map.added.pop(post_id, None) is not None:
+                post_map.length -= 1
+        if len(post_map.changed) + len(post_map.added) > max(self.MIN_LAYER_SIZE, math.isqrt(len(self.base))):
+            return PostMap(dict(post_map._items()))
+        return post_map
+
+class PostIndex:
+    """
+    Secondary indexes over posts, for the fields queried by the reminder.
+
+    Each index maps a field value to the posts having it, as a PostMap.
+    `updated()` returns a new PostIndex sharing the buckets which are not
+    affected, and layering the changes over the ones which are.
+    """
+    PATHS = (
+        ('user_id',),
+        ('type',),
+        ('props', 'bot_app'),
+        ('props', 'type'),
+        ('props', 'last_post_week'),
+        ('props', 'addedUserId'),
+    )
+
+    def __init__(self, posts: Optional[Dict[str, Dict]] = None):
+        self.indexes = {path: {} for path in self.PATHS}
+        for post_id, post in (posts or {}).items():
+            for path, value in self._indexed_values(post):
+                self.indexes[path].setdefault(value, {})[post_id] = post
+        for buckets in self.indexes.values():
+            for value, bucket in buckets.items():
+                buckets[value] = PostMap(bucket)
+
+    @classmethod
+    def _indexed_values(cls, post: Dict):
+        for path in cls.PATHS:
+            data = post
+            for key in path:
+                if not isinstance(data, (dict, Post)) or key not in data:
+                    break
+                data = data[key]
+            else:
+                try:
+                    hash(data)
+                except TypeError:
+                    continue
+                yield path, data
+
+    def updated(self, old_posts: Dict[str, Dict], new_posts: Dict[str, Optional[Dict]]) -> "PostIndex":
+        """
+        Returns a new index with `new_posts` applied.
+        A value of None in `new_posts` removes the post.
+        """
+        changes = {}
+        for post_id, post in new_posts.items():
+            if post_id in old_posts:
+                for path, value in self._indexed_values(old_posts[post_id]):
+                    changes.setdefault((path, value), {})[post_id] = None
+            if post is not None:
+                for path, value in self._indexed_values(post):
+                    changes.setdefault((path, value), {})[post_id] = post
+
+        index = PostIndex()
+        index.indexes = {path: dict(buckets) for path, buckets in self.indexes.items()}
+        for (path, value), bucket_changes in changes.items():
+            buckets = index.indexes[path]
+            bucket = buckets.get(value, PostMap()).updated(bucket_changes)
+            if bucket:
+                buckets[value] = bucket
+            else:
+                buckets.pop(value, None)
+        return index
+
+    def candidates(self, criteria: Dict[str, Any]) -> Optional[List[Dict]]:
+        """
+        Returns the posts which may match `criteria`, taken from the smallest
+        usable index, or None if no index can narrow down the query.
+        """
+        best = None
+        for path, value in self._criteria_values(criteria):
+            buckets = self.indexes[path]
+            values = value.values if isinstance(value, either) else (value,)
+            try:
+                matched = [buckets.get(v, {}) for v in values]
+            except TypeError:
+                continue
+            size = sum(len(posts) for posts in matched)
+            if best is None or size < best[0]:
+                best = (size, matched)
+        if best is None:
+            return None
+        if len(best[1]) == 1:
+            return list(best[1][0].values())
+        posts = {}
+        for matched in best[1]:
+            posts.update(matched)
+        return list(posts.values())
+
+    def _criteria_values(self, criteria: Dict[str, Any], prefix: tuple = ()):
+        for key, value in criteria.items():
+            path = prefix + (key,)
+            if isinstance(value, dict):
+                yield from self._criteria_values(value, path)
+            elif path in self.indexes and value is not Anything and not isinstance(value, (set, list)):
+                yield path, value
+
+class ColumnarPosts:
+    """
+    Posts held as parallel NumPy arrays, for vectorized reductions over long histories.
+
+    Strings (user ids, priorities and post types) are interned into integer codes.
+    """
+    ARRAYS = (
+        ("create_at", "<i8"),
+        ("delete_at", "<i8"),
+        ("user", "<i4"),
+        ("priority", "<i2"),
+        ("is_thread_head", "|b1"),
+        ("type", "<i2"),
+    )
+    # The type code of the rows of removed posts, which no view_mask() selects.
+    REMOVED_TYPE = -1
+
+    def __init__(self, posts: Dict[str, Post]):
+        self.user_codes = {}
+        self.priority_codes = {}
+        self.type_codes = {'': 0}
+        self.rows = {}  # post_id -> row
+        self.removed = 0
+        self.length = 0
+        self._allocate(len(posts))
+        self._append(posts.values())
+
+    def __len__(self) -> int:
+        """Number of the posts, not counting the rows of removed ones."""
+        return self.length - self.removed
+
+    def _allocate(self, capacity: int):
+        """Own new arrays of `capacity` rows, holding the current ones."""
+        arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.ARRAYS}
+        for name, _ in self.ARRAYS:
+            arrays[name][:self.length] = getattr(self, name, arrays[name])[:self.length]
+        self._arrays = arrays
+        # Rows used in the arrays, shared by the ColumnarPosts over them.
+        self._used = [self.length]
+
+    def _set_length(self, length: int):
+        self.length = self._used[0] = length
+        for name, _ in self.ARRAYS:
+            setattr(self, name, self._arrays[name][:length])
+
+    def _row_values(self, post: Post) -> tuple:
+        return (
+            post.create_at,
+            post.delete_at,
+            self.user_codes.setdefault(post.user_id, len(self.user_codes)),
+            self.priority_codes.setdefault(post.priority, len(self.priority_codes)),
+            not post.root_id,
+            self.type_codes.setdefault(post.type, len(self.type_codes)),
+        )
+
+    def _write_row(self, row: int, values: tuple):
+        for (name, _), value in zip(self.ARRAYS, values):
+            self._arrays[name][row] = value
+
+    def _append(self, posts: Iterable[Post]):
+        length = self.length
+        for post in posts:
+            self.rows[post.id] = length
+            self._write_row(length, self._row_values(post))
+            length += 1
+        self._set_length(length)
+
+    def updated(self, new_posts: Dict[str, Optional[Post]]) -> "ColumnarPosts":
+        """
+        Returns new arrays with `new_posts` applied. A value of None removes
+        the post; its row stays, with REMOVED_TYPE.
+
+        The new posts are appended past the rows of this one, in the spare
+        capacity of the arrays shared with it. The arrays are copied only when
+        they are full, or when a row of this one changes. The codes and `rows`
+        only grow, and are shared.
+        """
+        columnar = ColumnarPosts.__new__(ColumnarPosts)
+        columnar.__dict__.update(self.__dict__)
+        changed_rows, appended = {}, []
+        for post_id, post in new_posts.items():
+            row = self.rows.get(post_id)
+            if row is not None and row < self.length:
+                values = self._row_values(post) if post is not None else \
+                    tuple(self._arrays[name][row].item() for name, _ in self.ARRAYS[:-1]) + (self.REMOVED_TYPE,)
+                if values != tuple(self._arrays[name][row].item() for name, _ in self.ARRAYS):
+                    changed_rows[row] = values
+            elif post is not None:
+                appended.append(post)
+
+        length = self.length + len(appended)
+        if changed_rows or self._used[0] != self.length or length > len(self._arrays["create_at"]):
+            if self._used[0] != self.length:
+                # Another ColumnarPosts appended to the shared arrays.
+                columnar.rows = {post_id: row for post_id, row in self.rows.items() if row < self.length}
+            columnar._allocate(max(length, 2 * self.length, 16))
+        for row, values in changed_rows.items():
+            columnar.removed += int(values[-1] == self.REMOVED_TYPE) - int(self.type[row] == self.REMOVED_TYPE)
+            columnar._write_row(row, values)
+        columnar._append(appended)
+        return columnar
+
+    def codes(self) -> Dict[str, Dict[str, int]]:
+        return {"user": self.user_codes, "priority": self.priority_codes, "type": self.type_codes}
+
+    @classmethod
+    def array_offsets(cls, length: int) -> List[int]:
+        """Offsets of the arrays written by write_arrays(), each aligned to 8 bytes."""
+        offsets, offset = [], 0
+        for _, dtype in cls.ARRAYS:
+            offset += -offset % 8
+            offsets.append(offset)
+            offset += length * np.dtype(dtype).itemsize
+        return offsets
+
+    def write_arrays(self, file):
+        """Write the arrays to `file`, from an 8-byte aligned position, as laid out by array_offsets()."""
+        offset = 0
+        live = self.type != self.REMOVED_TYPE if self.removed else slice(None)
+        for (name, dtype), array_offset in zip(self.ARRAYS, self.array_offsets(len(self))):
+            file.write(b"\0" * (array_offset - offset))
+            data = np.ascontiguousarray(getattr(self, name)[live], dtype=dtype)
+            file.write(data)
+            offset = array_offset + data.nbytes
+
+    @classmethod
+    def from_buffer(cls, buffer, start: int, length: int, codes: Dict[str, Dict[str, int]]) -> "ColumnarPosts":
+        """
+        Posts written by write_arrays() at `start` of `buffer` (e.g. a memory map),
+        without a copy: the arrays are read-only views of the buffer.
+        """
+        columnar = cls.__new__(cls)
+        columnar.user_codes, columnar.priority_codes, columnar.type_codes = codes["user"], codes["priority"], codes["type"]
+        # Read-only: no updated().
+        columnar.rows, columnar.removed, columnar.length = None, 0, length
+        for (name, dtype), offset in zip(cls.ARRAYS, cls.array_offsets(length)):
+            setattr(columnar, name, np.frombuffer(buffer, dtype=dtype, count=length, offset=start + offset))
+        return columnar
+
+    def view_mask(self,
+        priority_filter: Optional[str] = None,
+        is_thread_head: Optional[bool] = None,
+        ignore_deleted_posts: Optional[bool] = True,
+    ) -> "np.ndarray":
+        """
+        Mask of the non-system posts matching the filter of get_last_post_datetimes().
+        """
+        mask = self.type == self.type_codes['']
+        if ignore_deleted_posts:
+            mask &= self.delete_at == 0
+        if priority_filter:
+            mask &= self.priority == self.priority_codes.get(priority_filter.lower(), -1)
+        if is_thread_head is not None:
+            mask &= self.is_thread_head == is_thread_head
+        return mask
+
+    def last_create_at_by_user(self, mask: "np.ndarray", user_ids: List[str]) -> Dict[str, int]:
+        """
+        Latest create_at (Unix ms) of the masked posts for each user in `user_ids` having any.
+        """
+        last_create_at = np.full(len(self.user_codes), -1, dtype=np.int64)
+        np.maximum.at(last_create_at, self.user[mask], self.create_at[mask])
+        result = {}
+        for user_id in user_ids:
+            code = self.user_codes.get(user_id)
+            if code is not None and last_create_at[code] >= 0:
+                result[user_id] = int(last_create_at[code])
+        return result
+
+class PostDigest:
+    """
+    Reduction of a stream of posts to the ones deciding the reminder results.
+
+    For each user it keeps the latest post of each view in LAST_POST_VIEWS,
+    the earliest join message of each kind and the latest record posts; for
+    each week, the latest record post of the app, the one with the most
+    passed weeks and its thread root; and the latest relaystop post. On the
+    kept posts, the queries of MattermostChannel for these give the same
+    results as on all the posts, while the memory is bounded by the number
+    of users and weeks rather than of posts.
+    """
+    def __init__(self, app_name: Optional[str] = None, views: Optional[Dict[str, Dict]] = None):
+        self.app_name = app_name
+        self.views = [LastPostTable.view_filter(view) for view in (LAST_POST_VIEWS if views is None else views).values()]
+        self.kept = {}
+        self.thread_roots = {}
+        self.root_ids = set()
+        self.oldest_create_at = None
+        self.latest_update_at = 0
+        self.count = 0
+
+    def _keep(self, key: tuple, post: Post, rank: Any):
+        current = self.kept.get(key)
+        if current is None or rank > current[0]:
+            self.kept[key] = (rank, post)
+
+    def add(self, post: Post):
+        self.count += 1
+        if self.oldest_create_at is None or post.create_at < self.oldest_create_at:
+            self.oldest_create_at = post.create_at
+        if post.update_at > self.latest_update_at:
+            self.latest_update_at = post.update_at
+        if post.id in self.root_ids:
+            self.thread_roots[post.id] = post
+
+        if post.type == '':
+            for i, view_filter in enumerate(self.views):
+                if LastPostTable.matches(post, view_filter):
+                    self._keep(("view", i, post.user_id), post, post.create_at)
+        elif post.type == "system_join_channel":
+            self._keep(("join", post.type, post.user_id), post, -post.create_at)
+        elif post.type == "system_add_to_channel":
+            self._keep(("join", post.type, post.props.get("addedUserId")), post, -post.create_at)
+
+        props = post.props
+        if "bot_app" not in props:
+            return
+        is_app = props["bot_app"] == self.app_name
+        if props.get("type") == "record":
+            users = props.get("users")
+            if isinstance(users, list):
+                for user_id in users:
+                    self._keep(("record", user_id), post, post.create_at)
+                    if is_app:
+                        self._keep(("app_record", user_id), post, post.create_at)
+            week = props.get("last_post_week")
+            if is_app and week is not None:
+                self._keep(("week", week), post, post.create_at)
+                self._keep(("week_passed", week), post, props.get("passed_weeks", -1))
+                if post.root_id:
+                    self.root_ids.add(post.root_id)
+        elif props.get("type") == "relaystop" and "data" in props:
+            self._keep(("relaystop",), post, post.create_at)
+
+    def consume(self, posts: Iterable[Post]) -> "PostDigest":
+        for post in posts:
+            self.add(post)
+        return self
+
+    def posts(self) -> Dict[str, Post]:
+        """The kept posts, newest first."""
+        posts = {post.id: post for _, post in self.kept.values()}
+        posts.update(self.thread_roots)
+        return {post_id: posts[post_id] for post_id in sorted(posts, key=lambda post_id: posts[post_id].create_at, reverse=True)}
+
+class StopTable:
+    """
+    The admin stop table: the data of the latest 'relaystop' post, of each app
+    and of any app, with the until-dates parsed once per post.
+
+    `updated()` rescans the relaystop posts only when the latest one of an
+    app was edited or removed.
+    """
+    CRITERIA = {"props": {"bot_app": Anything, "type": "relaystop", "data": Anything}}
+
+    def __init__(self, stop_posts: Iterable[Post] = (), week_shift_hours: int = 0):
+        self.week_shift_hours = week_shift_hours
+        self.latest = {}
+        for post in stop_posts:
+            self._add(post)
+        self._untils = {}
+
+    @staticmethod
+    def is_stop_post(post: Post) -> bool:
+        props = post.props
+        return props.get("type") == "relaystop" and "data" in props and "bot_app" in props
+
+    def _add(self, post: Post):
+        if not self.is_stop_post(post):
+            return
+        app = post.props["bot_app"]
+        current = self.latest.get(app)
+        # On equal create_at the later one wins, as in the ascending sort of filter_posts_by_criteria.
+        if current is None or post.create_at >= current.create_at:
+            self.latest[app] = post
+
+    def updated(self, new_posts: Dict[str, Optional[Post]], stop_posts: Callable[[], Iterable[Post]]) -> "StopTable":
+        """
+        Returns a new table with `new_posts` applied. A value of None removes
+        the post. `stop_posts()` gives all the relaystop posts after the change,
+        for when the table has to be rebuilt.
+        """
+        latest_ids = {post.id for post in self.latest.values()}
+        if latest_ids.intersection(new_posts):
+            return StopTable(stop_posts(), self.week_shift_hours)
+        table = StopTable(week_shift_hours=self.week_shift_hours)
+        table.latest = dict(self.latest)
+        for post in new_posts.values():
+            if post is not None:
+                table._add(post)
+        # The parsed dates of the unchanged posts are still valid.
+        table._untils = {post_id: untils for post_id, untils in self._untils.items() if post_id in latest_ids}
+        return table
+
+    def latest_post(self, app_name: Optional[str] = None) -> Optional[Post]:
+        """The latest relaystop post of `app_name`, or of any app if None."""
+        if app_name:
+            return self.latest.get(app_name)
+        return max(self.latest.values(), key=lambda post: post.create_at, default=None)
+
+    def data(self, app_name: Optional[str] = None) -> Dict[str, str]:
+        """The stop table, user_id: until date string."""
+        post = self.latest_post(app_name)
+        return post.props["data"] if post is not None else {}
+
+    def untils(self, app_name: Optional[str] = None) -> Dict[str, datetime]:
+        """The stop table with the until dates parsed, shifted by week_shift_hours."""
+        post = self.latest_post(app_name)
+        if post is None:
+            return {}
+        untils = self._untils.get(post.id)
+        if untils is None:
+            untils = {}
+            data = post.props["data"]
+            for user_id, until in (data.items() if isinstance(data, dict) else ()):
+                try:
+                    until_date = parser.parse(until)
+                except (TypeError, ValueError, OverflowError) as e:
+                    warnings.warn(f"Ignored the invalid stop date '{until}' of user {user_id}: {e}")
+                    continue
+                untils[user_id] = datetime(until_date.year, until_date.month, until_date.day) + timedelta(hours=self.week_shift_hours)
+            self._untils[post.id] = untils
+        return untils
+
+class RecordTable:
+    """
+    Views of the 'record' posts of the bots, for each app:
+    - users: user_id -> the latest record post listing the user,
+    - weeks: last_post_week -> the record posts of the week (ascending
+      create_at) and the maximum passed_weeks among them.
+
+    `updated()` adds the new record posts to copies of the affected views,
+    and rebuilds the table only when an existing record post was edited or
+    removed.
+    """
+    CRITERIA = {"props": {"bot_app": Anything, "type": "record"}}
+
+    def __init__(self, record_posts: Iterable[Post] = ()):
+        self.users = {}
+        self.weeks = {}
+        self.passed_weeks = {}
+        self._any_app_users = None
+        copied = set()
+        for post in sorted(record_posts, key=lambda post: post.create_at):
+            self._add(post, copied)
+
+    @staticmethod
+    def is_record_post(post: Post) -> bool:
+        props = post.props
+        return props.get("type") == "record" and "bot_app" in props
+
+    @staticmethod
+    def _own(outer: Dict, key: Any, copied: set, path: tuple, factory: Callable = dict):
+        """outer[key], copied once from the table this one was derived from."""
+        if path not in copied:
+            outer[key] = factory(outer.get(key, ()))
+            copied.add(path)
+        return outer[key]
+
+    def _add(self, post: Post, copied: set):
+        if not self.is_record_post(post):
+            return
+        props = post.props
+        app, week = props["bot_app"], props.get("last_post_week")
+        try:
+            hash(app), hash(week)
+        except TypeError:
+            return
+        if week is None:
+            return
+
+        if isinstance(props.get("users"), list):
+            latest = self._own(self.users, app, copied, ("users", app))
+            for user_id in props["users"]:
+                current = latest.get(user_id)
+                # On equal create_at the later one wins, as in the ascending sort of filter_posts_by_criteria.
+                if current is None or post.create_at >= current.create_at:
+                    latest[user_id] = post
+
+        weeks = self._own(self.weeks, app, copied, ("weeks", app))
+        posts = self._own(weeks, week, copied, ("weeks", app, week), list)
+        if posts and post.create_at < posts[-1].create_at:
+            posts.insert(bisect_right([p.create_at for p in posts], post.create_at), post)
+        else:
+            posts.append(post)
+        passed_weeks = props.get("passed_weeks", -1)
+        passed = self._own(self.passed_weeks, app, copied, ("passed_weeks", app))
+        try:
+            if passed_weeks > passed.get(week, -1):
+                passed[week] = passed_weeks
+        except TypeError:
+            pass
+
+    def updated(self, old_posts: Dict[str, Post], new_posts: Dict[str, Optional[Post]], record_posts: Callable[[], Iterable[Post]]) -> "RecordTable":
+        """
+        Returns a new table with `new_posts` applied. A value of None removes
+        the post. `record_posts()` gives all the record posts after the change,
+        for when the table has to be rebuilt.
+        """
+        if any(post_id in old_posts and self.is_record_post(old_posts[post_id]) for post_id in new_posts):
+            return RecordTable(record_posts())
+        table = RecordTable()
+        table.users, table.weeks, table.passed_weeks = dict(self.users), dict(self.weeks), dict(self.passed_weeks)
+        copied = set()
+        for post in sorted((post for post in new_posts.values() if post is not None), key=lambda post: post.create_at):
+            table._add(post, copied)
+        return table
+
+    def user_posts(self, app_name: Optional[str] = None) -> Dict[str, Post]:
+        """user_id -> the latest record post of `app_name` (or of any app if None) listing the user."""
+        if app_name:
+            return self.users.get(app_name, {})
+        if self._any_app_users is None:
+            any_app_users = {}
+            for users in self.users.values():
+                for user_id, post in users.items():
+                    current = any_app_users.get(user_id)
+                    if current is None or post.create_at > current.create_at:
+                        any_app_users[user_id] = post
+            self._any_app_users = any_app_users
+        return self._any_app_users
+
+    def week_posts(self, week: int, app_name: str) -> List[Post]:
+        """The record posts of `app_name` for `week`, in ascending create_at."""
+        return list(self.weeks.get(app_name, {}).get(week, ()))
+
+    def max_passed_weeks(self, week: int, app_name: str) -> int:
+        """The maximum passed_weeks of the record posts of `app_name` for `week`, or -1."""
+        return self.passed_weeks.get(app_name, {}).get(week, -1)
+
+class JoinTable:
+    """
+    The time each user joined the channel (milliseconds): for each of
+    'system_join_channel' and 'system_add_to_channel', the earliest message
+    about the user, and the later of the two.
+
+    `updated()` rebuilds the table only when an existing join message was
+    edited or removed.
+    """
+    JOIN_TYPES = ("system_join_channel", "system_add_to_channel")
+
+    def __init__(self, join_posts: Iterable[Post] = ()):
+        self.first_joins = {join_type: {} for join_type in self.JOIN_TYPES}
+        self.join_times = {}
+        for post in join_posts:
+            self._add(post)
+
+    @classmethod
+    def joined_user_id(cls, post: Post) -> Optional[str]:
+        if post.type == "system_join_channel":
+            return post.user_id
+        return post.props.get("addedUserId")
+
+    def _add(self, post: Post):
+        if post.type not in self.first_joins:
+            return
+        user_id = self.joined_user_id(post)
+        first_join = self.first_joins[post.type]
+        if user_id in first_join and first_join[user_id] <= post.create_at:
+            return
+        first_join[user_id] = post.create_at
+        self.join_times[user_id] = max(joins.get(user_id, 0) for joins in self.first_joins.values())
+
+    def updated(self, old_posts: Dict[str, Post], new_posts: Dict[str, Optional[Post]], join_posts: Callable[[], Iterable[Post]]) -> "JoinTable":
+        """
+        Returns a new table with `new_posts` applied. A value of None removes
+        the post. `join_posts()` gives all the join messages after the change,
+        for when the table has to be rebuilt.
+        """
+        if any(post_id in old_posts and old_posts[post_id].type in self.first_joins for post_id in new_posts):
+            return JoinTable(join_posts())
+        join_posts = [post for post in new_posts.values() if post is not None and post.type in self.first_joins]
+        if not join_posts:
+            return self
+        table = JoinTable()
+        table.first_joins = {join_type: dict(first_join) for join_type, first_join in self.first_joins.items()}
+        table.join_times = dict(self.join_times)
+        for post in join_posts:
+            table._add(post)
+        return table
+
+class LastPostTable:
+    """
+    The latest post of each user in each view of LAST_POST_VIEWS, as
+    (create_at, post_id), for get_last_post_datetimes() to look up instead
+    of scanning the posts of the users.
+
+    `updated()` only compares the new posts with the latest ones. The posts
+    of a user are rescanned when their latest post of a view was removed or
+    no longer matches the view, e.g. was deleted.
+    """
+    def __init__(self, posts: Iterable[Post] = (), views: Optional[Dict[str, Dict]] = None):
+        self.latest = {self.view_filter(view): {} for view in (LAST_POST_VIEWS if views is None else views).values()}
+        for post in posts:
+            for view_filter, users in self.latest.items():
+                if self.matches(post, view_filter):
+                    current = users.get(post.user_id)
+                    if current is None or post.create_at > current[0]:
+                        users[post.user_id] = (post.create_at, post.id)
+
+    @classmethod
+    def from_columnar(cls, columnar_posts: ColumnarPosts, views: Optional[Dict[str, Dict]] = None) -> "LastPostTable":
+        """The table of the posts of `columnar_posts`, without their ids."""
+        table = cls(views=views)
+        user_ids = list(columnar_posts.user_codes)
+        for view_filter in table.latest:
+            mask = columnar_posts.view_mask(*view_filter)
+            table.latest[view_filter] = {
+                user_id: (create_at, None)
+                for user_id, create_at in columnar_posts.last_create_at_by_user(mask, user_ids).items()
+            }
+        return table
+
+    @staticmethod
+    def view_filter(view: Dict[str, Any]) -> tuple:
+        """(priority_filter, is_thread_head, ignore_deleted_posts) of a view of get_last_post_datetimes()."""
+        priority_filter = view.get("priority_filter")
+        return (
+            priority_filter.lower() if priority_filter else None,
+            view.get("is_thread_head"),
+            view.get("ignore_deleted_posts", True),
+        )
+
+    @staticmethod
+    def matches(post: Post, view_filter: tuple) -> bool:
+        """Whether `post` counts as a post of its user in the view. System posts never do."""
+        priority_filter, is_thread_head, ignore_deleted_posts = view_filter
+        return post.type == '' and not (ignore_deleted_posts and post.delete_at) and \
+            (priority_filter is None or post.priority == priority_filter) and \
+            (is_thread_head is None or bool(post.root_id) != is_thread_head)
+
+    def updated(self, old_posts: Dict[str, Post], new_posts: Dict[str, Optional[Post]], user_posts: Callable[[str], Iterable[Post]]) -> "LastPostTable":
+        """
+        Returns a new table with `new_posts` applied. A value of None removes
+        the post. `user_posts(user_id)` gives the posts of a user after the
+        change, for when their latest post has to be looked for again.
+        """
+        table = LastPostTable.__new__(LastPostTable)
+        table.latest = dict(self.latest)
+        copied, rescanned = set(), set()
+        for post_id, post in new_posts.items():
+            user_post = post if post is not None else old_posts.get(post_id)
+            if user_post is None:
+                continue
+            user_id = user_post.user_id
+            for view_filter in self.latest:
+                users = table.latest[view_filter]
+                current = users.get(user_id)
+                if post is not None and self.matches(post, view_filter):
+                    if current is None or post.create_at > current[0]:
+                        if view_filter not in copied:
+                            users = table.latest[view_filter] = dict(users)
+                            copied.add(view_filter)
+                        users[user_id] = (post.create_at, post_id)
+                elif current is not None and current[1] == post_id:
+                    rescanned.add((view_filter, user_id))
+
+        for view_filter, user_id in rescanned:
+            if view_filter not in copied:
+                table.latest[view_filter] = dict(table.latest[view_filter])
+                copied.add(view_filter)
+            users = table.latest[view_filter]
+            users.pop(user_id, None)
+            for post in user_posts(user_id):
+                if self.matches(post, view_filter) and (user_id not in users or post.create_at > users[user_id][0]):
+                    users[user_id] = (post.create_at, post.id)
+        return table
+
+class UserCache(dict):
+    """
+    User profiles by id, which may be shared by the channels of the same server.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+
+class Metrics:
+    """
+    Counters, gauges and histograms of this process, rendered in the
+    Prometheus text exposition format by `render()`.
+
+    Each gunicorn worker has its own; a scrape of /metrics sees the worker
+    which happened to serve it.
+    """
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        self.values = {}
+
+    def describe(self, name: str, metric_type: str, help_text: str):
+        self.descriptions[name] = (metric_type, help_text)
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name: str, labels: Dict[str, str], value: float):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, labels: Dict[str, str], value: float):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                # Counts per bucket (not cumulative), then +Inf, sum and count.
+                histogram = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            histogram[bisect_left(self.buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @staticmethod
+    def _format_labels(labels: tuple) -> str:
+        if not labels:
+            return ""
+        escaped = (
+            f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+            for key, value in labels
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self) -> str:
+        with self.lock:
+            values = {key: list(value) if isinstance(value, list) else value for key, value in self.values.items()}
+        lines = []
+        for name, (metric_type, help_text) in sorted(self.descriptions.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (key_name, labels), value in sorted(values.items(), key=lambda item: item[0]):
+                if key_name != name:
+                    continue
+                if metric_type != "histogram":
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for le, count in zip([str(b) for b in self.buckets] + ["+Inf"], value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+METRICS.describe("relayreminder_http_request_duration_seconds", "histogram", "Latency of the slash-command server by route.")
+METRICS.describe("relayreminder_mattermost_request_duration_seconds", "histogram", "Duration of the Mattermost API requests by endpoint, until the response headers.")
+METRICS.describe("relayreminder_function_duration_seconds", "histogram", "Time spent in the post fetching and scanning methods.")
+METRICS.describe("relayreminder_posts_loaded", "gauge", "Number of posts held by the channel snapshots.")
+METRICS.describe("relayreminder_deferred_responses_total", "counter", "Slash-commands acknowledged first, with the response sent to their response_url.")
+
+def timed(func: Callable) -> Callable:
+    """Record the duration of each call of `func` in relayreminder_function_duration_seconds."""
+    labels = {"function": func.__name__}
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                METRICS.observe("relayreminder_function_duration_seconds", labels, time.perf_counter() - start)
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            METRICS.observe("relayreminder_function_duration_seconds", labels, time.perf_counter() - start)
+    return wrapper
+
+MATTERMOST_ID_PATTERN = re.compile(r"/[a-z0-9]{26}(?=/|$)")
+
+def instrument_driver(mm_driver: Union[Driver, AsyncDriver]) -> Union[Driver, AsyncDriver]:
+    """
+    Record the requests of the driver in relayreminder_mattermost_request_duration_seconds.
+    Ids in the paths are replaced by '{id}', so that an endpoint is one series.
+    """
+    def on_request(request: httpx.Request):
+        request.extensions["relayreminder_start"] = time.perf_counter()
+
+    def on_response(response: httpx.Response):
+        request = response.request
+        start = request.extensions.get("relayreminder_start")
+        if start is not None:
+            METRICS.observe("relayreminder_mattermost_request_duration_seconds", {
+                "method": request.method,
+                "endpoint": MATTERMOST_ID_PATTERN.sub("/{id}", request.url.path),
+                "status": str(response.status_code),
+            }, time.perf_counter() - start)
+
+    http_client = mm_driver.client.client
+    if isinstance(http_client, httpx.AsyncClient):
+        async def on_request_async(request):
+            on_request(request)
+
+        async def on_response_async(response):
+            on_response(response)
+        http_client.event_hooks = {"request": [on_request_async], "response": [on_response_async]}
+    else:
+        http_client.event_hooks = {"request": [on_request], "response": [on_response]}
+    return mm_driver
+
+REQUEST_PRIORITY = contextvars.ContextVar("relayreminder_request_priority", default=BACKGROUND)
+
+def propagate_context(func: Callable) -> Callable:
+    """
+    Wrap `func` to run in the context of the caller, e.g. its REQUEST_PRIORITY,
+    when it is called from worker threads.
+    """
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(func, *args)
+
+class RateLimiter:
+    """
+    Token bucket shared by the Mattermost requests of this process.
+
+    It is unlimited until the server reports its limit by the X-RateLimit-*
+    headers (Limit: bucket size, Remaining, Reset: seconds until full), or
+    rejects a request with 429. A rejected request waits for Retry-After,
+    doubled for each successive rejection, and is sent again.
+
+    A share of the bucket (`interactive_reserve`) is only used by INTERACTIVE
+    requests, so that slash-commands are not queued behind background syncs.
+    """
+    def __init__(self, interactive_reserve: float = 0.2, max_retries: int = 5, max_backoff: float = 60):
+        self.interactive_reserve = interactive_reserve
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.capacity = None # Unlimited until known
+        self.rate = None # Tokens per second
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.rejections = 0
+
+    def _refill(self, now: float):
+        if self.capacity is not None and self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _try_acquire(self, priority: int) -> float:
+        """
+        Take a token if `priority` may. Returns 0 if taken, or the seconds to wait before trying again.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.capacity is None:
+                return 0.0
+            self._refill(now)
+            floor = 0.0 if priority == INTERACTIVE else self.capacity * self.interactive_reserve
+            if self.tokens - 1 >= floor:
+                self.tokens -= 1
+                return 0.0
+            if not self.rate:
+                # Nothing would refill the bucket: send, and let the response tell the state.
+                return 0.0
+            return (floor + 1 - self.tokens) / self.rate
+
+    def acquire(self, priority: int):
+        while True:
+            wait = self._try_acquire(priority)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, priority: int):
+        while True:
+            wait = self._try_acquire(priority)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def update(self, status_code: int, headers: httpx.Headers):
+        """
+        Follow the rate-limit headers of a response.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            try:
+                limit = int(headers["X-RateLimit-Limit"])
+                remaining = int(headers["X-RateLimit-Remaining"])
+                reset = float(headers.get("X-RateLimit-Reset", 0))
+            except (KeyError, ValueError):
+                limit = None
+            if limit:
+                # The server's count is authoritative, whether lower (other clients
+                # share it) or higher (refilled while the rate was unknown).
+                self.capacity = limit
+                self.tokens = float(min(remaining, limit))
+                if reset > 0 and remaining < limit:
+                    # Reset is rounded up to seconds, so each estimate is a lower bound of the rate.
+                    self.rate = max(self.rate or 0.0, (limit - remaining) / reset)
+
+            if status_code == 429:
+                try:
+                    retry_after = float(headers.get("Retry-After", 1))
+                except ValueError:
+                    retry_after = 1.0
+                backoff = min(self.max_backoff, max(retry_after, 0.5) * 2 ** self.rejections)
+                self.rejections += 1
+                self.blocked_until = max(self.blocked_until, now + backoff)
+                if self.capacity is None:
+                    # Limited without headers: start from a guess and follow the rejections.
+                    self.capacity, self.rate, self.tokens = 1, 1 / backoff, 0.0
+            else:
+                self.rejections = 0
+
+RATE_LIMITER = RateLimiter()
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """Sends the requests of a driver through RATE_LIMITER, retrying the ones rejected with 429."""
+    def __init__(self, transport: httpx.BaseTransport, limiter: RateLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(self.limiter.max_retries + 1):
+            self.limiter.acquire(REQUEST_PRIORITY.get())
+            response = self.transport.handle_request(request)
+            self.limiter.update(response.status_code, response.headers)
+            if response.status_code != 429 or attempt == self.limiter.max_retries:
+                return response
+            response.close()
+
+    def close(self):
+        self.transport.close()
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """Coroutine version of RateLimitedTransport."""
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: RateLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        for attempt in range(self.limiter.max_retries + 1):
+            await self.limiter.acquire_async(REQUEST_PRIORITY.get())
+            response = await self.transport.handle_async_request(request)
+            self.limiter.update(response.status_code, response.headers)
+            if response.status_code != 429 or attempt == self.limiter.max_retries:
+                return response
+            await response.aclose()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+def _rate_limited_client_options(options: Dict, transport_cls: type, wrap: type, limiter: RateLimiter) -> Dict:
+    """
+    Arguments of the httpx client of a driver client, with its transports wrapped by `wrap`.
+    """
+    transport_options = {"http2": options.get("http2", False), "verify": options.get("verify", True)}
+    mounts = None
+    if options.get("proxy"):
+        mounts = {"all://": wrap(transport_cls(proxy=options["proxy"], **transport_options), limiter)}
+    return {"transport": wrap(transport_cls(**transport_options), limiter), "mounts": mounts}
+
+class RateLimitedClient(Client):
+    """
+    Client of Driver sending its requests through `limiter` (see RateLimitedTransport).
+    Give it to the driver as its `client_cls`.
+    """
+    limiter = RATE_LIMITER
+
+    def __init__(self, options):
+        # The httpx client of Client is replaced, so only the base is initialized.
+        super(Client, self).__init__(options)
+        self.client = httpx.Client(**_rate_limited_client_options(options, httpx.HTTPTransport, RateLimitedTransport, self.limiter))
+
+class RateLimitedAsyncClient(AsyncClient):
+    """Client of AsyncDriver sending its requests through `limiter`."""
+    limiter = RATE_LIMITER
+
+    def __init__(self, options):
+        super(AsyncClient, self).__init__(options)
+        self.client = httpx.AsyncClient(**_rate_limited_client_options(options, httpx.AsyncHTTPTransport, AsyncRateLimitedTransport, self.limiter))
+
+def new_driver(driver_params: Dict, driver_cls: type = Driver) -> Union[Driver, AsyncDriver]:
+    """A driver of `driver_cls` with the metrics and the rate limiting of this module."""
+    client_cls = RateLimitedAsyncClient if issubclass(driver_cls, AsyncDriver) else RateLimitedClient
+    return instrument_driver(driver_cls(MattermostChannel._driver_options(driver_params), client_cls))
+
 class MattermostChannel:
     def __init__(self,
         driver_params: Dict,
@@ -52,42 +1532,252 @@ class MattermostChannel:
         after_weeksago: Optional[int] = None,
         stdout_mode: bool = False,
         week_shift_hours: int = 0,
+        post_store: Optional[PostStore] = None,
+        columnar: bool = False,
+        fetch_workers: int = 4,
+        follow_workers: int = 8,
+        mm_driver: Optional[Driver] = None,
+        user_cache: Optional[UserCache] = None,
+        post_digest: Optional[PostDigest] = None,
     ):
-        self.mm_driver = Driver(driver_params)
-        self.mm_driver.login()
-        self.headers = {
-            "Authorization": "Bearer {}".format(driver_params["token"]),
-            "Content-Type": "application/json",
-        }
-        self.base_url = driver_params.get("scheme","https") + "://" + driver_params["url"] + ":" + str(driver_params.get("port", 433)) + "/api/v4/"
-
-        if after_weeksago is None:
-            self.after_time = ANCIENT
+        self._configure(
+            team_name, channel_name, channel_id, after_weeksago, stdout_mode,
+            week_shift_hours, post_store, columnar, fetch_workers, follow_workers, user_cache,
+        )
+        # With a digest, only the posts deciding the reminder results are kept (see PostDigest).
+        self.post_digest = post_digest
+        # A given driver is logged in and shared with other channels; it is not logged out here.
+        self._owns_driver = mm_driver is None
+        if self._owns_driver:
+            self.mm_driver = new_driver(driver_params)
+            self.mm_driver.login()
         else:
-            self.after_time = self.get_start_of_week_n_weeks_ago(after_weeksago)
+            self.mm_driver = mm_driver
 
-        if channel_id:
-            self.channel_id = channel_id
-        else:
-            self.team_name = team_name
-            self.channel_name = channel_name
+        if not self.channel_id:
             self.channel_id = self._get_channel_id()
         self.team_id = self.mm_driver.channels.get_channel(self.channel_id)["team_id"]
-        self.user_ids = self._fetch_user_ids()
-        self.users = self._fetch_users()
-        self.id2name, self.name2id = self._fetch_usernames_and_ids()
-        self.id2dispname = self._fetch_id2dispname()
-        self.id2email = self._fetch_id2email()
-        self.id2user = self._fetch_id2user()
-
-        self.all_posts = {'order': [], 'posts': {}}
+        self._load_users(self._fetch_user_ids())
         self._fetch_posts()
-        self.stop_data = self._fetch_stop_data()
+
+    def _configure(self,
+        team_name: str,
+        channel_name: str,
+        channel_id: Optional[str],
+        after_weeksago: Optional[int],
+        stdout_mode: bool,
+        week_shift_hours: int,
+        post_store: Optional[PostStore],
+        columnar: bool,
+        fetch_workers: int,
+        follow_workers: int,
+        user_cache: Optional[UserCache],
+    ):
+        """
+        Set the configuration and the empty state, without any request to the server.
+        """
         self.stdout_mode = stdout_mode
         self.week_shift_hours = week_shift_hours
+        if columnar and np is None:
+            warnings.warn("NumPy is not available. The columnar representation of posts is disabled.")
+            columnar = False
+        self.columnar = columnar
+        self.columnar_posts = None
+        self.fetch_workers = max(1, fetch_workers)
+        self.follow_workers = max(1, follow_workers)
+
+        if after_weeksago is None:
+            self.after_time = ANCIENT
+        else:
+            self.after_time = self.get_start_of_week_n_weeks_ago(after_weeksago)
+        # The requested range; after_time is later moved to the oldest fetched post.
+        self.fetch_since = int(self.after_time.timestamp() * 1000)
+
+        self.team_name = team_name
+        self.channel_name = channel_name
+        self.channel_id = channel_id
+        self._update_lock = threading.RLock()
+
+        self.post_store = post_store
+        self.all_posts = {'posts': {}}
+        self.post_index = PostIndex()
+        self.stop_table = StopTable(week_shift_hours=week_shift_hours)
+        self.stop_data = {}
+        self.record_table = RecordTable()
+        self.join_table = JoinTable()
+        self.last_post_table = LastPostTable()
+        # Incremented on every change of the members or the posts; see VersionedCache.
+        self.version = 0
+        self.user_cache = UserCache() if user_cache is None else user_cache
+        self.post_digest = None
+
+    @staticmethod
+    def _driver_options(driver_params: Dict) -> Dict:
+        return dict({"request_timeout": DEFAULT_REQUEST_TIMEOUT}, **driver_params)
 
     def __del__(self):
-        self.mm_driver.logout()
+        if getattr(self, "_owns_driver", False):
+            self.mm_driver.logout()
+
+    def _load_users(self, user_ids: List[str]):
+        """
+        Set the channel members, fetching the profiles not loaded yet.
+        """
+        with self._update_lock:
+            # Channels sharing the cache load one at a time, so each profile is fetched once.
+            with self.user_cache.lock:
+                fetched_users = self._fetch_users(self._missing_user_ids(user_ids))
+                self.user_cache.update((user["id"], user) for user in fetched_users)
+            self._set_users(user_ids, fetched_users)
+
+    def _missing_user_ids(self, user_ids: List[str]) -> List[str]:
+        return [user_id for user_id in user_ids if user_id not in self.user_cache]
+
+    def _set_users(self, user_ids: List[str], fetched_users: List[Dict]):
+        """
+        Set the channel members from the cached and the newly fetched profiles.
+        """
+        with self._update_lock:
+            self.user_cache.update((user["id"], user) for user in fetched_users)
+            self.user_ids = user_ids
+            self.users = [self.user_cache[user_id] for user_id in user_ids if user_id in self.user_cache]
+            self._build_user_lookups()
+            self.version += 1
+
+    def refresh(self, page_size=MAX_PAGE_SIZE) -> int:
+        """
+        Bring the fetched state up to date with the server.
+
+        Only the posts modified since the last fetch are requested. The post
+        dictionaries are replaced rather than mutated, so readers holding the
+        previous `all_posts` are not disturbed.
+
+        Returns:
+        - int: Number of new or modified posts.
+        """
+        with self._update_lock:
+            user_ids = self._fetch_user_ids()
+            if set(user_ids) != set(self.user_ids):
+                self._load_users(user_ids)
+
+            changes = self._fetch_post_changes(self.synced_at)
+            if changes is None:
+                # Too many changes for a single response: fetch everything again.
+                self._fetch_posts(page_size)
+                return len(self.all_posts['posts'])
+            return self._merge_post_changes(changes['posts'])
+
+    def _merge_post_changes(self, new_posts: Dict[str, Post]) -> int:
+        """
+        Merge all the changes since the sync time, and advance it.
+
+        Returns:
+        - int: Number of new or modified posts.
+        """
+        with self._update_lock:
+            synced_at = max(self.synced_at, self._latest_update_at(new_posts))
+            self._merge_posts(new_posts, synced_at)
+            self.synced_at = synced_at
+        return len(new_posts)
+
+    def _merge_posts(self, new_posts: Dict[str, Union[Dict, Post]], synced_at: Optional[int] = None):
+        """
+        Merge new or modified posts into all_posts, the post index and the post store.
+
+        The held state is updated in proportion to the changes, not to all the
+        posts; see PostMap. The store is written before the update lock is
+        taken, as it keeps the latest version of each post whatever the order
+        of the writes.
+
+        Args:
+        - synced_at (int): The sync time reached if `new_posts` are all the
+          changes since the previous one. None for the posts of websocket
+          events, which leave the sync state of the store as it is.
+        """
+        if not new_posts:
+            return
+        new_posts = {post_id: Post.from_dict(post) for post_id, post in new_posts.items()}
+        if self.post_store:
+            sync_state = self.post_store.get_sync_state(self.channel_id, self.include_deleted) if synced_at is not None else None
+            self.post_store.save_posts(
+                self.channel_id, list(new_posts.values()), sync_state[0] if sync_state else None, synced_at=synced_at,
+                include_deleted=self.include_deleted,
+            )
+
+        with self._update_lock:
+            old_posts = self.all_posts['posts']
+            if not self.include_deleted:
+                new_posts = {post_id: (None if post.delete_at else post) for post_id, post in new_posts.items()}
+            self.post_index = self.post_index.updated(old_posts, new_posts)
+            self.all_posts = {'posts': old_posts.updated(new_posts)}
+            if self.columnar:
+                self.columnar_posts = self.columnar_posts.updated(new_posts)
+            self.stop_table = self.stop_table.updated(new_posts, lambda: self._indexed_posts(StopTable.CRITERIA))
+            self.record_table = self.record_table.updated(old_posts, new_posts, lambda: self._indexed_posts(RecordTable.CRITERIA))
+            self.join_table = self.join_table.updated(old_posts, new_posts, self._join_posts)
+            self.last_post_table = self.last_post_table.updated(
+                old_posts, new_posts, lambda user_id: self.post_index.indexes[('user_id',)].get(user_id, {}).values(),
+            )
+            self.stop_data = self._fetch_stop_data()
+            self.version += 1
+
+    def apply_event(self, event: Dict) -> bool:
+        """
+        Apply a Mattermost websocket event to the fetched state.
+
+        Handles 'posted', 'post_edited', 'post_deleted', 'user_added' and
+        'user_removed' for this channel. The sync time is not advanced, so a
+        later refresh() still fetches whatever the event stream missed.
+
+        Returns:
+        - bool: Whether the state was changed.
+        """
+        user_ids = self._members_after_event(event)
+        if user_ids is not None:
+            self._load_users(user_ids)
+            return True
+        return self._apply_post_event(event)
+
+    def _apply_post_event(self, event: Dict) -> bool:
+        """
+        Apply a 'posted', 'post_edited' or 'post_deleted' event. No request is made.
+        """
+        if event.get("event") not in ("posted", "post_edited", "post_deleted"):
+            return False
+        data = event.get("data") or {}
+        post = json.loads(data["post"]) if isinstance(data.get("post"), str) else data.get("post")
+        if not post or post.get("channel_id") != self.channel_id:
+            return False
+        if event.get("event") == "post_deleted" and not post.get("delete_at"):
+            post["delete_at"] = post.get("update_at") or int(time.time() * 1000)
+        self._merge_posts({post["id"]: post})
+        return True
+
+    def _members_after_event(self, event: Dict) -> Optional[List[str]]:
+        """
+        The channel members after a 'user_added' or 'user_removed' event,
+        or None if the event does not change them.
+        """
+        event_type = event.get("event")
+        data = event.get("data") or {}
+        broadcast = event.get("broadcast") or {}
+
+        if event_type == "user_added":
+            user_id = data.get("user_id")
+            if broadcast.get("channel_id") != self.channel_id or not user_id or user_id in self.id2user:
+                return None
+            return self.user_ids + [user_id]
+        elif event_type == "user_removed":
+            channel_id = broadcast.get("channel_id") or data.get("channel_id")
+            user_id = data.get("user_id") or broadcast.get("user_id")
+            if channel_id != self.channel_id or user_id not in self.user_ids:
+                return None
+            return [uid for uid in self.user_ids if uid != user_id]
+        return None
+
+    @staticmethod
+    def _latest_update_at(posts: Dict[str, Post]) -> int:
+        return max((post.update_at for post in posts.values()), default=0)
 
     def get_week_number(self, target_datetime: Union[datetime, date, int, float]) -> int:
         if isinstance(target_datetime, datetime):
@@ -103,103 +1793,97 @@ class MattermostChannel:
 
         return week_number
 
-    def _get_channel_id(self) -> str:
-        channel = self.mm_driver.channels.get_channel_by_name_for_team_name(self.team_name, self.channel_name)
-        return channel['id']
-
-    def _fetch_users(self) -> Dict:
-        users = [ self.mm_driver.users.get_user(user_id) for user_id in self.user_ids]
-        return users
-
-    def _fetch_user_ids(self) -> List[str]:
-        return [user["user_id"] for user in self.mm_driver.channels.get_channel_members(self.channel_id)]
-
-    def _fetch_usernames_and_ids(self) -> Dict[str, str]:
+    def get_week_numbers(self, datetimes: List[datetime]) -> "np.ndarray":
         """
-        Fetch usernames based on user_ids.
-        
-        Returns:
-            A dictionary where keys are user_ids and values are corresponding usernames.
+        Vectorized get_week_number() for a list of datetimes. Requires NumPy.
         """
-        id2name = {}
-        name2id = {}
-        for user in self.users:
-            user_id = user["id"]
-            username = user['username']
-            id2name[user_id] = username
-            name2id[username] = user_id
-        return id2name, name2id
+        delta_times = (
+            np.array(datetimes, dtype='datetime64[us]')
+            - np.datetime64(BASE_TIME, 'us')
+            - np.timedelta64(self.week_shift_hours, 'h')
+        )
+        return np.floor_divide(delta_times, np.timedelta64(7, 'D'))
 
-    def _fetch_id2user(self) -> Dict[str, Dict]:
-        """        
-        Returns:
-            A dictionary where keys are user_ids and values are corresponding user data.
-        """
-        id2user = {}
-        for user in self.users:
-            user_id = user["id"]
-            id2user[user_id] = user
-        return id2user
+    def _get_channel_id(self) -> str:
+        channel = self.mm_driver.channels.get_channel_by_name_for_team_name(self.team_name, self.channel_name)
+        return channel['id']
 
-    def get_username_by_id(self, user_id: str) -> Optional[str]:
-        """
-        Get the username for a given user_id using the self.usernames dictionary.
-        
-        Returns:
-            Username corresponding to the user_id or None if not found.
+    def _fetch_users(self, user_ids: Optional[List[str]] = None, chunk_size: int = 100, max_workers: int = 8) -> List[Dict]:
         """
-        return self.id2name.get(user_id, None)
+        Fetch the user data of `user_ids` (default: self.user_ids) by the bulk endpoint.
 
-    def get_user_by_id(self, user_id: str) -> Optional[str]:
-        """
-        Get the user-data for a given user_id using the self.usernames dictionary.
-        
-        Returns:
-            Username corresponding to the user_id or None if not found.
+        The ids are split into chunks, which are fetched concurrently when there are several.
         """
-        return self.id2user.get(user_id, None)
+        if user_ids is None:
+            user_ids = self.user_ids
+        chunks = [user_ids[i:i+chunk_size] for i in range(0, len(user_ids), chunk_size)]
+        if len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+                results = list(executor.map(propagate_context(self.mm_driver.users.get_users_by_ids), chunks))
+        else:
+            results = [self.mm_driver.users.get_users_by_ids(chunk) for chunk in chunks]
 
-    def get_id_by_username(self, username: str) -> Optional[str]:
-        """
-        Get the username for a given user_id using the self.usernames dictionary.
-        
-        Returns:
-            Username corresponding to the user_id or None if not found.
-        """
-        return self.name2id.get(username, None)
+        fetched = {user["id"]: user for result in results for user in result}
+        return [fetched[user_id] for user_id in user_ids if user_id in fetched]
 
-    def _fetch_id2dispname(self) -> Dict[str, str]:
+    def _fetch_user_ids(self, per_page: int = 200) -> List[str]:
+        user_ids = []
+        page = 0
+        while True:
+            members = self.mm_driver.channels.get_channel_members(self.channel_id, params={"page": page, "per_page": per_page})
+            user_ids.extend(member["user_id"] for member in members)
+            if len(members) < per_page:
+                break
+            page += 1
+        return user_ids
+
+    def _build_user_lookups(self):
         """
-        Fetch display-names based on user_ids.
-        
-        Returns:
-            A dictionary where keys are user_ids and values are corresponding display-names.
+        Build the lookup dictionaries of self.users in a single pass:
+        id2user, id2name, name2id, id2dispname and id2email.
         """
-        id2dispname = {}
+        id2user, id2name, name2id, id2dispname, id2email = {}, {}, {}, {}, {}
         for user in self.users:
             user_id = user["id"]
+            username = user["username"]
+            id2user[user_id] = user
+            id2name[user_id] = username
+            name2id[username] = user_id
+            id2email[user_id] = user["email"]
             if user.get("nickname", "").strip():
                 id2dispname[user_id] = user["nickname"]
             else:
                 name_parts = [user.get("first_name", ""), user.get("last_name", "")]
                 full_name = " ".join(part for part in name_parts if part)
                 id2dispname[user_id] = full_name if full_name.strip() else "Unknown"
+        self.id2user, self.id2name, self.name2id, self.id2dispname, self.id2email = id2user, id2name, name2id, id2dispname, id2email
 
-        return id2dispname
+    def get_username_by_id(self, user_id: str) -> Optional[str]:
+        """
+        Get the username for a given user_id using the self.usernames dictionary.
+        
+        Returns:
+            Username corresponding to the user_id or None if not found.
+        """
+        return self.id2name.get(user_id, None)
 
-    def _fetch_id2email(self) -> Dict[str, str]:
+    def get_user_by_id(self, user_id: str) -> Optional[str]:
         """
-        Fetch emails based on user_ids.
+        Get the user-data for a given user_id using the self.usernames dictionary.
         
         Returns:
-            A dictionary where keys are user_ids and values are corresponding emails.
+            Username corresponding to the user_id or None if not found.
         """
-        id2email = {}
-        for user in self.users:
-            user_id = user["id"]
-            id2email[user_id] = user["email"]
+        return self.id2user.get(user_id, None)
 
-        return id2email
+    def get_id_by_username(self, username: str) -> Optional[str]:
+        """
+        Get the username for a given user_id using the self.usernames dictionary.
+        
+        Returns:
+            Username corresponding to the user_id or None if not found.
+        """
+        return self.name2id.get(username, None)
 
     def get_dispname_by_id(self, user_id: str) -> Optional[str]:
         """
@@ -219,55 +1903,371 @@ class MattermostChannel:
         """
         return self.id2email.get(user_id, None)
 
-    def _fetch_posts(self, page_size=100) -> Dict:
+    def _fetch_post_pages(self, since: int, page_size: int = MAX_PAGE_SIZE) -> Dict:
         """
-        Fetch all posts in the channel since 'after_time' using pagination.
+        Fetch the posts in the channel modified after 'since' using pagination.
 
         Args:
-        - page_size (int): Number of posts to fetch in a single request. Default is 100.
+        - since (int): Unix time in milliseconds.
+        - page_size (int): Number of posts to fetch in a single request. Default is MAX_PAGE_SIZE.
 
         Returns:
         - Dict: Aggregated posts.
         """
+        page_size = min(page_size, MAX_PAGE_SIZE)
         aggregated_posts = {'posts': {}, 'order': []}
-        page = 0
+        for posts in self._iter_post_pages(since, page_size):
+            self._merge_post_page(aggregated_posts, posts)
+        return aggregated_posts
 
-        while True:
-            posts = self.mm_driver.client.get(
-                '/api/v4/channels/' + self.channel_id + '/posts',
-                params={
-                    'since': int(self.after_time.timestamp() * 1000),
-                    'per_page': page_size,
-                    'page': page
-                },
-                options = {
-                    'fields' : [
-                        'id',
-                        'create_at', 'delete_at',
-                        'metadata', 'props', 'root_id',
-                    ],
-                },
-            )
+    def _iter_post_pages(self, since: int, page_size: int = MAX_PAGE_SIZE) -> Iterator[Dict]:
+        """
+        Fetch the pages of posts modified after 'since', yielding each page
+        (as returned by the API) in order.
+
+        With 'since' set, a single request returns the changes. If it is cut at
+        SINCE_POST_LIMIT, the rest comes from the pages of posts created before
+        the oldest post returned, down to 'since' (see _take_post_page()).
+
+        Up to `self.fetch_workers` pages are requested concurrently, so at most
+        that many pages are held besides the one being consumed.
+        """
+        page_size = min(page_size, MAX_PAGE_SIZE)
+        before = None
+        if since > 0:
+            posts = self.mm_driver.client.get(**self._post_page_request(since, page_size))
+            if posts['posts']:
+                yield posts
+            if len(posts['order']) < SINCE_POST_LIMIT:
+                return
+            before = self._before_anchor(posts)
+
+        @propagate_context
+        def fetch_page(page):
+            return self.mm_driver.client.get(**self._post_page_request(since, page_size, page, before))
+
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            futures = {}
+            page = 0
+            previous_ids = set()
+            # A full history starts with a single page, in case the channel is small.
+            # Pages before a cut 'since' response are known to be many.
+            window = 1 if before is None else self.fetch_workers
+            try:
+                while True:
+                    # Keep a window of pages in flight ahead of the one being consumed.
+                    for ahead in range(page, page + window):
+                        if ahead not in futures:
+                            futures[ahead] = executor.submit(fetch_page, ahead)
+                    window = self.fetch_workers
+                    posts, has_next = self._take_post_page(futures.pop(page).result(), previous_ids, page_size, since, before)
+                    if posts is None:
+                        break
+                    if posts['posts']:
+                        yield posts
+                    if not has_next:
+                        break
+                    page += 1  # Move to the next page
+            finally:
+                for future in futures.values():
+                    future.cancel()
+
+    def _post_page_request(self, since: int, page_size: int, page: int = 0, before: Optional[str] = None) -> Dict:
+        """
+        Arguments of the client request for a page of posts: the posts modified
+        after 'since' (not paged), else the page of posts created before the
+        post `before`, else the page of the channel history.
+        """
+        if before:
+            params = {'before': before, 'per_page': page_size, 'page': page}
+        elif since > 0:
+            params = {'since': since}
+        else:
+            params = {'per_page': page_size, 'page': page}
+        return {
+            'endpoint': '/api/v4/channels/' + self.channel_id + '/posts',
+            'params': params,
+            'options': {
+                'fields' : [
+                    'id',
+                    'create_at', 'update_at', 'delete_at',
+                    'metadata', 'props', 'root_id',
+                ],
+            },
+        }
+
+    @staticmethod
+    def _before_anchor(posts: Dict) -> str:
+        """
+        The post whose 'before' pages follow a cut 'since' response: its oldest
+        post created later than the oldest one. The pages only hold the posts
+        created strictly before their anchor, and the cut may fall between
+        posts created at the same millisecond.
+        """
+        order = posts['order']
+        oldest_create_at = posts['posts'][order[-1]]['create_at']
+        for post_id in reversed(order):
+            if posts['posts'][post_id]['create_at'] > oldest_create_at:
+                return post_id
+        return order[-1]
+
+    @staticmethod
+    def _take_post_page(posts: Dict, previous_ids: set, page_size: int, since: int, before: Optional[str]) -> tuple:
+        """
+        Check a fetched page of _iter_post_pages(), recording its ids in `previous_ids`.
+
+        The pages before a cut 'since' response keep only the posts modified
+        after 'since', and end with the page reaching the posts created before it.
+
+        Returns:
+        - tuple: The page to use (None if there are no more posts), and
+          whether the next page should be fetched.
+        """
+        page_ids = set(posts['order'])
+        # A page without new posts means the server ignored the paging.
+        if not posts['posts'] or page_ids <= previous_ids:
+            return None, False
+        previous_ids.clear()
+        previous_ids.update(page_ids)
+
+        # A short page is the last one.
+        has_next = len(posts['order']) >= page_size
+        if before:
+            if posts['posts'][posts['order'][-1]]['create_at'] <= since:
+                has_next = False
+            order = [post_id for post_id in posts['order'] if posts['posts'][post_id]['update_at'] > since]
+            posts = dict(posts, order=order, posts={post_id: posts['posts'][post_id] for post_id in order})
+        return posts, has_next
+
+    @staticmethod
+    def _merge_post_page(aggregated_posts: Dict, posts: Dict):
+        """
+        Merge a fetched page into aggregated_posts.
+        """
+        new_ids = [post_id for post_id in posts['order'] if post_id not in aggregated_posts['posts']]
+        aggregated_posts['posts'].update((post_id, Post.from_dict(post)) for post_id, post in posts['posts'].items())
+        aggregated_posts['order'].extend(new_ids)
 
-            if not posts['posts']:
-                break  # No more posts to fetch
+    @timed
+    def _fetch_posts(self, page_size=MAX_PAGE_SIZE) -> Dict:
+        """
+        Fetch all posts in the channel since 'after_time'.
 
-            aggregated_posts['posts'].update(posts['posts'])
-            aggregated_posts['order'].extend(posts['order'])
+        With a post store, only the posts modified since the last sync are
+        fetched from the server and merged into the stored copy.
 
-            page += 1  # Move to the next page
+        Args:
+        - page_size (int): Number of posts to fetch in a single request. Default is MAX_PAGE_SIZE.
 
-        if aggregated_posts['posts']:
-            oldest_time = datetime.fromtimestamp(
-                aggregated_posts['posts'][aggregated_posts['order'][-1]]['create_at'] / 1000
-            )
+        Returns:
+        - Dict: Aggregated posts.
+        """
+        if self.post_digest is not None:
+            return self._digest_posts(page_size)
+        since, sync_state = self._prepare_post_fetch()
+        fetched_posts = self._fetch_post_changes(sync_state[1]) if sync_state else None
+        if fetched_posts is None:
+            # Not synced yet, or too many changes since: fetch everything again.
+            sync_state = None
+            fetched_posts = self._fetch_post_pages(since, page_size)
+        return self._complete_post_fetch(since, sync_state, fetched_posts)
+
+    def _fetch_post_changes(self, since: int) -> Optional[Dict]:
+        """
+        Fetch the posts modified after 'since' in a single request.
+
+        Returns:
+        - Dict: Aggregated posts, or None if the response was cut at
+          SINCE_POST_LIMIT, so that some changes may be missing.
+        """
+        # 'since' is only used by the server if positive.
+        posts = self.mm_driver.client.get(**self._post_page_request(max(since, 1), MAX_PAGE_SIZE))
+        return self._post_changes(posts)
+
+    def _post_changes(self, posts: Dict) -> Optional[Dict]:
+        """The result of _fetch_post_changes() from the response."""
+        if len(posts['order']) >= SINCE_POST_LIMIT:
+            return None
+        aggregated_posts = {'posts': {}, 'order': []}
+        self._merge_post_page(aggregated_posts, posts)
+        return aggregated_posts
+
+    def _stream_posts(self, page_size=MAX_PAGE_SIZE) -> Iterator[Post]:
+        """
+        Generator version of _fetch_posts(): the posts since 'after_time' flow
+        page by page from the server (or in chunks from the post store) without
+        being collected.
+
+        The store is written page by page, and its sync state is recorded only
+        once all the pages have been fetched.
+        """
+        since, sync_state = self._prepare_post_fetch()
+        changes = self._fetch_post_changes(sync_state[1]) if sync_state else None
+        if changes is not None:
+            # Incremental sync: the store already covers the requested range.
+            self.post_store.save_posts(self.channel_id, list(changes['posts'].values()), sync_state[0], include_deleted=self.include_deleted)
+            yield from self.post_store.iter_posts(self.channel_id, since, include_deleted=self.include_deleted, chunk_size=page_size)
+        else:
+            if self.post_store:
+                self.post_store.clear(self.channel_id, self.include_deleted)
+            latest_update_at = since
+            for posts in self._iter_post_pages(since, page_size):
+                page_posts = [Post.from_dict(post) for post in posts['posts'].values()]
+                if self.post_store:
+                    self.post_store.save_posts(self.channel_id, page_posts, None, include_deleted=self.include_deleted)
+                latest_update_at = max([latest_update_at] + [post.update_at for post in page_posts])
+                yield from page_posts
+            if self.post_store:
+                self.post_store.save_posts(self.channel_id, [], since, synced_at=latest_update_at, include_deleted=self.include_deleted)
+
+    def _digest_posts(self, page_size=MAX_PAGE_SIZE) -> Dict:
+        """
+        Stream the posts into self.post_digest and keep only the posts it selects.
+        """
+        since = self.fetch_since
+        digest = self.post_digest.consume(self._stream_posts(page_size))
+        posts = digest.posts()
+        # The stored posts may include newer ones from websocket events.
+        synced_at = self.post_store.get_sync_state(self.channel_id, self.include_deleted)[1] if self.post_store else digest.latest_update_at
+        self._set_posts(posts, digest.oldest_create_at, max(since, synced_at))
+        return self.all_posts
+
+    def _prepare_post_fetch(self) -> tuple:
+        """
+        Returns:
+        - tuple: 'since' in milliseconds, and the sync state of the post store
+          if it already covers the requested range (None otherwise).
+        """
+        since = self.fetch_since
+        # Paged fetches (since <= 0) do not return deleted posts; mirror that.
+        self.include_deleted = since > 0
+        sync_state = self.post_store.get_sync_state(self.channel_id, self.include_deleted) if self.post_store else None
+
+        if sync_state is not None and sync_state[0] <= since:
+            return since, sync_state
+        return since, None
+
+    def _complete_post_fetch(self, since: int, sync_state: Optional[tuple], fetched_posts: Dict) -> Dict:
+        """
+        Store the fetched posts and set them as all_posts.
+        """
+        if sync_state is not None:
+            # Incremental sync: the store already covers the requested range.
+            self.post_store.save_posts(self.channel_id, list(fetched_posts['posts'].values()), sync_state[0], include_deleted=self.include_deleted)
+            posts = self.post_store.load_posts(self.channel_id, since, include_deleted=self.include_deleted)
+            # The stored posts may include newer ones from websocket events.
+            synced_at = self.post_store.get_sync_state(self.channel_id, self.include_deleted)[1]
+        else:
+            posts = fetched_posts['posts']
+            if self.post_store:
+                self.post_store.save_posts(self.channel_id, list(posts.values()), since, replace=True, include_deleted=self.include_deleted)
+            posts = {post_id: posts[post_id] for post_id in sorted(posts, key=lambda post_id: posts[post_id].create_at, reverse=True)}
+            synced_at = self._latest_update_at(posts)
+
+        oldest_create_at = next(reversed(posts.values())).create_at if posts else None
+        self._set_posts(posts, oldest_create_at, max(since, synced_at))
+        return self.all_posts
+
+    def _set_posts(self, posts: Dict[str, Post], oldest_create_at: Optional[int], synced_at: int):
+        """
+        Set the fetched posts (newest first) as all_posts, with the post index.
+        """
+        if oldest_create_at is not None:
+            oldest_time = datetime.fromtimestamp(oldest_create_at / 1000)
             if oldest_time > self.after_time:
                 self.after_time = oldest_time
 
-        self.all_posts = aggregated_posts  # Update the all_posts property
-        # print(*list(self.all_posts['posts'].values()), sep='\n')
-        return aggregated_posts
+        self.post_index = PostIndex(posts)
+        self.all_posts = {'posts': PostMap(posts)}  # Newest first
+        if self.columnar:
+            self.columnar_posts = ColumnarPosts(posts)
+        self.stop_table = StopTable(self._indexed_posts(StopTable.CRITERIA), self.week_shift_hours)
+        self.record_table = RecordTable(self._indexed_posts(RecordTable.CRITERIA))
+        self.join_table = JoinTable(self._join_posts())
+        self.last_post_table = LastPostTable(posts.values())
+        self.stop_data = self._fetch_stop_data()
+        self.synced_at = synced_at
+        self.version += 1
+
+    def write_snapshot(self, file, generation: int):
+        """
+        Write the state read by the slash-commands to `file`, for from_snapshot():
+        the posts as columnar arrays, the members, and in full only the posts
+        of the derived views (the relaystop, record and join posts).
 
+        Layout: SNAPSHOT_HEADER, the JSON metadata, then the arrays of
+        ColumnarPosts.write_arrays() from the next 8-byte boundary.
+        """
+        with self._update_lock:
+            posts = self.all_posts['posts']
+            columnar_posts = self.columnar_posts if self.columnar_posts is not None else ColumnarPosts(posts)
+            view_posts = {}
+            for post in self._indexed_posts(StopTable.CRITERIA) + self._indexed_posts(RecordTable.CRITERIA) + self._join_posts():
+                if StopTable.is_stop_post(post) or RecordTable.is_record_post(post) or post.type in JoinTable.JOIN_TYPES:
+                    view_posts[post.id] = post
+            meta = json.dumps({
+                "generation": generation,
+                "team_name": self.team_name,
+                "channel_name": self.channel_name,
+                "channel_id": self.channel_id,
+                "team_id": self.team_id,
+                "stdout_mode": self.stdout_mode,
+                "week_shift_hours": self.week_shift_hours,
+                "after_time": self.after_time.isoformat(),
+                "include_deleted": self.include_deleted,
+                "synced_at": self.synced_at,
+                "user_ids": self.user_ids,
+                "users": self.users,
+                "posts": [post.to_dict() for post in sorted(view_posts.values(), key=lambda post: post.create_at, reverse=True)],
+                "length": len(posts),
+                "codes": columnar_posts.codes(),
+            }).encode()
+        size = SNAPSHOT_HEADER.size + len(meta)
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(meta)))
+        file.write(meta)
+        file.write(b"\0" * (-size % 8))
+        columnar_posts.write_arrays(file)
+
+    @classmethod
+    def from_snapshot(cls, buffer, mm_driver: Driver) -> "MattermostChannel":
+        """
+        Read-only channel over a snapshot written by write_snapshot(), e.g. a
+        memory map. The posts stay in `buffer` as columnar arrays; the members
+        and the derived views are rebuilt from the metadata. The channel is not
+        refreshed; a newer snapshot replaces it. `mm_driver` is shared, and not
+        logged out.
+        """
+        magic, meta_size = SNAPSHOT_HEADER.unpack_from(buffer)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Not a RelayReminder snapshot.")
+        meta = json.loads(buffer[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + meta_size])
+        mm_channel = cls.__new__(cls)
+        mm_channel._configure(
+            meta["team_name"], meta["channel_name"], meta["channel_id"], None, meta["stdout_mode"],
+            meta["week_shift_hours"], None, False, 1, 1, None,
+        )
+        mm_channel._owns_driver = False
+        mm_channel.mm_driver = mm_driver
+        mm_channel.team_id = meta["team_id"]
+        mm_channel.after_time = datetime.fromisoformat(meta["after_time"])
+        mm_channel.include_deleted = meta["include_deleted"]
+        mm_channel._set_users(meta["user_ids"], meta["users"])
+        mm_channel._set_posts({post["id"]: Post.from_dict(post) for post in meta["posts"]}, None, meta["synced_at"])
+        arrays_start = SNAPSHOT_HEADER.size + meta_size
+        arrays_start += -arrays_start % 8
+        mm_channel.columnar_posts = ColumnarPosts.from_buffer(buffer, arrays_start, meta["length"], meta["codes"])
+        mm_channel.last_post_table = LastPostTable.from_columnar(mm_channel.columnar_posts)
+        # Unique to the generation, for the VersionedCache of the readers.
+        mm_channel.version = meta["generation"]
+        return mm_channel
+
+    def post_count(self) -> int:
+        """Number of the posts held, including the ones only in the columnar arrays of a snapshot."""
+        if self.columnar_posts is not None:
+            return len(self.columnar_posts)
+        return len(self.all_posts['posts'])
+
+    @timed
     def get_last_post_datetimes(self, 
         user_ids: Optional[List[str]] = None,
         priority_filter: Optional[str] = None,
@@ -278,139 +2278,187 @@ class MattermostChannel:
         use_past_record: bool = False,
         use_admin_stop: bool = False,
     ) -> Dict[str, datetime]:
+        view = {
+            "priority_filter": priority_filter,
+            "is_thread_head": is_thread_head,
+            "ignore_deleted_posts": ignore_deleted_posts,
+        }
+        return self.get_last_post_datetimes_by_views(
+            {"": view},
+            user_ids = user_ids,
+            app_name = app_name,
+            regard_join_as_post = regard_join_as_post,
+            use_past_record = use_past_record,
+            use_admin_stop = use_admin_stop,
+        )[""]
+
+    def get_last_post_datetimes_by_views(self,
+        views: Optional[Dict[str, Dict[str, Any]]] = None,
+        user_ids: Optional[List[str]] = None,
+        app_name: Optional[str] = None,
+        regard_join_as_post: bool = False,
+        use_past_record: bool = False,
+        use_admin_stop: bool = False,
+    ) -> Dict[str, Dict[str, datetime]]:
+        """
+        Compute the last post datetimes of users for several views at once:
+        looked up in the LastPostTable for the views of LAST_POST_VIEWS, and
+        otherwise reduced in one scan of the posts.
+
+        Args:
+        - views: View name -> filter, given by the keyword arguments `priority_filter`,
+          `is_thread_head` and `ignore_deleted_posts` of get_last_post_datetimes().
+          Default is LAST_POST_VIEWS.
+        - The other arguments are the same as get_last_post_datetimes(),
+          and the fallbacks are looked up for all users at once.
 
+        Returns:
+        - Dict: View name -> (user_id -> datetime).
+        """
+        if views is None:
+            views = LAST_POST_VIEWS
         if user_ids is None:
             user_ids = self.user_ids
+        user_id_set = set(user_ids)
+
+        filters = [(name,) + LastPostTable.view_filter(view) + ({},) for name, view in views.items()]
+
+        last_post_table = self.last_post_table
+        columnar_posts = self.columnar_posts
+        if all(view_filter[1:4] in last_post_table.latest for view_filter in filters):
+            for _, priority_filter, is_thread_head, ignore_deleted_posts, last_create_ats in filters:
+                users = last_post_table.latest[(priority_filter, is_thread_head, ignore_deleted_posts)]
+                for user_id in user_id_set:
+                    if user_id in users:
+                        last_create_ats[user_id] = users[user_id][0]
+        elif columnar_posts is not None:
+            for _, priority_filter, is_thread_head, ignore_deleted_posts, last_create_ats in filters:
+                mask = columnar_posts.view_mask(priority_filter, is_thread_head, ignore_deleted_posts)
+                last_create_ats.update(columnar_posts.last_create_at_by_user(mask, user_ids))
+        else:
+            # Take the posts of the requested users from the user_id index when they are fewer.
+            posts_by_user = self.post_index.indexes[('user_id',)]
+            all_posts = self.all_posts['posts']
+            if sum(len(posts_by_user.get(user_id, ())) for user_id in user_id_set) < len(all_posts) // 2:
+                posts = [post for user_id in user_id_set for post in posts_by_user.get(user_id, {}).values()]
+            else:
+                posts = all_posts.values()
+            for post in posts:
+                user_id = post.user_id
+                # Skip system post
+                if post.type != '' or user_id not in user_id_set:
+                    continue
+                create_at = post.create_at
+                is_reply = bool(post.root_id)
+                is_deleted = post.delete_at != 0
+                priority = post.priority
+
+                for _, priority_filter, is_thread_head, ignore_deleted_posts, last_create_ats in filters:
+                    # Skip deleted post (default)
+                    if ignore_deleted_posts and is_deleted:
+                        continue
+                    if (priority_filter is None or priority == priority_filter) and \
+                       (is_thread_head is None or is_reply != is_thread_head):
+                        if create_at > last_create_ats.get(user_id, -1):
+                            last_create_ats[user_id] = create_at
+
+        # Fallbacks, looked up only when some view needs them.
+        needs_fallback = any(
+            (priority_filter is None or priority_filter == 'standard') and (is_thread_head is None or is_thread_head)
+            for _, priority_filter, is_thread_head, _, _ in filters
+        )
+        join_datetimes = self.get_join_datetimes(user_ids) if needs_fallback and regard_join_as_post else {}
+        record_datetimes = self.get_last_post_datetimes_from_record(user_ids, app_name) if needs_fallback and use_past_record else {}
+        stop_datetimes = self.get_stop_untils(user_ids) if needs_fallback and use_admin_stop else {}
 
-        last_post_datetimes = dict.fromkeys(user_ids, self.after_time)
-
-        if priority_filter:
-            priority_filter = priority_filter.lower()
-
-        for post in self.all_posts['posts'].values():
-            user_id = post['user_id']
-            create_at = datetime.fromtimestamp(post['create_at'] / 1000)
-            root_id = post.get('root_id', '')
-            priority = post.get('metadata', {}).get('priority', {}).get('priority', 'standard').lower() or 'standard'
-
-            # Skip deleted post (default)
-            if ignore_deleted_posts and post['delete_at'] != 0:
-                continue
-            # Skip system post
-            if post['type'] != '':
-                continue
-            # Skip joining channel
-            # if post.get("type", "") == "system_join_leave":
-            #     continue
-
-            if user_id in user_ids:
-                if (priority_filter is None or priority == priority_filter) and \
-                   (is_thread_head is None or bool(root_id) != is_thread_head):
-                    if user_id not in last_post_datetimes or create_at > last_post_datetimes[user_id]:
-                        last_post_datetimes[user_id] = create_at
-
-        # Check channel-join-date.
-        if (priority_filter is None or priority_filter == 'standard') and \
-           (is_thread_head is None or is_thread_head):
-            for user_id, post_datetime in last_post_datetimes.items():
-                if regard_join_as_post and post_datetime <= self.after_time:
-                    join_datetime = self.get_join_datetime(user_id)
-                    if join_datetime > post_datetime:
-                        post_datetime = join_datetime
-                if use_past_record and post_datetime <= self.after_time:
-                    record_datetime = self.get_last_post_datetime_from_record(user_id, app_name)
-                    if record_datetime > post_datetime:
-                        post_datetime = record_datetime
-                if use_admin_stop:
-                    stop_datetime = self.get_stop_until(user_id)
-                    if stop_datetime > post_datetime:
-                        post_datetime = stop_datetime
+        results = {}
+        for name, priority_filter, is_thread_head, _, last_create_ats in filters:
+            last_post_datetimes = {}
+            for user_id in user_ids:
+                post_datetime = self.after_time
+                if user_id in last_create_ats:
+                    create_at = datetime.fromtimestamp(last_create_ats[user_id] / 1000)
+                    if create_at > post_datetime:
+                        post_datetime = create_at
                 last_post_datetimes[user_id] = post_datetime
 
-        return last_post_datetimes
+            # Check channel-join-date.
+            if (priority_filter is None or priority_filter == 'standard') and \
+               (is_thread_head is None or is_thread_head):
+                for user_id, post_datetime in last_post_datetimes.items():
+                    if regard_join_as_post and post_datetime <= self.after_time:
+                        join_datetime = join_datetimes[user_id]
+                        if join_datetime > post_datetime:
+                            post_datetime = join_datetime
+                    if use_past_record and post_datetime <= self.after_time:
+                        record_datetime = record_datetimes[user_id]
+                        if record_datetime > post_datetime:
+                            post_datetime = record_datetime
+                    if use_admin_stop:
+                        stop_datetime = stop_datetimes[user_id]
+                        if stop_datetime > post_datetime:
+                            post_datetime = stop_datetime
+                    last_post_datetimes[user_id] = post_datetime
+
+            results[name] = last_post_datetimes
+
+        return results
+
+    def get_join_datetimes(self, user_ids: List[str]) -> Dict[str, datetime]:
+        """
+        Get the dates when users joined the channel, from the system messages.
+        Users without one in the fetched posts joined before 'after_time'.
+        """
+        join_times = self.join_table.join_times
+        join_datetimes = {}
+        for user_id in user_ids:
+            if join_times.get(user_id, 0) > 0:
+                join_datetimes[user_id] = datetime.fromtimestamp(join_times[user_id] / 1000)
+            else:
+                join_datetimes[user_id] = self.after_time
+        return join_datetimes
 
     def get_join_datetime(self, user_id: str) -> datetime:
         """Get the date when a user joined the channel using system messages."""
-        criteria = [
-            {
-                "type": "system_join_channel",
-                "user_id": user_id,
-            },
-            {
-                "type": "system_add_to_channel",
-                "props": {"addedUserId": user_id,},
-            },
-        ]
-        filtered_posts = [
-            self.filter_posts_by_criteria(criterion) for criterion in criteria
-        ]
-
-        join_time_milliseconds = max(
-            (posts + [{"create_at": 0}])[0]["create_at"] for posts in filtered_posts
-        )
-        if join_time_milliseconds > 0:
-            join_time = datetime.fromtimestamp(join_time_milliseconds / 1000)
-        else:
-            join_time = self.after_time
-
-        return join_time
+        return self.get_join_datetimes([user_id])[user_id]
 
     def get_last_post_datetime_from_record(self, user_id: str, app_name: Optional[str] = None) -> datetime:
-        criteria = {
-            "props": {
-                "bot_app": Anything,
-                "type": "record",
-                "users": [user_id],
-            },
-        }
-        if app_name:
-            criteria["props"]["bot_app"] = app_name
-
-        posts = self.filter_posts_by_criteria(criteria)
-        if posts:
-            last_post_week = posts[-1]["props"]["last_post_week"]
-            return self.get_start_of_week(last_post_week)
+        post = self.record_table.user_posts(app_name).get(user_id)
+        if post is not None:
+            return self.get_start_of_week(post.props["last_post_week"])
         else:
             return self.after_time
 
-    def _fetch_stop_data(self, app_name: Optional[str] = None) -> datetime:
-        criteria = {
-            "props": {
-                "bot_app": Anything,
-                "type": "relaystop",
-                "data": Anything,
-            },
+    def get_last_post_datetimes_from_record(self, user_ids: List[str], app_name: Optional[str] = None) -> Dict[str, datetime]:
+        """
+        Bulk version of get_last_post_datetime_from_record(), from the same record view.
+        """
+        user_posts = self.record_table.user_posts(app_name)
+        return {
+            user_id: self.get_start_of_week(user_posts[user_id].props["last_post_week"]) if user_id in user_posts else self.after_time
+            for user_id in user_ids
         }
-        if app_name:
-            criteria["props"]["bot_app"] = app_name
 
-        posts = self.filter_posts_by_criteria(criteria)
-        if posts:
-            last_stop_data = posts[-1]["props"]["data"]
-            return last_stop_data
-        else:
-            return dict()
+    def _indexed_posts(self, criteria: Dict[str, Any]) -> List[Post]:
+        """The posts which may match `criteria`, looked up in the post index."""
+        candidates = self.post_index.candidates(criteria)
+        return list(self.all_posts['posts'].values()) if candidates is None else candidates
 
-    def get_stop_until(self, user_id: str) -> datetime:
-        if user_id in self.stop_data:
-            until_date = parser.parse(self.stop_data[user_id])
-            return datetime(until_date.year, until_date.month, until_date.day) + timedelta(hours=self.week_shift_hours)
-        return self.after_time
+    def _join_posts(self) -> List[Post]:
+        return [post for join_type in JoinTable.JOIN_TYPES for post in self._indexed_posts({"type": join_type})]
 
-    def send_post(self, message: str, props: Optional[Dict] = None, root_id: Optional[str] = None) -> Dict:
-        payload = {
-            'channel_id': self.channel_id,
-            'message': message,
-        }
+    def _fetch_stop_data(self, app_name: Optional[str] = None) -> Dict[str, str]:
+        return self.stop_table.data(app_name)
 
-        if props:
-            payload['props'] = props
+    def get_stop_until(self, user_id: str) -> datetime:
+        return self.stop_table.untils().get(user_id, self.after_time)
 
-        if root_id:
-            payload['root_id'] = root_id
-            if not root_id in self.all_posts['posts']:
-                warnings.warn(f"Given root_id '{root_id}' does not exist in fetched posts. Posting directly to the channel.")
+    def get_stop_untils(self, user_ids: List[str]) -> Dict[str, datetime]:
+        untils = self.stop_table.untils()
+        return {user_id: untils.get(user_id, self.after_time) for user_id in user_ids}
 
+    def send_post(self, message: str, props: Optional[Dict] = None, root_id: Optional[str] = None, pending_post_id: Optional[str] = None) -> Dict:
+        payload = self._post_payload(message, props, root_id, pending_post_id)
         if self.stdout_mode:
             print(payload)
             return True
@@ -422,75 +2470,137 @@ class MattermostChannel:
                 else:
                     return False
             except Exception as e:
+                warnings.warn(f"Failed to send a post: {e}")
                 return False
 
+    def find_sent_post(self, props: Optional[Dict], root_id: Optional[str], pending_post_id: Optional[str], since: int) -> Optional[Dict]:
+        """
+        Look for a post of send_post() made after `since` (Unix ms) in the thread
+        `root_id` (the channel if None): the one with `pending_post_id`, or by
+        this bot with all of `props`.
+
+        The server creates a post once for a pending_post_id only for a short
+        while (about 30 seconds), so a later retry must check first.
+
+        Returns:
+            The post, or None if not found.
+        """
+        if self.stdout_mode:
+            return None
+        posts = self.mm_driver.client.get(**self._post_page_request(max(since, 1), MAX_PAGE_SIZE))
+        return self._find_sent_post(posts, props, root_id, pending_post_id)
+
+    def _find_sent_post(self, posts: Dict, props: Optional[Dict], root_id: Optional[str], pending_post_id: Optional[str]) -> Optional[Dict]:
+        for post in posts['posts'].values():
+            if (post.get('root_id') or None) != (root_id or None):
+                continue
+            if pending_post_id and post.get('pending_post_id') == pending_post_id:
+                return post
+            # The server may add its own props (e.g. from_bot).
+            post_props = post.get('props') or {}
+            if props and post.get('user_id') == self.mm_driver.client.userid and all(post_props.get(key) == value for key, value in props.items()):
+                return post
+        return None
+
+    def _post_payload(self, message: str, props: Optional[Dict] = None, root_id: Optional[str] = None, pending_post_id: Optional[str] = None) -> Dict:
+        payload = {
+            'channel_id': self.channel_id,
+            'message': message,
+        }
+
+        # The server creates a post once for the same pending_post_id, so it can be sent again safely.
+        if pending_post_id:
+            payload['pending_post_id'] = pending_post_id
+
+        if props:
+            payload['props'] = props
+
+        if root_id:
+            payload['root_id'] = root_id
+            if not root_id in self.all_posts['posts']:
+                warnings.warn(f"Given root_id '{root_id}' does not exist in fetched posts. Posting directly to the channel.")
+
+        return payload
+
+    @timed
     def filter_posts_by_criteria(self, criteria: Dict[str, Any], posts: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         if posts is None:
-            posts = self.all_posts['posts']
-
-        def match_criteria(data: Dict[str, Any], criteria: Dict[str, Any]) -> bool:
-            for key, value in criteria.items():
-                try:
-                    if key not in data:
-                        return False
-                except:
-                    if key not in list(data.keys()):
-                        return False
+            candidates = self.post_index.candidates(criteria)
+            posts = self.all_posts['posts'] if candidates is None else dict(enumerate(candidates))
 
-                if value is Anything:
-                    continue
-                elif isinstance(value, dict):
-                    if not match_criteria(data[key], value):
-                        return False
-                elif isinstance(value, (set, list)) and isinstance(data[key], list):
-                    try:
-                        value_set = set(value)
-                        if not value_set.issubset(data[key]):
-                            return False
-                    except:
-                        data_key = data[key]
-                        if not all(val in data_key for val in value):
-                            return False
-                elif data[key] != value:
-                    return False
-            return True
+        match_criteria = compile_criteria(criteria)
 
         # Filter the posts based on criteria
-        filtered_posts = [post for post in posts.values() if match_criteria(post, criteria)]
+        filtered_posts = [post for post in posts.values() if match_criteria(post)]
 
         # Sort the posts in ascending order based on the 'create_at' timestamp
         sorted_filtered_posts = sorted(filtered_posts, key=lambda post: post['create_at'])
 
         return sorted_filtered_posts
 
-    def _follow_thread_for_users(self, onoff: bool, post_id: str, user_ids: Union[list, set, str]):
+    def _follow_thread_for_users(self, onoff: bool, post_id: str, user_ids: Union[list, set, str]) -> Dict[str, bool]:
         """
-        Follow/Unfollow a thread for a specific user.
+        Follow/Unfollow a thread for specific users.
+
+        The requests share the pooled connections of the driver and are sent
+        concurrently. Failures are reported by a warning.
 
         Args:
             post_id (str): The ID of a post within the thread.
             user_ids (list/set/str): The IDs of the users whose follow status should be changed.
+
+        Returns:
+            A dictionary where keys are user_ids and values are whether the change succeeded.
         """
         # If in stdout_mode, print the action and return
         if self.stdout_mode:
             follow_str = "Follow" if onoff else "Unfollow"
             print(f"{follow_str} action called for post ID '{post_id}' for user IDs '{user_ids}'")
-        else:
-            # Actually perform the follow/unfollow action
-            # Get the thread_id from the post_id
-            thread_id = self.all_posts['posts'][post_id]['root_id'] or post_id
+            return dict.fromkeys(user_ids.split() if isinstance(user_ids, str) else user_ids, True)
 
-            # Stop the user following the thread
-            if isinstance(user_ids, str):
-                user_ids = user_ids.split()
+        if isinstance(user_ids, str):
+            user_ids = user_ids.split()
+        user_ids = list(user_ids)
 
-            for user_id in user_ids:
-                stop_url = os.path.join(self.base_url, "users", user_id, "teams", self.team_id, "threads", thread_id, "following")
-                if onoff == True:
-                    requests.put(stop_url, headers=self.headers)
-                else:
-                    requests.delete(stop_url, headers=self.headers)
-        return
+        # Actually perform the follow/unfollow action
+        # Get the thread_id from the post_id
+        thread_id = self.all_posts['posts'][post_id]['root_id'] or post_id
+        method = "put" if onoff else "delete"
+
+        def change_following(user_id):
+            try:
+                self.mm_driver.client.make_request(method, self._following_endpoint(user_id, thread_id))
+                return None
+            except Exception as e:
+                return e
+
+        if not user_ids:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.follow_workers, len(user_ids))) as executor:
+            errors = dict(zip(user_ids, executor.map(propagate_context(change_following), user_ids)))
+
+        return self._report_following_errors(onoff, thread_id, errors)
+
+    def _following_endpoint(self, user_id: str, thread_id: str) -> str:
+        return f"/api/v4/users/{user_id}/teams/{self.team_id}/threads/{thread_id}/following"
+
+    @staticmethod
+    def _report_following_errors(onoff: bool, thread_id: str, errors: Dict[str, Optional[Exception]]) -> Dict[str, bool]:
+        """
+        Warn about the failed follow/unfollow requests in one message.
+
+        Returns:
+            A dictionary where keys are user_ids and values are whether the change succeeded.
+        """
+        user_ids = list(errors)
+        failures = {user_id: error for user_id, error in errors.items() if error is not None}
+        if failures:
+            follow_str = "follow" if onoff else "unfollow"
+            warnings.warn(
+                f"Failed to {follow_str} thread '{thread_id}' for {len(failures)} of {len(user_ids)} users: "
+                + ", ".join(f"{user_id} ({error})" for user_id, error in failures.items())
+            )
+        return {user_id: error is None for user_id, error in errors.items()}
 
     def follow_thread_for_users(self, *args):
         return self._follow_thread_for_users(True, *args)
@@ -511,6 +2621,254 @@ class MattermostChannel:
         return target_time
 
 
+class AsyncMattermostChannel(MattermostChannel):
+    """
+    Asyncio variant of MattermostChannel.
+
+    All requests go through one AsyncDriver, so they share a single pool of
+    connections, and the independent ones (member and post pages, profiles,
+    follow/unfollow) are awaited together. Create it by `await create(...)`,
+    and `await close()` it when done.
+
+    Methods without requests (get_last_post_datetimes, filter_posts_by_criteria, ...)
+    are the synchronous ones of MattermostChannel. send_post, refresh, apply_event
+    and follow/unfollow are coroutines.
+    """
+    def __init__(self,
+        driver_params: Dict,
+        team_name: str = "main",
+        channel_name: str = "",
+        channel_id: Optional[str] = None,
+        after_weeksago: Optional[int] = None,
+        stdout_mode: bool = False,
+        week_shift_hours: int = 0,
+        post_store: Optional[PostStore] = None,
+        columnar: bool = False,
+        fetch_workers: int = 4,
+        follow_workers: int = 8,
+        mm_driver: Optional[AsyncDriver] = None,
+        user_cache: Optional[UserCache] = None,
+    ):
+        """Only sets the configuration. Use create() to get a fetched channel."""
+        self._configure(
+            team_name, channel_name, channel_id, after_weeksago, stdout_mode,
+            week_shift_hours, post_store, columnar, fetch_workers, follow_workers, user_cache,
+        )
+        self._owns_driver = mm_driver is None
+        self.mm_driver = new_driver(driver_params, AsyncDriver) if self._owns_driver else mm_driver
+        self._async_update_lock = asyncio.Lock()
+
+    @classmethod
+    async def create(cls, driver_params: Dict, *args, **kwargs) -> "AsyncMattermostChannel":
+        """
+        Log in and fetch the channel. Takes the same arguments as MattermostChannel.
+        """
+        self = cls(driver_params, *args, **kwargs)
+        try:
+            if self._owns_driver:
+                await self.mm_driver.login()
+            if not self.channel_id:
+                self.channel_id = await self._get_channel_id()
+            channel, user_ids, _ = await asyncio.gather(
+                self.mm_driver.channels.get_channel(self.channel_id),
+                self._fetch_user_ids(),
+                self._fetch_posts(),
+            )
+            self.team_id = channel["team_id"]
+            await self._load_users(user_ids)
+        except BaseException:
+            await self.close()
+            raise
+        return self
+
+    def __del__(self):
+        pass  # close() must be awaited explicitly.
+
+    async def close(self):
+        """Log out and close the connections, unless the driver was given."""
+        if not self._owns_driver:
+            return
+        try:
+            if self.mm_driver.client.token:
+                await self.mm_driver.logout()
+        finally:
+            await self.mm_driver.client.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _get_channel_id(self) -> str:
+        channel = await self.mm_driver.channels.get_channel_by_name_for_team_name(self.team_name, self.channel_name)
+        return channel['id']
+
+    async def _load_users(self, user_ids: List[str]):
+        self._set_users(user_ids, await self._fetch_users(self._missing_user_ids(user_ids)))
+
+    async def _fetch_users(self, user_ids: Optional[List[str]] = None, chunk_size: int = 100) -> List[Dict]:
+        if user_ids is None:
+            user_ids = self.user_ids
+        chunks = [user_ids[i:i+chunk_size] for i in range(0, len(user_ids), chunk_size)]
+        results = await asyncio.gather(*(self.mm_driver.users.get_users_by_ids(chunk) for chunk in chunks))
+
+        fetched = {user["id"]: user for result in results for user in result}
+        return [fetched[user_id] for user_id in user_ids if user_id in fetched]
+
+    async def _fetch_user_ids(self, per_page: int = 200) -> List[str]:
+        user_ids = []
+        page = 0
+        while True:
+            members = await self.mm_driver.channels.get_channel_members(self.channel_id, params={"page": page, "per_page": per_page})
+            user_ids.extend(member["user_id"] for member in members)
+            if len(members) < per_page:
+                break
+            page += 1
+        return user_ids
+
+    async def _fetch_post_pages(self, since: int, page_size: int = MAX_PAGE_SIZE) -> Dict:
+        """
+        Coroutine version of MattermostChannel._fetch_post_pages(), with the
+        same requests as _iter_post_pages().
+        """
+        page_size = min(page_size, MAX_PAGE_SIZE)
+        aggregated_posts = {'posts': {}, 'order': []}
+        before = None
+        if since > 0:
+            posts = await self.mm_driver.client.get(**self._post_page_request(since, page_size))
+            self._merge_post_page(aggregated_posts, posts)
+            if len(posts['order']) < SINCE_POST_LIMIT:
+                return aggregated_posts
+            before = self._before_anchor(posts)
+
+        tasks = {}
+        page = 0
+        previous_ids = set()
+        window = 1 if before is None else self.fetch_workers
+        try:
+            while True:
+                for ahead in range(page, page + window):
+                    if ahead not in tasks:
+                        tasks[ahead] = asyncio.ensure_future(
+                            self.mm_driver.client.get(**self._post_page_request(since, page_size, ahead, before))
+                        )
+                window = self.fetch_workers
+                posts, has_next = self._take_post_page(await tasks.pop(page), previous_ids, page_size, since, before)
+                if posts is None:
+                    break
+                self._merge_post_page(aggregated_posts, posts)
+                if not has_next:
+                    break
+                page += 1
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        return aggregated_posts
+
+    @timed
+    async def _fetch_posts(self, page_size=MAX_PAGE_SIZE) -> Dict:
+        # The post store and the indexing run in threads, off the event loop.
+        since, sync_state = await asyncio.to_thread(self._prepare_post_fetch)
+        fetched_posts = await self._fetch_post_changes(sync_state[1]) if sync_state else None
+        if fetched_posts is None:
+            sync_state = None
+            fetched_posts = await self._fetch_post_pages(since, page_size)
+        return await asyncio.to_thread(self._complete_post_fetch, since, sync_state, fetched_posts)
+
+    async def _fetch_post_changes(self, since: int) -> Optional[Dict]:
+        posts = await self.mm_driver.client.get(**self._post_page_request(max(since, 1), MAX_PAGE_SIZE))
+        return self._post_changes(posts)
+
+    async def refresh(self, page_size=MAX_PAGE_SIZE) -> int:
+        """
+        Coroutine version of MattermostChannel.refresh(). The members and the
+        modified posts are fetched concurrently.
+        """
+        async with self._async_update_lock:
+            user_ids, changes = await asyncio.gather(
+                self._fetch_user_ids(),
+                self._fetch_post_changes(self.synced_at),
+            )
+            if set(user_ids) != set(self.user_ids):
+                await self._load_users(user_ids)
+
+            if changes is None:
+                await self._fetch_posts(page_size)
+                return len(self.all_posts['posts'])
+            return await asyncio.to_thread(self._merge_post_changes, changes['posts'])
+
+    async def apply_event(self, event: Dict) -> bool:
+        """
+        Coroutine version of MattermostChannel.apply_event().
+        """
+        async with self._async_update_lock:
+            user_ids = self._members_after_event(event)
+            if user_ids is not None:
+                await self._load_users(user_ids)
+                return True
+            return await asyncio.to_thread(self._apply_post_event, event)
+
+    async def send_post(self, message: str, props: Optional[Dict] = None, root_id: Optional[str] = None, pending_post_id: Optional[str] = None) -> Dict:
+        if self.stdout_mode:
+            return super().send_post(message, props, root_id, pending_post_id)
+        try:
+            response = await self.mm_driver.posts.create_post(self._post_payload(message, props, root_id, pending_post_id))
+            return 'id' in response
+        except Exception as e:
+            warnings.warn(f"Failed to send a post: {e}")
+            return False
+
+    async def find_sent_post(self, props: Optional[Dict], root_id: Optional[str], pending_post_id: Optional[str], since: int) -> Optional[Dict]:
+        if self.stdout_mode:
+            return None
+        posts = await self.mm_driver.client.get(**self._post_page_request(max(since, 1), MAX_PAGE_SIZE))
+        return self._find_sent_post(posts, props, root_id, pending_post_id)
+
+    async def _follow_thread_for_users(self, onoff: bool, post_id: str, user_ids: Union[list, set, str]) -> Dict[str, bool]:
+        """
+        Coroutine version of MattermostChannel._follow_thread_for_users().
+        At most `self.follow_workers` requests are in flight.
+        """
+        if self.stdout_mode:
+            return super()._follow_thread_for_users(onoff, post_id, user_ids)
+
+        if isinstance(user_ids, str):
+            user_ids = user_ids.split()
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+
+        thread_id = self.all_posts['posts'][post_id]['root_id'] or post_id
+        method = "put" if onoff else "delete"
+        semaphore = asyncio.Semaphore(self.follow_workers)
+
+        async def change_following(user_id):
+            async with semaphore:
+                try:
+                    await self.mm_driver.client.make_request(method, self._following_endpoint(user_id, thread_id))
+                    return None
+                except Exception as e:
+                    return e
+
+        errors = dict(zip(user_ids, await asyncio.gather(*(change_following(user_id) for user_id in user_ids))))
+        return self._report_following_errors(onoff, thread_id, errors)
+
+    async def follow_thread_for_users(self, *args):
+        return await self._follow_thread_for_users(True, *args)
+
+    async def unfollow_thread_for_users(self, *args):
+        return await self._follow_thread_for_users(False, *args)
+
+
+# Named views for MattermostChannel.get_last_post_datetimes_by_views().
+LAST_POST_VIEWS = {
+    "all": {},
+    "standard_thread_head": {"priority_filter": "standard", "is_thread_head": True},
+    "important": {"priority_filter": "important"},
+}
+
 def load_tsv_data(file_path: str) -> Dict[int, str]:
     data = {}
     with open(file_path, 'r', encoding='utf-8') as f:
@@ -537,6 +2895,31 @@ def load_tsv_data(file_path: str) -> Dict[int, str]:
             data[week_number] = re.sub(r'\\n', '\n', parts[1])
     return data
 
+def load_channel_configs(file_path: str, default_message_file: str) -> List[Dict[str, str]]:
+    """
+    Load the channels to process from a TSV file.
+
+    Each line is "team<TAB>channel", optionally followed by "<TAB>message-file".
+    """
+    configs = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            # Skip comments and empty lines
+            if not line or line.startswith('#'):
+                continue
+
+            parts = line.split('\t')
+            if len(parts) < 2 or not parts[0] or not parts[1]:
+                continue
+
+            configs.append({
+                "team": parts[0],
+                "channel": parts[1],
+                "message_file": parts[2] if len(parts) > 2 and parts[2] else default_message_file,
+            })
+    return configs
+
 def load_envs():
     app_dir = os.path.join(os.path.expanduser("~"), ".relayreminder")
     env_path = os.path.join(app_dir, "env")
@@ -557,6 +2940,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--port", type=int, default=int(os.environ.get("RELAYREMINDER_PORT", 443)), help="Mattermost Port")
     parser.add_argument("--team", type=str, default=os.environ.get("RELAYREMINDER_TEAM", "main"), help="Team name")
     parser.add_argument("--channel", type=str, default=os.environ.get("RELAYREMINDER_CHANNEL", "RelayPosts"), help="Channel name")
+    parser.add_argument("--channel-config", type=str, default=os.environ.get("RELAYREMINDER_CHANNEL_CONFIG", ""), help="Path to the TSV file listing team, channel (and message file) to process in one run. Overrides --team and --channel.")
     parser.add_argument("--message-file", type=str, default=os.environ.get("RELAYREMINDER_MESSAGE_FILE", os.path.join(os.path.expanduser("~"), ".relayreminder", "messages.tsv")), help="Path to the TSV file containing week intervals & reminder messages.")
     parser.add_argument("--mention-format", type=str, default=os.environ.get("RELAYREMINDER_MENTION_FORMAT", "{}"), help="Path to the TSV file containing week intervals & reminder messages.")
     parser.add_argument("--stdout-mode", action="store_true", 
@@ -566,6 +2950,14 @@ def parse_args() -> argparse.Namespace:
                         default=bool(strtobool(os.environ.get("RELAYREMINDER_ALL_HISTORY", "false"))),
                         help="Search all history of the channel.")
     parser.add_argument("--week-shift-hours", type=int, default=int(os.environ.get("RELAYREMINDER_WEEK_SHIFT_HOURS", 0)), help="Shift the beginning of weeks by n-hours.")
+    parser.add_argument("--streaming", action="store_true",
+                        default=bool(strtobool(os.environ.get("RELAYREMINDER_STREAMING", "false"))),
+                        help="Reduce the posts to the ones deciding the reminders while they are fetched, instead of holding them all (for long histories).")
+    parser.add_argument("--columnar", action="store_true",
+                        default=bool(strtobool(os.environ.get("RELAYREMINDER_COLUMNAR", "false"))),
+                        help="Hold posts as NumPy arrays for vectorized computation (for long histories).")
+    parser.add_argument("--fetch-workers", type=int, default=int(os.environ.get("RELAYREMINDER_FETCH_WORKERS", 4)), help="Number of pages of posts fetched concurrently.")
+    parser.add_argument("--post-cache", type=str, default=os.environ.get("RELAYREMINDER_POST_CACHE", ""), help="Path to the local post store (SQLite), e.g. ~/.relayreminder/posts.sqlite3. Disabled by default.")
 
     # slashcommand mode
     parser.add_argument("--slashcommand-mode", action="store_true",
@@ -573,9 +2965,21 @@ def parse_args() -> argparse.Namespace:
                         help="Work in slashcommand-mode.")
     parser.add_argument("--slashcommand-host", default=os.environ.get("RELAYREMINDER_SLASHCOMMAND_HOST", "0.0.0.0"), help="Slash-command listening host (default: %(default)s)")
     parser.add_argument("--slashcommand-port", type=int, default=os.environ.get("RELAYREMINDER_SLASHCOMMAND_PORT", 4500), help='Slash-command listening port')
+    parser.add_argument("--asgi", action="store_true",
+                        default=bool(strtobool(os.environ.get("RELAYREMINDER_ASGI", "false"))),
+                        help="Serve the slash-commands by the ASGI app (relayreminder:asgi_app) on Uvicorn, with non-blocking requests to Mattermost.")
     parser.add_argument("--gunicorn-path", default=os.environ.get("RELAYREMINDER_GUNICORN_PATH", ""), help="Path to Gunicorn executable (if not provided, Flask built-in server will be used)")
     parser.add_argument("--workers", type=int, default=os.environ.get("RELAYREMINDER_WORKERS", 1), help="Number of Gunicorn worker processes (only applicable if using Gunicorn)")
     parser.add_argument("--timeout", type=int, default=os.environ.get("RELAYREMINDER_TIMEOUT", 30), help="Gunicorn timeout value in seconds (only applicable if using Gunicorn)")
+    parser.add_argument("--refresh-interval", type=float, default=os.environ.get("RELAYREMINDER_REFRESH_INTERVAL", 60), help="Interval in seconds to refresh the channel snapshots in the background. 0 disables the refresh.")
+    parser.add_argument("--websocket", action="store_true",
+                        default=bool(strtobool(os.environ.get("RELAYREMINDER_WEBSOCKET", "false"))),
+                        help="Keep the channel snapshots current from the Mattermost websocket events.")
+    parser.add_argument("--snapshot-dir", type=str, default=os.environ.get("RELAYREMINDER_SNAPSHOT_DIR", ""), help="Directory of the channel snapshots shared by the Gunicorn workers: one worker keeps the channels and publishes them, the others map them read-only. Empty string disables it.")
+    parser.add_argument("--snapshot-idle-timeout", type=float, default=os.environ.get("RELAYREMINDER_SNAPSHOT_IDLE_TIMEOUT", 600), help="Seconds after which the snapshot of a channel other than the relay channels is dropped if no command used it, e.g. the channels of /whenmylast. 0 keeps them.")
+    parser.add_argument("--defer-after", type=float, default=os.environ.get("RELAYREMINDER_DEFER_AFTER", 2), help="Seconds a slash-command may take before it is acknowledged by --deferred-message and its response is sent to its response_url. Negative never defers.")
+    parser.add_argument("--deferred-message", type=str, default=os.environ.get("RELAYREMINDER_DEFERRED_MESSAGE", "Working on it..."), help="Acknowledgement of a deferred slash-command")
+    parser.add_argument("--command-workers", type=int, default=int(os.environ.get("RELAYREMINDER_COMMAND_WORKERS", 8)), help="Number of threads computing the slash-command responses in each worker of the Flask server")
     parser.add_argument("--blacklist-message-min", type=str, default=os.environ.get("RELAYREMINDER_BLACKLIST_MESSAGE_MIN", "No relay-posts >= {} weeks:"), help="Default leading message for /blacklist min")
     parser.add_argument("--blacklist-message-minmax", type=str, default=os.environ.get("RELAYREMINDER_BLACKLIST_MESSAGE_MINMAX", "No relay-posts for {}-{} weeks:"), help="Default leading message for /blacklist min max")
     parser.add_argument("--blacklist-minweek-default", type=int, default=os.environ.get("RELAYREMINDER_BLACKLIST_MINWEEK_DEFAULT", 13), help="Default minweek for /blacklist")
@@ -593,19 +2997,32 @@ def parse_args() -> argparse.Namespace:
     os.environ["RELAYREMINDER_PORT"] = str(args.port)
     os.environ["RELAYREMINDER_TEAM"] = args.team
     os.environ["RELAYREMINDER_CHANNEL"] = args.channel
+    os.environ["RELAYREMINDER_CHANNEL_CONFIG"] = args.channel_config
     os.environ["RELAYREMINDER_MESSAGE_FILE"] = args.message_file
     os.environ["RELAYREMINDER_MENTION_FORMAT"] = args.mention_format
     os.environ["RELAYREMINDER_STDOUT_MODE"] = str(args.stdout_mode)
     os.environ["RELAYREMINDER_ALL_HISTORY"] = str(args.all_history)
     os.environ["RELAYREMINDER_WEEK_SHIFT_HOURS"] = str(args.week_shift_hours)
+    os.environ["RELAYREMINDER_STREAMING"] = str(args.streaming)
+    os.environ["RELAYREMINDER_COLUMNAR"] = str(args.columnar)
+    os.environ["RELAYREMINDER_FETCH_WORKERS"] = str(args.fetch_workers)
+    os.environ["RELAYREMINDER_POST_CACHE"] = args.post_cache
 
     # slashcommand mode
     os.environ["RELAYREMINDER_SLASHCOMMAND_MODE"] = str(args.slashcommand_mode)
     os.environ["RELAYREMINDER_SLASHCOMMAND_HOST"] = args.slashcommand_host
     os.environ["RELAYREMINDER_SLASHCOMMAND_PORT"] = str(args.slashcommand_port)
+    os.environ["RELAYREMINDER_ASGI"] = str(args.asgi)
     os.environ["RELAYREMINDER_GUNICORN_PATH"] = args.gunicorn_path
     os.environ["RELAYREMINDER_WORKERS"] = str(args.workers)
     os.environ["RELAYREMINDER_TIMEOUT"] = str(args.timeout)
+    os.environ["RELAYREMINDER_REFRESH_INTERVAL"] = str(args.refresh_interval)
+    os.environ["RELAYREMINDER_WEBSOCKET"] = str(args.websocket)
+    os.environ["RELAYREMINDER_SNAPSHOT_DIR"] = args.snapshot_dir
+    os.environ["RELAYREMINDER_SNAPSHOT_IDLE_TIMEOUT"] = str(args.snapshot_idle_timeout)
+    os.environ["RELAYREMINDER_DEFER_AFTER"] = str(args.defer_after)
+    os.environ["RELAYREMINDER_DEFERRED_MESSAGE"] = args.deferred_message
+    os.environ["RELAYREMINDER_COMMAND_WORKERS"] = str(args.command_workers)
     os.environ["RELAYREMINDER_BLACKLIST_MESSAGE_MIN"] = args.blacklist_message_min
     os.environ["RELAYREMINDER_BLACKLIST_MESSAGE_MINMAX"] = args.blacklist_message_minmax
     os.environ["RELAYREMINDER_BLACKLIST_MINWEEK_DEFAULT"] = str(args.blacklist_minweek_default)
@@ -615,26 +3032,46 @@ def parse_args() -> argparse.Namespace:
 
     return args
 
-def args2mm_channel(args: argparse.Namespace, max_week_limit: int=100):
-    driver_params = {
+def args2post_store(args: argparse.Namespace) -> Optional[PostStore]:
+    if not args.post_cache:
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(args.post_cache)), exist_ok=True)
+    return PostStore(args.post_cache)
+
+def args2driver_params(args: argparse.Namespace) -> Dict:
+    return {
         "url": args.mm_url,
         "scheme": args.scheme,
         "port": args.port,
         "token": args.bot_token
     }
 
+def args2mm_channel(args: argparse.Namespace, max_week_limit: int=100,
+    team: Optional[str] = None,
+    channel: Optional[str] = None,
+    mm_driver: Optional[Driver] = None,
+    user_cache: Optional[UserCache] = None,
+    post_store: Optional[PostStore] = None,
+    post_digest: Optional[PostDigest] = None,
+):
     if args.all_history:
         after_weeksago = None
     else:
         after_weeksago = max_week_limit
 
     mm_channel = MattermostChannel(
-        driver_params,
-        args.team,
-        args.channel,
+        args2driver_params(args),
+        team or args.team,
+        channel or args.channel,
         after_weeksago = after_weeksago,
         stdout_mode = args.stdout_mode,
         week_shift_hours = args.week_shift_hours,
+        post_store = post_store if post_store is not None else args2post_store(args),
+        columnar = args.columnar,
+        fetch_workers = args.fetch_workers,
+        mm_driver = mm_driver,
+        user_cache = user_cache,
+        post_digest = post_digest,
     )
     return mm_channel
 
@@ -650,7 +3087,11 @@ def post_records(mm_channel: MattermostChannel, app_name: str):
     )
 
     # Convert dates to week numbers
-    last_post_weeks = {user_id: mm_channel.get_week_number(datetime_) for user_id, datetime_ in last_post_datetimes.items()}
+    if mm_channel.columnar_posts is not None:
+        weeks = mm_channel.get_week_numbers(list(last_post_datetimes.values()))
+        last_post_weeks = dict(zip(last_post_datetimes.keys(), weeks.tolist()))
+    else:
+        last_post_weeks = {user_id: mm_channel.get_week_number(datetime_) for user_id, datetime_ in last_post_datetimes.items()}
 
     # Find users and message based on last post week number
     users_to_notify = {}
@@ -662,41 +3103,82 @@ def post_records(mm_channel: MattermostChannel, app_name: str):
     # Post messages
     result = []
     for week, user_ids in sorted(users_to_notify.items(), key=lambda x: x[0]):
-        criteria = {
-            "props": {
-                "bot_app": app_name,
-                "type": "record",
-                "last_post_week": week,
-            }
-        }
-        matching_posts = mm_channel.filter_posts_by_criteria(criteria)
-        # Find the matching post with maximum weeks passed
-        last_passed_weeks = max([post['props']['passed_weeks'] for post in matching_posts], default=-1)
+        matching_posts = mm_channel.record_table.week_posts(week, app_name)
+        # The maximum weeks passed among the matching posts
+        last_passed_weeks = mm_channel.record_table.max_passed_weeks(week, app_name)
         sorted_user_ids = sorted(user_ids, key=lambda uid: (last_post_datetimes[uid], uid))
         result.append((week, last_passed_weeks, matching_posts, sorted_user_ids))
     return result
 
-def main(args: argparse.Namespace, max_week_limit: int=100):
-    mm_channel = args2mm_channel(args, max_week_limit)
+class ReminderAction:
+    """
+    A side effect of a reminder run, planned by plan_reminders() and executed
+    by dispatch_reminders():
+    - "post": send_post() of `message` and `props` to the thread `root_id`
+      (to the channel if None), with `pending_post_id` so that a retry
+      creates the post once.
+    - "unfollow": unfollow_thread_for_users() of the thread of `post_id` for `user_ids`.
+
+    `thread` is the thread the action changes, or None for the posts to the
+    channel itself. The actions of a thread are executed in the planned order.
+    """
+    __slots__ = ('kind', 'thread', 'message', 'props', 'root_id', 'pending_post_id', 'post_id', 'user_ids')
+
+    def __init__(self,
+        kind: str,
+        thread: Optional[str],
+        message: str = "",
+        props: Optional[Dict] = None,
+        root_id: Optional[str] = None,
+        pending_post_id: Optional[str] = None,
+        post_id: Optional[str] = None,
+        user_ids: Optional[List[str]] = None,
+    ):
+        self.kind = kind
+        self.thread = thread
+        self.message = message
+        self.props = props
+        self.root_id = root_id
+        self.pending_post_id = pending_post_id
+        self.post_id = post_id
+        self.user_ids = user_ids
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"ReminderAction({self.to_dict()!r})"
+
+def plan_reminders(mm_channel: MattermostChannel, args: argparse.Namespace, message_file: str) -> List[ReminderAction]:
+    """
+    Decide the reminders of a channel, without any request to the server.
+
+    For each week bucket due for a reminder, the users of the previous
+    reminder who have posted since are unfollowed from its thread before and
+    after the new reminder is posted to it.
 
+    Returns:
+        The actions, in order within each thread.
+    """
     if args.initialize:
-        mm_channel.send_post(
-            "Administration thread.",
-            props={
+        return [ReminderAction(
+            "post", None,
+            message = "Administration thread.",
+            props = {
                 "bot_app": args.app_name,
                 "type": "relaystop",
                 "data": dict(),
             },
-        )
-        return
+        )]
 
     # Load message data
-    message_data = load_tsv_data(args.message_file)
+    message_data = load_tsv_data(message_file)
     message_passed_weeks_list = sorted(message_data.keys())
     max_week_limit = message_passed_weeks_list[-1]
 
     current_week_number = mm_channel.get_week_number(datetime.now())
 
+    actions = []
     for week, last_passed_weeks, matching_posts, user_ids in post_records(mm_channel, args.app_name):
         passed_weeks = current_week_number - week
         if passed_weeks <= last_passed_weeks:
@@ -712,28 +3194,639 @@ def main(args: argparse.Namespace, max_week_limit: int=100):
 
             message = f"{message_start}\n{mentions}"
 
+            unfollow = None
             if matching_posts:
                 post = matching_posts[-1]
                 post_id = post['id']
                 root_id = post['root_id'] or post_id
-                mm_channel.unfollow_thread_for_users(post_id, set(post['props']['users']) - set(user_ids))
+                unfollowed_user_ids = sorted(set(post['props']['users']) - set(user_ids))
+                if unfollowed_user_ids:
+                    unfollow = ReminderAction("unfollow", root_id, post_id=post_id, user_ids=unfollowed_user_ids)
             else:
                 root_id = None
 
-            mm_channel.send_post(
-                message,
-                props={
+            if unfollow:
+                actions.append(unfollow)
+            actions.append(ReminderAction(
+                "post", root_id,
+                message = message,
+                props = {
                     "bot_app": args.app_name,
                     "type": "record",
                     "last_post_week": week,
                     "passed_weeks": passed_weeks,
                     "users": user_ids,
                 },
-                root_id=root_id,
+                root_id = root_id,
+                # Unique to the reminder: a week bucket is reminded once for each passed_weeks.
+                pending_post_id = f"{mm_channel.channel_id}:{week}:{passed_weeks}",
+            ))
+            if unfollow:
+                actions.append(unfollow)
+
+    return actions
+
+def dispatch_reminders(mm_channel: MattermostChannel, actions: List[ReminderAction], max_workers: int = 4, max_attempts: int = 3, retry_backoff: float = 1) -> List[Dict]:
+    """
+    Execute the planned actions. The threads are processed concurrently, and
+    the actions of each thread in order. A failed action is retried up to
+    `max_attempts` times, doubling the wait from `retry_backoff` seconds. The
+    retries are idempotent: a post is first looked for by find_sent_post(),
+    as its pending_post_id may have expired on the server, and only the
+    users not unfollowed yet are unfollowed again.
+
+    Returns:
+        For each action in the given order, {"action": the action,
+        "ok": whether it succeeded, "attempts": number of attempts,
+        "latency": seconds until it succeeded or was given up}.
+    """
+    results = [None] * len(actions)
+    threads = {}
+    for i, action in enumerate(actions):
+        threads.setdefault(action.thread, []).append(i)
+
+    def run_thread(indices: List[int]):
+        for i in indices:
+            action = actions[i]
+            user_ids = action.user_ids
+            start = time.perf_counter()
+            # Earlier than the first attempt by the clock differences the server may have.
+            sent_since = int(time.time() * 1000) - SENT_POST_LOOKBACK
+            for attempt in range(1, max_attempts + 1):
+                if action.kind == "post":
+                    try:
+                        sent = attempt > 1 and mm_channel.find_sent_post(action.props, action.root_id, action.pending_post_id, sent_since)
+                    except Exception as e:
+                        # Unknown whether the post was made: sending it could double it.
+                        warnings.warn(f"Failed to look for a sent post: {e}")
+                        ok = False
+                    else:
+                        ok = bool(sent) or mm_channel.send_post(action.message, action.props, action.root_id, action.pending_post_id)
+                else:
+                    succeeded = mm_channel.unfollow_thread_for_users(action.post_id, user_ids)
+                    # Retried for the failed users only.
+                    user_ids = [user_id for user_id in user_ids if not succeeded.get(user_id)]
+                    ok = not user_ids
+                if ok or attempt == max_attempts:
+                    break
+                time.sleep(retry_backoff * 2 ** (attempt - 1))
+            results[i] = {"action": action, "ok": bool(ok), "attempts": attempt, "latency": time.perf_counter() - start}
+            if not ok:
+                warnings.warn(f"Gave up the {action.kind} action of thread '{action.thread}' after {attempt} attempts.")
+
+    if threads:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(threads))) as executor:
+            list(executor.map(propagate_context(run_thread), threads.values()))
+    return results
+
+def remind_channel(mm_channel: MattermostChannel, args: argparse.Namespace, message_file: str) -> Dict:
+    """
+    Post the reminders of a channel: plan_reminders(), then dispatch_reminders().
+    In stdout-mode the plan is printed, one JSON line for each action, instead.
+
+    Returns:
+        {"reminders": number of the reminders posted, "actions": the results of dispatch_reminders()}.
+    """
+    actions = plan_reminders(mm_channel, args, message_file)
+    if mm_channel.stdout_mode:
+        for action in actions:
+            print(json.dumps(dict(action.to_dict(), channel_id=mm_channel.channel_id), ensure_ascii=False))
+        results = [{"action": action, "ok": True, "attempts": 0, "latency": 0.0} for action in actions]
+    else:
+        results = dispatch_reminders(mm_channel, actions, max_workers=mm_channel.follow_workers)
+    reminders = sum(1 for result in results if result["ok"] and result["action"].kind == "post" and result["action"].props["type"] == "record")
+    return {"reminders": reminders, "actions": results}
+
+def main(args: argparse.Namespace, max_week_limit: int=100) -> Dict[str, Dict]:
+    """
+    Run the reminders of all the configured channels.
+
+    The channels (--channel-config, or --team and --channel) are processed
+    concurrently, sharing one login with its connection pool, the user profiles
+    and the post store. A failing channel is reported and does not stop the others.
+
+    Returns:
+        A dictionary where keys are "team/channel" and values are
+        {"reminders": number of the reminders posted, "actions": the actions
+        with their outcome and latency (see dispatch_reminders()), "error": the exception or None}.
+    """
+    if args.channel_config:
+        channel_configs = load_channel_configs(args.channel_config, args.message_file)
+    else:
+        channel_configs = [{"team": args.team, "channel": args.channel, "message_file": args.message_file}]
+    if not channel_configs:
+        return {}
+
+    mm_driver = new_driver(args2driver_params(args))
+    mm_driver.login()
+    user_cache = UserCache()
+    post_store = args2post_store(args)
+
+    def run(config):
+        try:
+            mm_channel = args2mm_channel(
+                args, max_week_limit,
+                team = config["team"],
+                channel = config["channel"],
+                mm_driver = mm_driver,
+                user_cache = user_cache,
+                post_store = post_store,
+                post_digest = PostDigest(args.app_name) if args.streaming else None,
             )
+            return dict(remind_channel(mm_channel, args, config["message_file"]), error=None)
+        except Exception as e:
+            return {"reminders": 0, "actions": [], "error": e}
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(MAX_CHANNEL_WORKERS, len(channel_configs))) as executor:
+            channel_results = list(executor.map(run, channel_configs))
+    finally:
+        mm_driver.logout()
+
+    results = {}
+    for config, result in zip(channel_configs, channel_results):
+        name = f"{config['team']}/{config['channel']}"
+        results[name] = result
+        if result["error"] is not None:
+            warnings.warn(
+                f"Failed to process channel '{name}':\n"
+                + "".join(traceback.format_exception(type(result["error"]), result["error"], result["error"].__traceback__))
+            )
+    return results
 
-            if matching_posts:
-                mm_channel.unfollow_thread_for_users(post_id, set(post['props']['users']) - set(user_ids))
+
+class SnapshotStore:
+    """
+    Channel snapshots shared by the workers of a server through a directory.
+
+    The publisher writes each generation of a snapshot to a new file, then
+    points '<name>.current' at it by an atomic rename. The readers map the
+    current file and keep that generation until the pointer is replaced.
+    The previous generation is kept for the readers still opening it.
+    Workers ask the publisher for a snapshot by '<name>.request' files.
+    """
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.mapped = {}  # key -> (pointer stat, MattermostChannel)
+        self._lock_file = None
+
+    @staticmethod
+    def _name(key: tuple) -> str:
+        return re.sub(r"[^A-Za-z0-9_-]", "_", "-".join(key))
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
+
+    def _write_json(self, file_name: str, data: Dict):
+        tmp_path = self._path(f"{file_name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path(file_name))
+
+    def _read_json(self, file_name: str) -> Optional[Dict]:
+        try:
+            with open(self._path(file_name)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def try_lead(self) -> bool:
+        """
+        Become the publisher unless another worker is. The role is kept until
+        the process exits, when the lock is released for another worker.
+        """
+        if self._lock_file is None:
+            lock_file = open(self._path("publisher.lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file
+        return True
+
+    def publish(self, key: tuple, mm_channel: MattermostChannel):
+        """Write a new generation of the snapshot for `key` and make it current."""
+        name = self._name(key)
+        generation = time.time_ns()
+        file_name = f"{name}.{generation}.snap"
+        tmp_path = self._path(f"{file_name}.tmp")
+        with open(tmp_path, "wb") as f:
+            mm_channel.write_snapshot(f, generation)
+        os.replace(tmp_path, self._path(file_name))
+
+        previous = self._read_json(f"{name}.current")
+        self._write_json(f"{name}.current", {"key": list(key), "file": file_name})
+        # Readers map a generation once; the older files can go even if still mapped.
+        kept = {file_name, previous and previous["file"]}
+        for old_name in os.listdir(self.directory):
+            if old_name.startswith(f"{name}.") and old_name.endswith(".snap") and old_name not in kept:
+                os.remove(self._path(old_name))
+
+    def load(self, key: tuple, mm_driver: Driver) -> Optional[MattermostChannel]:
+        """
+        The channel of the current snapshot for `key`, mapped again only when
+        a new generation has been published. None if none is published yet.
+        """
+        name = self._name(key)
+        mapped = self.mapped.get(key)
+        try:
+            stat = os.stat(self._path(f"{name}.current"))
+        except FileNotFoundError:
+            self.mapped.pop(key, None)
+            return None
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if mapped is not None and mapped[0] == stamp:
+            return mapped[1]
+        pointer = self._read_json(f"{name}.current")
+        try:
+            with open(self._path(pointer["file"]), "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (TypeError, FileNotFoundError):
+            # Replaced while being read; the next call reads the new pointer.
+            return mapped and mapped[1]
+        mm_channel = MattermostChannel.from_snapshot(buffer, mm_driver)
+        self.mapped[key] = (stamp, mm_channel)
+        return mm_channel
+
+    def remove(self, key: tuple):
+        """Withdraw the snapshot for `key`. The readers mapping it keep their generation."""
+        name = self._name(key)
+        # The pointer first, so that no reader opens a generation being removed.
+        for file_name in [f"{name}.current"] + [
+            file_name for file_name in os.listdir(self.directory)
+            if file_name.startswith(f"{name}.") and file_name.endswith(".snap")
+        ]:
+            try:
+                os.remove(self._path(file_name))
+            except FileNotFoundError:
+                pass
+
+    def keys(self) -> List[tuple]:
+        """Keys of the published snapshots."""
+        pointers = (self._read_json(file_name) for file_name in os.listdir(self.directory) if file_name.endswith(".current"))
+        return [tuple(pointer["key"]) for pointer in pointers if pointer]
+
+    def request(self, key: tuple, refresh: bool = False):
+        """Ask the publisher for the snapshot for `key`, or for a refresh of it."""
+        self._write_json(f"{self._name(key)}.request", {"key": list(key), "refresh": refresh})
+
+    def requests(self) -> List[tuple]:
+        """Take the pending requests, as (key, refresh)."""
+        requests = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(".request"):
+                data = self._read_json(file_name)
+                try:
+                    os.remove(self._path(file_name))
+                except FileNotFoundError:
+                    pass
+                if data:
+                    requests.append((tuple(data["key"]), data["refresh"]))
+        return requests
+
+
+class ChannelSnapshots:
+    """
+    Long-lived MattermostChannel objects for the slash-command server.
+
+    Channels are created on first use by `factory(key)` and then kept up to
+    date by a background thread calling `MattermostChannel.refresh()`, and
+    optionally by the websocket event stream, so that the handlers can answer
+    from memory.
+
+    With a snapshot directory, only one worker of the server (the publisher)
+    keeps the channels, and publishes a snapshot of each on every change to a
+    SnapshotStore. The other workers answer from the mapped snapshots; until
+    the one they need is published, they use a channel of their own.
+
+    With `idle_timeout`, the channels not asked for in that many seconds are
+    dropped, and no longer refreshed, watched or published, but those of
+    `kept_keys`. The readers ask again for the snapshots they use, so that the
+    publisher keeps them.
+    """
+    def __init__(self,
+        factory: Callable[[tuple], MattermostChannel],
+        refresh_interval: float = 60,
+        use_websocket: bool = False,
+        snapshot_dir: str = "",
+        driver_params: Optional[Dict] = None,
+        idle_timeout: float = 0,
+        kept_keys: Iterable[tuple] = (),
+    ):
+        self.factory = factory
+        self.refresh_interval = refresh_interval
+        self.use_websocket = use_websocket
+        self.idle_timeout = idle_timeout
+        self.kept_keys = set(kept_keys)
+        self.used = {}  # key -> time.monotonic() of the last use
+        self.channels = {}
+        self.lock = threading.Lock()
+        self._creating = {}  # key -> Future of the channel being created
+        self._thread = None
+        self._listener = None
+
+        self.store = None
+        if snapshot_dir:
+            if np is None or fcntl is None:
+                warnings.warn("NumPy or fcntl is not available. The shared channel snapshots are disabled.")
+            else:
+                self.store = SnapshotStore(snapshot_dir)
+        self.driver_params = driver_params
+        self.publishing = False
+        self.published = {}  # key -> version of the channel last published
+        self.requested = {}  # key -> time.monotonic() of the last request
+        self._driver = None
+
+    def get(self, key: tuple) -> MattermostChannel:
+        """
+        Get the snapshot for `key`, creating it if it does not exist yet.
+        """
+        with self.lock:
+            self._start()
+            now = self.used[key] = time.monotonic()
+            if self.store is not None and not self.publishing:
+                was_mapped = key in self.store.mapped
+                mm_channel = self.store.load(key, self._shared_driver())
+                # Asked again when withdrawn, and now and then while in use so that the publisher keeps it.
+                requested = self.requested.get(key)
+                if (requested is None or (mm_channel is None and was_mapped)
+                        or (self.idle_timeout > 0 and now - requested >= self.idle_timeout / 2)):
+                    self.store.request(key)
+                    self.requested[key] = now
+                if mm_channel is not None:
+                    self.channels.pop(key, None)
+                    return mm_channel
+        return self._own(key)
+
+    def _own(self, key: tuple) -> MattermostChannel:
+        """
+        The channel of this worker for `key`. It is created by the factory
+        outside the lock, which would block the other keys for the whole
+        fetch; the concurrent calls for the same key wait for that creation.
+        """
+        with self.lock:
+            if key in self.channels:
+                return self.channels[key]
+            future = self._creating.get(key)
+            creating = future is None
+            if creating:
+                future = self._creating[key] = Future()
+        if not creating:
+            return future.result()
+        try:
+            mm_channel = self.factory(key)
+        except BaseException as e:
+            with self.lock:
+                del self._creating[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self._creating[key]
+            self.channels[key] = mm_channel
+            # The readers keep their channels only until the snapshot is published.
+            if self.store is None or self.publishing:
+                self._watch(mm_channel)
+        future.set_result(mm_channel)
+        return mm_channel
+
+    def latest(self, key: tuple) -> MattermostChannel:
+        """
+        A channel of this worker for `key`, refreshed from the server now. Never
+        a mapped snapshot, which may be behind the changes of the other workers.
+        """
+        if self.store is not None and not self.publishing and key not in self.channels:
+            # The readers keep no channel once the snapshot is mapped: one is fetched for this use.
+            return self.factory(key)
+        mm_channel = self._own(key)
+        mm_channel.refresh()
+        return mm_channel
+
+    def items(self) -> List[tuple]:
+        """(key, channel) answering in this worker: its own channels and the mapped snapshots."""
+        with self.lock:
+            items = {}
+            if self.store is not None and not self.publishing:
+                items.update((key, mapped[1]) for key, mapped in self.store.mapped.items())
+            items.update(self.channels)
+            return list(items.items())
+
+    def refresh(self, key: tuple):
+        if self.store is not None and not self.publishing:
+            self.store.request(key, refresh=True)
+        mm_channel = self.channels.get(key)
+        if mm_channel is not None:
+            mm_channel.refresh()
+
+    def _shared_driver(self) -> Driver:
+        """Driver of the mapped snapshots of this worker, logged in once."""
+        if self._driver is None:
+            self._driver = new_driver(self.driver_params)
+            self._driver.login()
+        return self._driver
+
+    def _watch(self, mm_channel: MattermostChannel):
+        if self.use_websocket:
+            if self._listener is None:
+                self._listener = ChannelEventListener(mm_channel.mm_driver)
+            self._listener.add_channel(mm_channel)
+            self._listener.start()
+
+    def _start(self):
+        # Started lazily so that each forked worker runs its own thread.
+        if self._thread is None and (self.refresh_interval > 0 or self.store is not None or self.idle_timeout > 0):
+            self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self):
+        # The requests of the other workers and the idle channels are polled every second.
+        if self.store is None and self.idle_timeout <= 0:
+            poll_interval = self.refresh_interval
+        else:
+            poll_interval = min(self.refresh_interval or 1, 1)
+        next_refresh = time.monotonic() + self.refresh_interval
+        while True:
+            time.sleep(poll_interval)
+            keys = set()
+            if self.store is not None:
+                try:
+                    keys = self._serve_requests()
+                except Exception as e:
+                    warnings.warn(f"Failed to serve the snapshot requests: {e}")
+            try:
+                self._evict()
+            except Exception as e:
+                warnings.warn(f"Failed to drop the idle snapshots: {e}")
+            if self.refresh_interval > 0 and time.monotonic() >= next_refresh:
+                next_refresh = time.monotonic() + self.refresh_interval
+                keys.update(self.channels.keys())
+            for key in keys:
+                mm_channel = self.channels.get(key)
+                try:
+                    if mm_channel is not None:
+                        mm_channel.refresh()
+                except Exception as e:
+                    warnings.warn(f"Failed to refresh the snapshot of {key}: {e}")
+            if self.publishing:
+                self._publish()
+
+    def _serve_requests(self) -> set:
+        """
+        As the publisher, create the channels asked by the workers. Returns the
+        keys to refresh now.
+        """
+        requests = []
+        if not self.publishing:
+            if not self.store.try_lead():
+                return set()
+            with self.lock:
+                self.publishing = True
+                for mm_channel in self.channels.values():
+                    self._watch(mm_channel)
+            # Take over the snapshots published before, e.g. by a previous publisher.
+            requests = [(key, True) for key in self.store.keys()]
+        requests += self.store.requests()
+
+        keys = set()
+        for key, refresh in requests:
+            with self.lock:
+                self.used[key] = time.monotonic()
+            if key in self.channels:
+                if refresh:
+                    keys.add(key)
+                continue
+            try:
+                self._own(key)
+            except Exception as e:
+                warnings.warn(f"Failed to create the snapshot of {key}: {e}")
+        return keys
+
+    def _evict(self):
+        """Drop the channels not asked for in idle_timeout seconds, but those of kept_keys."""
+        if self.idle_timeout <= 0:
+            return
+        deadline = time.monotonic() - self.idle_timeout
+        with self.lock:
+            idle = [key for key, used in self.used.items() if used < deadline and key not in self.kept_keys]
+            for key in idle:
+                del self.used[key]
+                self.requested.pop(key, None)
+                self.published.pop(key, None)
+                mm_channel = self.channels.pop(key, None)
+                if mm_channel is not None and self._listener is not None:
+                    self._listener.remove_channel(mm_channel)
+                if self.store is not None:
+                    self.store.mapped.pop(key, None)
+            publishing = self.publishing
+        if publishing:
+            for key in idle:
+                self.store.remove(key)
+
+    def _publish(self):
+        for key, mm_channel in list(self.channels.items()):
+            version = mm_channel.version
+            if self.published.get(key) == version:
+                continue
+            try:
+                self.store.publish(key, mm_channel)
+                self.published[key] = version
+            except Exception as e:
+                warnings.warn(f"Failed to publish the snapshot of {key}: {e}")
+
+
+class VersionedCache:
+    """
+    Results computed from a channel snapshot, kept while the version they were
+    computed for is current, e.g. (MattermostChannel.version, week number).
+    A new version drops all the kept results.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.values = {}
+
+    def get(self, version: Any, key: Any, compute: Callable[[], Any]) -> Any:
+        """
+        The result for `key` at `version`, computed by `compute()` if not kept.
+        """
+        with self.lock:
+            if version != self.version:
+                self.version = version
+                self.values = {}
+            elif key in self.values:
+                return self.values[key]
+        # Computed outside the lock, so a slow computation does not block the hits of other keys.
+        value = compute()
+        with self.lock:
+            if version == self.version:
+                self.values[key] = value
+        return value
+
+
+class ChannelEventListener:
+    """
+    Keeps MattermostChannel objects current from the Mattermost websocket event stream.
+
+    The websocket runs on its own event loop in a background thread. On every
+    (re)connection the channels are refreshed once, to catch up on the events
+    missed while disconnected.
+    """
+    def __init__(self, mm_driver: Driver):
+        self.options = dict(mm_driver.options, keepalive=True)
+        self.token = mm_driver.client.token
+        self.channels = []
+        self.websocket = None
+        self._thread = None
+        self._task = None
+
+    def add_channel(self, mm_channel: MattermostChannel):
+        self.channels.append(mm_channel)
+
+    def remove_channel(self, mm_channel: MattermostChannel):
+        if mm_channel in self.channels:
+            self.channels.remove(mm_channel)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=lambda: asyncio.run(self._run()), daemon=True)
+            self._thread.start()
+
+    def start_task(self):
+        """Run on the current event loop instead of a thread, for AsyncMattermostChannel objects."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self.websocket is not None:
+            self.websocket.disconnect()
+
+    async def _run(self):
+        self.websocket = Websocket(self.options, self.token)
+        await self.websocket.connect(self._handle_message)
+
+    @staticmethod
+    async def _call(method: Callable, *args):
+        # The coroutines of AsyncMattermostChannel are awaited, the blocking methods run in a thread.
+        if inspect.iscoroutinefunction(method):
+            return await method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def _handle_message(self, message: str):
+        event = json.loads(message)
+        for mm_channel in list(self.channels):
+            try:
+                if event.get("event") == "hello":
+                    await self._call(mm_channel.refresh)
+                else:
+                    await self._call(mm_channel.apply_event, event)
+            except Exception as e:
+                warnings.warn(f"Failed to apply the websocket event {event.get('event')}: {e}")
+                # The channel may have missed a change: catch up from the server.
+                try:
+                    await self._call(mm_channel.refresh)
+                except Exception as e:
+                    warnings.warn(f"Failed to refresh the channel after the websocket event {event.get('event')}: {e}")
 
 
 relayadmin_help_message = """\
@@ -745,130 +3838,377 @@ relayadmin_help_message = """\
 /relayadmin restart *username*: Restart relay-posts for the user, regarding they posted today.
 """
 
-def create_slashcommand_app(args):
-    app = Flask(__name__)
-
-    @app.before_request
-    def store_args():
-        g.args = args
+RELAY_CHANNEL_KEY = ("relay-channel",)
+RELAYADMIN_CHANNEL_KEY = ("relayadmin-channel",)
 
-    @app.route('/blacklist', methods=['POST'])
-    def blacklist():
-        """Handle incoming /blacklist events from Mattermost."""
-        # logging.debug(f"Slash-command received: {request.json}")
+# Shared by the Flask and the ASGI servers: everything of the slash-commands
+# but the requests to Mattermost, which are blocking in one and awaited in the other.
 
-        args = g.args
-        data = request.form
-        token = data.get("token")
+def slashcommand_channel_params(args: argparse.Namespace, key: tuple) -> Dict:
+    """
+    Keyword arguments of MattermostChannel for a snapshot key: the relay
+    channel, the relay channel of /relayadmin, or ("channel-id", id).
+    """
+    params = dict(
+        driver_params = args2driver_params(args),
+        stdout_mode = args.stdout_mode,
+        post_store = args2post_store(args),
+        columnar = args.columnar,
+        fetch_workers = args.fetch_workers,
+    )
+    if key == RELAY_CHANNEL_KEY:
+        # Same as args2mm_channel().
+        params.update(
+            team_name = args.team,
+            channel_name = args.channel,
+            after_weeksago = None if args.all_history else 100,
+            week_shift_hours = args.week_shift_hours,
+        )
+    elif key[0] == "channel-id":
+        params.update(channel_id = key[1])
+    else:
+        params.update(team_name = args.team, channel_name = args.channel)
+    return params
+
+def slashcommand_token_error(data: Dict[str, str], token_env: str) -> Optional[Dict]:
+    """The response to a slash-command whose token is not the one in the environment variable `token_env`, or None."""
+    if data.get("token") != os.environ[token_env]:
+        return {"text": "Invalid token"}
+    return None
+
+blacklist_usage_response = {
+    "response_type": "ephemeral",
+    "text": "Error: Invalid command syntax",
+    "attachments": [
+        {
+            "title": "Usage",
+            "text": "/blacklist [min_weeks] [max_weeks] [--post]",
+        },
+    ],
+}
+
+def parse_blacklist_text(args: argparse.Namespace, text: str) -> Optional[tuple]:
+    """
+    Parse the text of /blacklist.
 
-        # Verify the slash-command token
-        if token != os.environ["MATTERMOST_BLACKLIST_TOKEN"]:
-            return jsonify({"text": "Invalid token"})
+    Returns:
+    - tuple: min_weeks, max_weeks, priority and response_type, or None if the syntax is invalid.
+    """
+    try:
+        parser = argparse.ArgumentParser()
+        parser.add_argument("min-weeks", nargs="?", type=int, default=args.blacklist_minweek_default)
+        parser.add_argument("max-weeks", nargs="?", type=int, default=-1)
+        parser.add_argument("--important", action="store_true")
+        parser.add_argument("--post", action="store_true")
+        slash_args = parser.parse_args(shlex.split(text))
+
+        min_weeks = getattr(slash_args, "min-weeks")
+        if getattr(slash_args, "max-weeks") < 0:
+            max_weeks = float("inf")
+        else:
+            max_weeks = getattr(slash_args, "max-weeks")
 
-        try:
-            parser = argparse.ArgumentParser()
-            parser.add_argument("min-weeks", nargs="?", type=int, default=args.blacklist_minweek_default)
-            parser.add_argument("max-weeks", nargs="?", type=int, default=-1)
-            parser.add_argument("--important", action="store_true")
-            parser.add_argument("--post", action="store_true")
-            slash_args = parser.parse_args(shlex.split(data.get("text")))
-
-            min_weeks = getattr(slash_args, "min-weeks")
-            if getattr(slash_args, "max-weeks") < 0:
-                max_weeks = float("inf")
-            else:
-                max_weeks = getattr(slash_args, "max-weeks")
+        if getattr(slash_args, "important"):
+            priority = "important"
+        else:
+            priority = "standard"
 
-            if getattr(slash_args, "important"):
-                priority = "important"
-            else:
-                priority = "standard"
+        if getattr(slash_args, "post"):
+            response_type = "in_channel"
+        else:
+            response_type = "ephemeral"
 
-            if getattr(slash_args, "post"):
-                response_type = "in_channel"
-            else:
-                response_type = "ephemeral"
-
-        except:
-            return jsonify(
-                {
-                    "response_type": "ephemeral",
-                    "text": "Error: Invalid command syntax",
-                    "attachments": [
-                        {
-                            "title": "Usage",
-                            "text": "/blacklist [min_weeks] [max_weeks] [--post]",
-                        },
-                    ],
-                },
-            )
+    except:
+        return None
+    return min_weeks, max_weeks, priority, response_type
 
-        mm_channel = args2mm_channel(args)
-        current_week_number = mm_channel.get_week_number(datetime.now())
+def blacklist_response(args: argparse.Namespace, mm_channel: MattermostChannel, cache: VersionedCache, command: tuple) -> Dict:
+    """
+    The response of /blacklist for a command parsed by parse_blacklist_text().
+    `cache` keeps the week buckets of post_records() and the rendered messages
+    of the relay channel.
+    """
+    min_weeks, max_weeks, priority, response_type = command
+    current_week_number = mm_channel.get_week_number(datetime.now())
+    version = (mm_channel.version, current_week_number)
 
+    def render_message():
         if max_weeks == float("inf"):
             message = args.blacklist_message_min.format(min_weeks)
         else:
             message = args.blacklist_message_minmax.format(min_weeks, max_weeks)
-        message = (
+        records = cache.get(version, "post_records", lambda: post_records(mm_channel, args.app_name))
+        return (
             message + "\n"
             + "\n".join([f"{mm_channel.get_dispname_by_id(user_id)} [{mm_channel.get_username_by_id(user_id)}] ({current_week_number - week})"
-                         for week, _, _, user_ids in post_records(mm_channel, args.app_name)[::-1] if min_weeks <= current_week_number - week <= max_weeks
+                         for week, _, _, user_ids in records[::-1] if min_weeks <= current_week_number - week <= max_weeks
                          for user_id in user_ids[::-1]])
         )
+    message = cache.get(version, ("message", min_weeks, max_weeks, priority), render_message)
+
+    return {
+        "response_type": response_type,
+        "text": message,
+        "priority": priority,
+    }
+
+def whenmylast_response(args: argparse.Namespace, mm_channel: MattermostChannel, user_id: str) -> Dict:
+    """The response of /whenmylast for `user_id`."""
+    last_post_datetimes = mm_channel.get_last_post_datetimes_by_views(
+        {
+            "all": LAST_POST_VIEWS["all"],
+            "standard_thread_head": LAST_POST_VIEWS["standard_thread_head"],
+        },
+        user_ids=[user_id],
+        app_name=args.app_name,
+    )
+    last_post_datetime_all = last_post_datetimes["all"][user_id]
+    last_post_datetime_standard_channel = last_post_datetimes["standard_thread_head"][user_id]
+
+    if last_post_datetime_standard_channel <= ANCIENT:
+        last_post_datetime_standard_channel_str = args.whenmylast_datetime_never
+    else:
+        last_post_datetime_standard_channel_str = last_post_datetime_standard_channel.strftime(args.datetime_format)
+
+    if last_post_datetime_all <= ANCIENT:
+        last_post_datetime_all_str = args.whenmylast_datetime_never
+    else:
+        last_post_datetime_all_str = last_post_datetime_all.strftime(args.datetime_format)
+
+    message = args.whenmylast_message_format.replace("\\n", "\n").format(last_post_datetime_standard_channel_str, last_post_datetime_all_str)
 
-        return jsonify({
-            "response_type": response_type,
-            "text": message,
-            "priority": priority,
+    return {
+        "response_type": "ephemeral",
+        "text": message,
+    }
+
+def relayadmin_stop_list(mm_channel: MattermostChannel, stop_data: Dict[str, str]) -> str:
+    return "\n".join(
+        [f"{mm_channel.get_dispname_by_id(user_id)} [{mm_channel.get_username_by_id(user_id)}]: until {until_date}" for user_id, until_date in sorted(stop_data.items(), key=lambda x: (x[1],x[0]))]
+    )
+
+def relayadmin_command(args: argparse.Namespace, mm_channel: MattermostChannel, exec_user: Dict, slash_args: List[str]) -> tuple:
+    """
+    Handle /relayadmin run by `exec_user` (fetched from the server, for the roles).
+
+    Returns:
+    - tuple: (response, None), or (None, post) for the sub-commands changing
+      the stop table: `post` is the keyword arguments of send_post(), and the
+      response is relayadmin_post_response() after sending it.
+    """
+    roles = exec_user["roles"].split()
+    if "system_admin" not in roles:
+        return {"response_type": "ephemeral", "text": "You don't have correct permission to execute this command."}, None
+
+    if len(slash_args) == 0 or slash_args[0].lower() == "help":
+        return {"response_type": "ephemeral", "text": relayadmin_help_message}, None
+    sub_command = slash_args[0].lower()
+    sub_args = slash_args[1:]
+
+    try:
+        last_record = mm_channel.stop_table.latest_post(args.app_name)
+        if last_record is None:
+            return {"response_type": "ephemeral", "text": relayadmin_help_message}, None
+        # Copy, not to modify the post held in the snapshot.
+        stop_data = dict(last_record["props"]["data"])
+
+        if sub_command in {"stop", "cancelstop", "restart"}:
+            username = sub_args[0]
+            user_id = mm_channel.get_id_by_username(username)
+            if user_id is None:
+                return {"response_type": "ephemeral", "text": f"{username} is not a member of relay-channel."}, None
+            if sub_command == "stop":
+                until_date = parser.parse(sub_args[1]).date()
+                stop_data[user_id] = until_date.strftime("%Y-%m-%d")
+                sub_args = sub_args[:2]
+            elif sub_command == "cancelstop":
+                del stop_data[user_id]
+                sub_args = sub_args[:1]
+            else: # "restart"
+                until_date = datetime.now().date()
+                stop_data[user_id] = until_date.strftime("%Y-%m-%d")
+                sub_args = sub_args[:1]
+
+            root_id = last_record["root_id"]
+            if root_id == "":
+                root_id = last_record["id"]
+            return None, {
+                "message": "/relayadmin {} {}".format(sub_command, " ".join(sub_args)),
+                "props": {
+                    "bot_app": args.app_name,
+                    "type": "relaystop",
+                    "data": stop_data,
+                },
+                "root_id": root_id,
             }
-        )
+        elif sub_command == "status":
+            return {
+                "response_type": "ephemeral",
+                "text": "Relay-posts now stop for:\n{}".format(relayadmin_stop_list(mm_channel, stop_data)),
+            }, None
+        else:
+            return {"response_type": "ephemeral", "text": relayadmin_help_message}, None
+
+    except:
+        return {"response_type": "ephemeral", "text": relayadmin_help_message}, None
+
+def relayadmin_post_response(mm_channel: MattermostChannel, post: Dict, post_result: bool) -> Dict:
+    """The response of /relayadmin after sending the `post` of relayadmin_command()."""
+    stop_list = relayadmin_stop_list(mm_channel, post["props"]["data"])
+    if post_result:
+        return {
+            "response_type": "ephemeral",
+            "text": "Your command has been successfully executed:\n{}".format(stop_list),
+        }
+    else:
+        return {
+            "response_type": "ephemeral",
+            "text": "Something went wrong when posting your command:\n{}".format(stop_list),
+        }
 
-    @app.route('/whenmylast', methods=['POST'])
-    def whenmylast():
-        """Handle incoming /whenmylast events from Mattermost."""
+def send_deferred_response(response_url: str, future: Future):
+    """Send the response computed by `future` to the response_url of a slash-command."""
+    try:
+        response = future.result()
+    except Exception as e:
+        warnings.warn(f"Failed to compute a deferred slash-command response: {e}")
+        return
+    try:
+        httpx.post(response_url, json=response, timeout=DEFAULT_REQUEST_TIMEOUT).raise_for_status()
+    except httpx.HTTPError as e:
+        warnings.warn(f"Failed to send a deferred slash-command response: {e}")
+
+async def send_deferred_response_async(response_url: str, task: asyncio.Future):
+    """Coroutine version of send_deferred_response()."""
+    try:
+        response = await task
+    except Exception as e:
+        warnings.warn(f"Failed to compute a deferred slash-command response: {e}")
+        return
+    try:
+        async with httpx.AsyncClient(timeout=DEFAULT_REQUEST_TIMEOUT) as client:
+            (await client.post(response_url, json=response)).raise_for_status()
+    except httpx.HTTPError as e:
+        warnings.warn(f"Failed to send a deferred slash-command response: {e}")
+
+def create_slashcommand_app(args):
+    app = Flask(__name__)
+    snapshots = ChannelSnapshots(
+        lambda key: MattermostChannel(**slashcommand_channel_params(args, key)),
+        args.refresh_interval, args.websocket, args.snapshot_dir, args2driver_params(args),
+        idle_timeout=args.snapshot_idle_timeout, kept_keys=(RELAY_CHANNEL_KEY, RELAYADMIN_CHANNEL_KEY),
+    )
+    # Week buckets of post_records() and rendered /blacklist messages of the relay channel.
+    blacklist_cache = VersionedCache()
+    # Computes the responses, which may outlive the requests (see respond()).
+    executor = ThreadPoolExecutor(args.command_workers)
+    # Computations in progress, joined by the same commands meanwhile: (route, channel key, ...) -> Future
+    in_flight = {}
+    in_flight_lock = threading.Lock()
+    # One /relayadmin change of the stop table at a time, each on the previous one.
+    relayadmin_lock = threading.Lock()
+
+    def respond(data, compute: Callable[[], Dict], key: Optional[tuple] = None):
+        """
+        The response of `compute()` if it is ready within --defer-after seconds.
+        Otherwise an acknowledgement, and the response is sent to the
+        response_url of the command when ready, so that a slow command does
+        not time out in Mattermost.
+
+        The commands of the same `key` join the computation in progress
+        instead of starting another one. None for the commands with effects.
+        """
+        with in_flight_lock:
+            future = in_flight.get(key) if key is not None else None
+            computing = future is None
+            if computing:
+                future = executor.submit(propagate_context(compute))
+                if key is not None:
+                    in_flight[key] = future
+        if computing and key is not None:
+            # Outside the lock: the callback runs now if the computation is already done.
+            future.add_done_callback(lambda future: forget_in_flight(key, future))
+        response_url = data.get("response_url")
+        try:
+            return jsonify(future.result(timeout=args.defer_after if response_url and args.defer_after >= 0 else None))
+        except FutureTimeoutError:
+            pass
+        METRICS.inc("relayreminder_deferred_responses_total", {"route": request.url_rule.rule})
+        future.add_done_callback(lambda future: send_deferred_response(response_url, future))
+        return jsonify({"response_type": "ephemeral", "text": args.deferred_message})
+
+    def forget_in_flight(key: tuple, future: Future):
+        with in_flight_lock:
+            if in_flight.get(key) is future:
+                del in_flight[key]
+
+    @app.before_request
+    def store_args():
+        g.args = args
+        g.request_start = time.perf_counter()
+        # Mattermost requests made for a slash-command go before the background syncs.
+        g.priority_token = REQUEST_PRIORITY.set(INTERACTIVE)
+
+    @app.teardown_request
+    def restore_priority(exc):
+        if "priority_token" in g:
+            REQUEST_PRIORITY.reset(g.priority_token)
+
+    @app.after_request
+    def record_latency(response):
+        METRICS.observe("relayreminder_http_request_duration_seconds", {
+            "route": request.url_rule.rule if request.url_rule else "unmatched",
+            "method": request.method,
+            "status": str(response.status_code),
+        }, time.perf_counter() - g.request_start)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Metrics of this worker in the Prometheus text format."""
+        for key, mm_channel in snapshots.items():
+            METRICS.set("relayreminder_posts_loaded", {"snapshot": ":".join(key)}, mm_channel.post_count())
+        return METRICS.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+    @app.route('/blacklist', methods=['POST'])
+    def blacklist():
+        """Handle incoming /blacklist events from Mattermost."""
         # logging.debug(f"Slash-command received: {request.json}")
 
         args = g.args
         data = request.form
-        token = data.get("token")
 
         # Verify the slash-command token
-        if token != os.environ["MATTERMOST_WHENMYLAST_TOKEN"]:
-            return jsonify({"text": "Invalid token"})
-
-        driver_params = {
-            "url": args.mm_url,
-            "scheme": args.scheme,
-            "port": args.port,
-            "token": args.bot_token
-        }
-        mm_channel = MattermostChannel(
-            driver_params,
-            channel_id = data.get("channel_id"),
-            stdout_mode = args.stdout_mode,
-        )
-        user_id = data.get("user_id")
-        last_post_datetime_all = mm_channel.get_last_post_datetimes(user_ids=[user_id], app_name=args.app_name)[user_id]
-        last_post_datetime_standard_channel = mm_channel.get_last_post_datetimes(user_ids=[user_id], priority_filter="standard", is_thread_head=True, app_name=args.app_name)[user_id]
+        error = slashcommand_token_error(data, "MATTERMOST_BLACKLIST_TOKEN")
+        if error:
+            return jsonify(error)
 
-        if last_post_datetime_standard_channel <= ANCIENT:
-            last_post_datetime_standard_channel_str = args.whenmylast_datetime_never
-        else:
-            last_post_datetime_standard_channel_str = last_post_datetime_standard_channel.strftime(args.datetime_format)
+        command = parse_blacklist_text(args, data.get("text"))
+        if command is None:
+            return jsonify(blacklist_usage_response)
 
-        if last_post_datetime_all <= ANCIENT:
-            last_post_datetime_all_str = args.whenmylast_datetime_never
-        else:
-            last_post_datetime_all_str = last_post_datetime_all.strftime(args.datetime_format)
+        return respond(
+            data, lambda: blacklist_response(args, snapshots.get(RELAY_CHANNEL_KEY), blacklist_cache, command),
+            ("/blacklist", RELAY_CHANNEL_KEY, command),
+        )
 
-        message = args.whenmylast_message_format.replace("\\n", "\n").format(last_post_datetime_standard_channel_str, last_post_datetime_all_str)
+    @app.route('/whenmylast', methods=['POST'])
+    def whenmylast():
+        """Handle incoming /whenmylast events from Mattermost."""
+        # logging.debug(f"Slash-command received: {request.json}")
 
-        return jsonify(
-            {
-                "response_type": "ephemeral",
-                "text": message,
-            },
+        args = g.args
+        data = request.form
+
+        # Verify the slash-command token
+        error = slashcommand_token_error(data, "MATTERMOST_WHENMYLAST_TOKEN")
+        if error:
+            return jsonify(error)
+
+        channel_key, user_id = ("channel-id", data.get("channel_id")), data.get("user_id")
+        return respond(
+            data, lambda: whenmylast_response(args, snapshots.get(channel_key), user_id),
+            ("/whenmylast", channel_key, user_id),
         )
 
     @app.route('/relayadmin', methods=['POST'])
@@ -878,134 +4218,339 @@ def create_slashcommand_app(args):
 
         args = g.args
         data = request.form
-        token = data.get("token")
-        slash_args = data.get("text").split()
 
         # Verify the slash-command token
-        if token != os.environ["MATTERMOST_RELAYADMIN_TOKEN"]:
-            return jsonify({"text": "Invalid token"})
-
-        driver_params = {
-            "url": args.mm_url,
-            "scheme": args.scheme,
-            "port": args.port,
-            "token": args.bot_token
-        }
-        mm_channel = MattermostChannel(
-            driver_params,
-            team_name = args.team,
-            channel_name = args.channel,
-            stdout_mode = args.stdout_mode,
-        )
-        exec_user_id = data.get("user_id")
-        # channel_id = mm_channel.channel_id
-        # exec_channel_id = data.get("channel_id")
-
-        roles = mm_channel.mm_driver.users.get_user(exec_user_id)["roles"].split()
-        if "system_admin" not in roles:
-            return jsonify({"response_type": "ephemeral", "text": "You don't have correct permission to execute this command."})
-
-        if len(slash_args) == 0 or slash_args[0].lower() == "help":
-            return jsonify({"response_type": "ephemeral", "text": relayadmin_help_message})
-        sub_command = slash_args[0].lower()
-        sub_args = slash_args[1:]
-        
+        error = slashcommand_token_error(data, "MATTERMOST_RELAYADMIN_TOKEN")
+        if error:
+            return jsonify(error)
+
+        exec_user_id, slash_args = data.get("user_id"), data.get("text").split()
+
+        def run():
+            mm_channel = snapshots.get(RELAYADMIN_CHANNEL_KEY)
+            # Roles are always checked against the server, not the snapshot.
+            exec_user = mm_channel.mm_driver.users.get_user(exec_user_id)
+            response, post = relayadmin_command(args, mm_channel, exec_user, slash_args)
+            if post is None:
+                return response
+            with relayadmin_lock:
+                # The new stop table is built on the latest one of the server:
+                # the snapshot may miss a change, e.g. made in another worker.
+                mm_channel = snapshots.latest(RELAYADMIN_CHANNEL_KEY)
+                response, post = relayadmin_command(args, mm_channel, exec_user, slash_args)
+                if post is None:
+                    return response
+                try:
+                    post_result = mm_channel.send_post(**post)
+                    snapshots.refresh(RELAYADMIN_CHANNEL_KEY)
+                    return relayadmin_post_response(mm_channel, post, post_result)
+                except:
+                    return {"response_type": "ephemeral", "text": relayadmin_help_message}
+        return respond(data, run)
+
+    return app
+
+
+class AsyncChannelSnapshots:
+    """
+    Coroutine version of ChannelSnapshots, for the ASGI server.
+
+    The channels are AsyncMattermostChannel objects created by
+    `await factory(key)` and refreshed by a task on the event loop.
+    Concurrent commands for a channel not created yet wait for the same creation.
+    The idle channels are dropped as by ChannelSnapshots.
+    """
+    def __init__(self,
+        factory: Callable[[tuple], Any],
+        refresh_interval: float = 60,
+        use_websocket: bool = False,
+        idle_timeout: float = 0,
+        kept_keys: Iterable[tuple] = (),
+    ):
+        self.factory = factory
+        self.refresh_interval = refresh_interval
+        self.use_websocket = use_websocket
+        self.idle_timeout = idle_timeout
+        self.kept_keys = set(kept_keys)
+        self.used = {}  # key -> time.monotonic() of the last use
+        self.channels = {}
+        self._creating = {}
+        self._task = None
+        self._listener = None
+
+    async def get(self, key: tuple) -> AsyncMattermostChannel:
+        """
+        Get the snapshot for `key`, creating it if it does not exist yet.
+        """
+        self.used[key] = time.monotonic()
+        if key in self.channels:
+            return self.channels[key]
+        if self._task is None and (self.refresh_interval > 0 or self.idle_timeout > 0):
+            self._task = asyncio.ensure_future(self._refresh_loop())
+        if key not in self._creating:
+            self._creating[key] = asyncio.ensure_future(self._create(key))
+        # Shielded, so that a request going away does not cancel the creation for the others.
+        return await asyncio.shield(self._creating[key])
+
+    async def _create(self, key: tuple) -> AsyncMattermostChannel:
         try:
-            stop_records = mm_channel.filter_posts_by_criteria(
-                {
-                    "props": {
-                        "bot_app": args.app_name,
-                        "type": "relaystop",
-                        "data": Anything,
-                    },
-                },
-            )
-            last_record = stop_records[-1]
-            stop_data = last_record["props"]["data"]
-
-            if sub_command in {"stop", "cancelstop", "restart"}:
-                username = sub_args[0]
-                user_id = mm_channel.get_id_by_username(username)
-                if user_id is None:
-                    return jsonify({"response_type": "ephemeral", "text": f"{username} is not a member of relay-channel."})
-                if sub_command == "stop":
-                    until_date = parser.parse(sub_args[1]).date()
-                    stop_data[user_id] = until_date.strftime("%Y-%m-%d")
-                    sub_args = sub_args[:2]
-                elif sub_command == "cancelstop":
-                    del stop_data[user_id]
-                    sub_args = sub_args[:1]
-                else: # "restart"
-                    until_date = datetime.now().date()
-                    stop_data[user_id] = until_date.strftime("%Y-%m-%d")
-                    sub_args = sub_args[:1]
-                
-                root_id = last_record["root_id"]
-                if root_id == "":
-                    root_id = last_record["id"]
-                post_result = mm_channel.send_post(
-                    "/relayadmin {} {}".format(sub_command, " ".join(sub_args)),
-                    props = {
-                        "bot_app": args.app_name,
-                        "type": "relaystop",
-                        "data": stop_data,
-                    },
-                    root_id = root_id,
-                )
-                if post_result:
-                    return jsonify(
-                        {
-                            "response_type": "ephemeral",
-                            "text": "Your command has been successfully executed:\n{}".format(
-                                "\n".join(
-                                    [f"{mm_channel.get_dispname_by_id(user_id)} [{mm_channel.get_username_by_id(user_id)}]: until {until_date}" for user_id, until_date in sorted(stop_data.items(), key=lambda x: (x[1],x[0]))]
-                                )
-                            )
-                        },
-                    )
-                else:
-                    return jsonify(
-                        {
-                            "response_type": "ephemeral",
-                            "text": "Something went wrong when posting your command:\n{}".format(
-                                "\n".join(
-                                    [f"{mm_channel.get_dispname_by_id(user_id)} [{mm_channel.get_username_by_id(user_id)}]: until {until_date}" for user_id, until_date in sorted(stop_data.items(), key=lambda x: (x[1],x[0]))]
-                                )
-                            )
-                        }
-                    )
-            elif sub_command == "status":
-                return jsonify(
-                    {
-                        "response_type": "ephemeral",
-                        "text": "Relay-posts now stop for:\n{}".format(
-                            "\n".join(
-                                [f"{mm_channel.get_dispname_by_id(user_id)} [{mm_channel.get_username_by_id(user_id)}]: until {until_date}" for user_id, until_date in sorted(stop_data.items(), key=lambda x: (x[1],x[0]))]
-                            )
-                        )
-                    },
-                )
-            else:
-                return jsonify({"response_type": "ephemeral", "text": relayadmin_help_message})
+            mm_channel = await self.factory(key)
+        finally:
+            del self._creating[key]
+        self.channels[key] = mm_channel
+        if self.use_websocket:
+            if self._listener is None:
+                self._listener = ChannelEventListener(mm_channel.mm_driver)
+            self._listener.add_channel(mm_channel)
+            self._listener.start_task()
+        return mm_channel
+
+    async def latest(self, key: tuple) -> AsyncMattermostChannel:
+        """The channel for `key`, refreshed from the server now."""
+        mm_channel = await self.get(key)
+        await mm_channel.refresh()
+        return mm_channel
+
+    async def refresh(self, key: tuple):
+        mm_channel = self.channels.get(key)
+        if mm_channel is not None:
+            await mm_channel.refresh()
+
+    async def _refresh_loop(self):
+        # Started from a request; the refreshes are not interactive.
+        REQUEST_PRIORITY.set(BACKGROUND)
+        # The idle channels are polled every second.
+        poll_interval = self.refresh_interval if self.idle_timeout <= 0 else min(self.refresh_interval or 1, 1)
+        next_refresh = time.monotonic() + self.refresh_interval
+        while True:
+            await asyncio.sleep(poll_interval)
+            try:
+                await self._evict()
+            except Exception as e:
+                warnings.warn(f"Failed to drop the idle snapshots: {e}")
+            if self.refresh_interval <= 0 or time.monotonic() < next_refresh:
+                continue
+            next_refresh = time.monotonic() + self.refresh_interval
+            for key in list(self.channels.keys()):
+                try:
+                    await self.refresh(key)
+                except Exception as e:
+                    warnings.warn(f"Failed to refresh the snapshot of {key}: {e}")
+
+    async def _evict(self):
+        """Drop the channels not asked for in idle_timeout seconds, but those of kept_keys."""
+        if self.idle_timeout <= 0:
+            return
+        deadline = time.monotonic() - self.idle_timeout
+        for key in [key for key, used in self.used.items() if used < deadline and key not in self.kept_keys]:
+            del self.used[key]
+            mm_channel = self.channels.pop(key, None)
+            if mm_channel is not None:
+                if self._listener is not None:
+                    self._listener.remove_channel(mm_channel)
+                await mm_channel.close()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._listener is not None:
+            self._listener.stop()
+        for mm_channel in self.channels.values():
+            await mm_channel.close()
+        self.channels = {}
+
+
+def create_slashcommand_asgi_app(args):
+    """
+    ASGI version of create_slashcommand_app(), with the same commands, token
+    checks and responses. The requests to Mattermost are awaited on the event
+    loop (see AsyncMattermostChannel), and the computations run in threads, so
+    that one process serves concurrent commands.
+    """
+    if args.snapshot_dir:
+        warnings.warn("The ASGI server does not use --snapshot-dir; its process keeps its own channels.")
+    snapshots = AsyncChannelSnapshots(
+        lambda key: AsyncMattermostChannel.create(**slashcommand_channel_params(args, key)),
+        args.refresh_interval, args.websocket,
+        idle_timeout=args.snapshot_idle_timeout, kept_keys=(RELAY_CHANNEL_KEY, RELAYADMIN_CHANNEL_KEY),
+    )
+    # Week buckets of post_records() and rendered /blacklist messages of the relay channel.
+    blacklist_cache = VersionedCache()
+    # Kept referenced until the deferred responses are sent.
+    deferred = set()
+    # Computations in progress, joined by the same commands meanwhile: (route, channel key, ...) -> Task
+    in_flight = {}
+    # One /relayadmin change of the stop table at a time, each on the previous one.
+    relayadmin_lock = asyncio.Lock()
+
+    async def respond(route: str, data, compute: Callable[[], Any], key: Optional[tuple] = None) -> Dict:
+        """Coroutine version of respond() of create_slashcommand_app(); `compute()` is a coroutine."""
+        task = in_flight.get(key) if key is not None else None
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            if key is not None:
+                in_flight[key] = task
+                task.add_done_callback(lambda task: in_flight.pop(key) if in_flight.get(key) is task else None)
+        response_url = data.get("response_url")
+        if not response_url or args.defer_after < 0:
+            # Shielded, so that a request going away does not cancel the computation for the others.
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), args.defer_after)
+        except asyncio.TimeoutError:
+            pass
+        METRICS.inc("relayreminder_deferred_responses_total", {"route": route})
+        sender = asyncio.ensure_future(send_deferred_response_async(response_url, task))
+        deferred.add(sender)
+        sender.add_done_callback(deferred.discard)
+        return {"response_type": "ephemeral", "text": args.deferred_message}
+
+    async def metrics(data):
+        """Metrics of this process in the Prometheus text format."""
+        for key, mm_channel in list(snapshots.channels.items()):
+            METRICS.set("relayreminder_posts_loaded", {"snapshot": ":".join(key)}, mm_channel.post_count())
+        return METRICS.render(), "text/plain; version=0.0.4; charset=utf-8"
+
+    async def blacklist(data):
+        """Handle incoming /blacklist events from Mattermost."""
+        error = slashcommand_token_error(data, "MATTERMOST_BLACKLIST_TOKEN")
+        if error:
+            return error
+        command = parse_blacklist_text(args, data.get("text"))
+        if command is None:
+            return blacklist_usage_response
+
+        async def run():
+            mm_channel = await snapshots.get(RELAY_CHANNEL_KEY)
+            return await asyncio.to_thread(blacklist_response, args, mm_channel, blacklist_cache, command)
+        return await respond("/blacklist", data, run, ("/blacklist", RELAY_CHANNEL_KEY, command))
+
+    async def whenmylast(data):
+        """Handle incoming /whenmylast events from Mattermost."""
+        error = slashcommand_token_error(data, "MATTERMOST_WHENMYLAST_TOKEN")
+        if error:
+            return error
 
-        except:
-            return jsonify({"response_type": "ephemeral", "text": relayadmin_help_message})
+        channel_key, user_id = ("channel-id", data.get("channel_id")), data.get("user_id")
 
-    return app
+        async def run():
+            mm_channel = await snapshots.get(channel_key)
+            return await asyncio.to_thread(whenmylast_response, args, mm_channel, user_id)
+        return await respond("/whenmylast", data, run, ("/whenmylast", channel_key, user_id))
+
+    async def relayadmin(data):
+        """Handle incoming /relayadmin events from Mattermost."""
+        error = slashcommand_token_error(data, "MATTERMOST_RELAYADMIN_TOKEN")
+        if error:
+            return error
+
+        async def run():
+            mm_channel = await snapshots.get(RELAYADMIN_CHANNEL_KEY)
+            # Roles are always checked against the server, not the snapshot.
+            exec_user = await mm_channel.mm_driver.users.get_user(data.get("user_id"))
+            response, post = relayadmin_command(args, mm_channel, exec_user, data.get("text").split())
+            if post is None:
+                return response
+            async with relayadmin_lock:
+                # Built on the latest stop table of the server, as in create_slashcommand_app().
+                mm_channel = await snapshots.latest(RELAYADMIN_CHANNEL_KEY)
+                response, post = relayadmin_command(args, mm_channel, exec_user, data.get("text").split())
+                if post is None:
+                    return response
+                try:
+                    post_result = await mm_channel.send_post(**post)
+                    await snapshots.refresh(RELAYADMIN_CHANNEL_KEY)
+                    return relayadmin_post_response(mm_channel, post, post_result)
+                except:
+                    return {"response_type": "ephemeral", "text": relayadmin_help_message}
+        return await respond("/relayadmin", data, run)
+
+    routes = {
+        ("GET", "/metrics"): metrics,
+        ("POST", "/blacklist"): blacklist,
+        ("POST", "/whenmylast"): whenmylast,
+        ("POST", "/relayadmin"): relayadmin,
+    }
 
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await snapshots.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def read_form(receive) -> Dict[str, str]:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        return dict(urllib.parse.parse_qsl(body.decode(), keep_blank_values=True))
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        start = time.perf_counter()
+        handler = routes.get((scope["method"], scope["path"]))
+        # Mattermost requests made for a slash-command go before the background syncs.
+        priority_token = REQUEST_PRIORITY.set(INTERACTIVE)
+        try:
+            if handler is None:
+                status, body, content_type = 404, "Not Found", "text/plain; charset=utf-8"
+            else:
+                result = await handler(await read_form(receive))
+                if isinstance(result, dict):
+                    status, body, content_type = 200, json.dumps(result), "application/json"
+                else:
+                    status, (body, content_type) = 200, result
+        except Exception as e:
+            warnings.warn(f"Failed to handle {scope['method']} {scope['path']}: {e}")
+            status, body, content_type = 500, "Internal Server Error", "text/plain; charset=utf-8"
+        finally:
+            REQUEST_PRIORITY.reset(priority_token)
+
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type.encode())]})
+        await send({"type": "http.response.body", "body": body.encode()})
+        METRICS.observe("relayreminder_http_request_duration_seconds", {
+            "route": scope["path"] if handler else "unmatched",
+            "method": scope["method"],
+            "status": str(status),
+        }, time.perf_counter() - start)
+
+    return app
 
 if __name__ == "__main__":
     load_envs()
     args = parse_args()
     if args.slashcommand_mode:
+        if args.asgi and uvicorn is None:
+            warnings.warn("Uvicorn is not available. The Flask app serves the slash-commands.")
+            args.asgi = False
+            os.environ["RELAYREMINDER_ASGI"] = str(args.asgi)
         if args.gunicorn_path:
-            subprocess.run([args.gunicorn_path, "--workers", str(args.workers), "--timeout", str(args.timeout), "--bind", f"{args.slashcommand_host}:{args.slashcommand_port}", "relayreminder:app"])
+            server_args = ["--worker-class", "uvicorn.workers.UvicornWorker", "relayreminder:asgi_app"] if args.asgi else ["relayreminder:app"]
+            subprocess.run([args.gunicorn_path, "--workers", str(args.workers), "--timeout", str(args.timeout), "--bind", f"{args.slashcommand_host}:{args.slashcommand_port}"] + server_args)
+        elif args.asgi:
+            uvicorn.run(create_slashcommand_asgi_app(args), host=args.slashcommand_host, port=args.slashcommand_port)
         else:
             app = create_slashcommand_app(args)
             app.run(host=args.slashcommand_host, port=args.slashcommand_port)
     else:
-        main(args)
+        results = main(args)
+        if any(result["error"] is not None for result in results.values()):
+            sys.exit(1)
 elif __name__ == "relayreminder" and bool(strtobool(os.environ["RELAYREMINDER_SLASHCOMMAND_MODE"])):
     sys.argv = sys.argv[:1]
     args = parse_args()
-    app = create_slashcommand_app(args)
+    if args.asgi:
+        asgi_app = create_slashcommand_asgi_app(args)
+    else:
+        app = create_slashcommand_app(args)
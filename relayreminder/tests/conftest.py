@@ -0,0 +1,74 @@
+import gc
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Importing relayreminder starts the slash-command server unless this is false.
+os.environ.setdefault("RELAYREMINDER_SLASHCOMMAND_MODE", "false")
+
+from fakemattermost import FakeMattermost
+
+SLASH_TOKEN = "test-slash-token"
+
+
+@pytest.fixture(scope="session")
+def fake_servers():
+    """
+    The servers of fake_mattermost, stopped at the end of the session: the
+    channels of a test log out whenever they are collected.
+    """
+    servers = []
+    yield servers
+    gc.collect()
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def fake_mattermost(fake_servers):
+    """A FakeMattermost served in a background thread."""
+    fake = FakeMattermost()
+    fake.start()
+    fake_servers.append(fake)
+    return fake
+
+
+@pytest.fixture
+def driver_params(fake_mattermost):
+    return fake_mattermost.driver_params()
+
+
+@pytest.fixture
+def slashcommand_args(fake_mattermost, monkeypatch):
+    """
+    Build relayreminder.parse_args() of the slash-commands on the given
+    options, pointed at fake_mattermost. The commands take SLASH_TOKEN.
+    """
+    import relayreminder
+
+    for name in ("MATTERMOST_BLACKLIST_TOKEN", "MATTERMOST_WHENMYLAST_TOKEN", "MATTERMOST_RELAYADMIN_TOKEN"):
+        monkeypatch.setenv(name, SLASH_TOKEN)
+
+    def build(*argv):
+        params = fake_mattermost.driver_params()
+        monkeypatch.setattr(sys, "argv", [
+            "relayreminder.py",
+            "--mm-url", params["url"],
+            "--scheme", params["scheme"],
+            "--port", str(params["port"]),
+            "--bot-token", params["token"],
+            "--team", "main",
+            "--channel", "relaychannel",
+            "--post-cache", "",
+            "--refresh-interval", "0",
+        ] + list(argv))
+        saved_environ = dict(os.environ)
+        try:
+            return relayreminder.parse_args()
+        finally:
+            # parse_args() mirrors the options into os.environ.
+            os.environ.clear()
+            os.environ.update(saved_environ)
+    return build
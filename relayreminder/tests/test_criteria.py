@@ -0,0 +1,87 @@
+import pytest
+
+from relayreminder import Anything, compile_criteria, either
+
+
+def baseline_match_criteria(data, criteria):
+    # The matching of MattermostChannel.filter_posts_by_criteria before the criteria were compiled.
+    for key, value in criteria.items():
+        try:
+            if key not in data:
+                return False
+        except:
+            if key not in list(data.keys()):
+                return False
+
+        if value is Anything:
+            continue
+        elif isinstance(value, dict):
+            if not baseline_match_criteria(data[key], value):
+                return False
+        elif isinstance(value, (set, list)) and isinstance(data[key], list):
+            try:
+                value_set = set(value)
+                if not value_set.issubset(data[key]):
+                    return False
+            except:
+                data_key = data[key]
+                if not all(val in data_key for val in value):
+                    return False
+        elif data[key] != value:
+            return False
+    return True
+
+
+POSTS = [
+    {"type": "", "user_id": "u1", "root_id": "", "props": {}},
+    {"type": "", "user_id": "u2", "root_id": "p1", "props": {"from_bot": "true"}},
+    {"type": "system_join_channel", "user_id": "u1", "root_id": "", "props": {"username": "user1"}},
+    {"type": "custom_relay", "user_id": "bot", "root_id": "",
+     "props": {"bot_app": "RelayReminder", "type": "relaystop", "data": {"u1": "2024-01-01"}}},
+    {"type": "custom_relay", "user_id": "bot", "root_id": "p3",
+     "props": {"bot_app": "Other", "type": "relaystop", "data": {}}},
+    {"type": "", "user_id": "u3", "root_id": "", "props": {"tags": ["a", "b", "c"], "mentions": [{"id": "u1"}, {"id": "u2"}]}},
+    {"type": "", "user_id": "u3", "props": {"tags": "a", "attachments": [["x"], ["y"]]}},
+    {"type": None, "user_id": None, "root_id": None, "props": {"bot_app": None}},
+    {"user_id": "u4", "props": {"type": "relaystop"}},
+]
+
+CRITERIA = {
+    "empty": {},
+    "equal": {"user_id": "u1"},
+    "equal none": {"root_id": None},
+    "equal, several keys": {"type": "", "user_id": "u3", "root_id": ""},
+    "missing key": {"file_ids": []},
+    "missing key, anything": {"root_id": Anything},
+    "either": {"type": either("system_join_channel", "system_leave_channel")},
+    "either with none": {"type": either("", None)},
+    "either of unhashables": {"props": {"tags": either(["a", "b", "c"], "a")}},
+    "nested equal": {"props": {"type": "relaystop"}},
+    "nested anything": {"props": {"bot_app": Anything}},
+    "nested either": {"props": {"bot_app": either("RelayReminder", "Other")}},
+    "nested, several levels": {"props": {"data": {"u1": "2024-01-01"}}},
+    "nested, empty": {"props": {}},
+    "nested missing key": {"props": {"from_bot": "true"}, "type": ""},
+    "subset list": {"props": {"tags": ["a", "c"]}},
+    "subset set": {"props": {"tags": {"b"}}},
+    "subset, not all": {"props": {"tags": ["a", "d"]}},
+    "subset of unhashables": {"props": {"mentions": [{"id": "u2"}]}},
+    "subset of lists": {"props": {"attachments": [["y"]]}},
+    "subset against a non list": {"props": {"tags": ["a"]}},
+    "empty subset": {"props": {"tags": []}},
+    "relaystop": {"type": "custom_relay", "props": {"bot_app": "RelayReminder", "type": "relaystop", "data": Anything}},
+    "relaystop thread": {"root_id": either("p1", "p3"), "props": {"type": "relaystop"}},
+}
+
+
+@pytest.mark.parametrize("criteria", CRITERIA.values(), ids=CRITERIA.keys())
+def test_compiled_criteria_match_like_the_baseline(criteria):
+    match = compile_criteria(criteria)
+    assert [match(post) for post in POSTS] == [baseline_match_criteria(post, criteria) for post in POSTS]
+
+
+def test_compiled_criteria_of_the_same_shape_keep_their_values():
+    first = compile_criteria({"user_id": "u1", "props": {"tags": ["a"]}})
+    second = compile_criteria({"user_id": "u3", "props": {"tags": ["b"]}})
+    assert [first(post) for post in POSTS] == [False] * len(POSTS)
+    assert [second(post) for post in POSTS] == [post is POSTS[5] for post in POSTS]
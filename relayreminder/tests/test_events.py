@@ -0,0 +1,120 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from relayreminder import LAST_POST_VIEWS, AsyncMattermostChannel, ChannelEventListener, MattermostChannel
+
+
+def post_event(event, post):
+    return {"event": event, "data": {"post": json.dumps(post)}, "broadcast": {"channel_id": post["channel_id"]}}
+
+
+def channel_state(channel, user_ids):
+    posts = channel.all_posts["posts"]
+    custom_views = {"replies": {"is_thread_head": False, "ignore_deleted_posts": False}}
+    return {
+        "posts": [post.to_dict() for post in posts.values()],
+        "post_count": channel.post_count(),
+        "index": {
+            path: {value: sorted(bucket) for value, bucket in buckets.items() if bucket}
+            for path, buckets in channel.post_index.indexes.items()
+        },
+        "last_posts": channel.get_last_post_datetimes_by_views(user_ids=user_ids),
+        "custom_last_posts": channel.get_last_post_datetimes_by_views(custom_views, user_ids=user_ids),
+        "stop_data": channel.stop_data,
+        "join_times": channel.join_table.join_times,
+    }
+
+
+@pytest.mark.parametrize("after_weeksago", [100, None], ids=["since", "paged"])
+@pytest.mark.parametrize("columnar", [False, True], ids=["dicts", "columnar"])
+def test_events_give_the_state_of_a_fresh_fetch(fake_mattermost, driver_params, after_weeksago, columnar):
+    fake_mattermost.populate(members=6, posts=300, span_weeks=20, record_weeks=5, seed=7)
+    channel = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=after_weeksago, columnar=columnar)
+    user_ids = channel.user_ids
+    post_ids = list(channel.all_posts["posts"])
+
+    events = []
+    for i in range(60):
+        user_id = user_ids[i % len(user_ids)]
+        root_id = post_ids[i] if i % 3 == 0 else ""
+        events.append(post_event("posted", fake_mattermost.add_post(user_id, "new", broadcast=False, root_id=root_id)))
+    # A post created in the past, e.g. delivered late.
+    old_create_at = channel.all_posts["posts"][post_ids[100]].create_at
+    events.append(post_event("posted", fake_mattermost.add_post(user_ids[0], "late", old_create_at, broadcast=False)))
+    for post_id in post_ids[:40:2]:
+        events.append(post_event("post_edited", fake_mattermost.edit_post(post_id, message="edited")))
+    # The latest posts of the users, so that their last post times go back.
+    latest = {}
+    for post in fake_mattermost._sorted_posts(fake_mattermost.channel["id"]):
+        if post["type"] == "" and not post["delete_at"]:
+            latest.setdefault(post["user_id"], post["id"])
+    for post_id in list(latest.values()) + post_ids[1:40:4]:
+        events.append(post_event("post_deleted", fake_mattermost.delete_post(post_id)))
+
+    for event in events:
+        assert channel.apply_event(event)
+
+    fresh = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=after_weeksago, columnar=columnar)
+    assert channel_state(channel, user_ids) == channel_state(fresh, user_ids)
+
+
+def test_last_post_table_follows_deletes(fake_mattermost, driver_params):
+    fake_mattermost.populate(members=3, posts=50, span_weeks=5, seed=1)
+    channel = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=10)
+    user_id = channel.user_ids[1]
+    first = fake_mattermost.add_post(user_id, "first", broadcast=False)
+    second = fake_mattermost.add_post(user_id, "second", first["create_at"] + 1000, broadcast=False)
+    channel.apply_event(post_event("posted", first))
+    channel.apply_event(post_event("posted", second))
+    views = {"all": LAST_POST_VIEWS["all"]}
+
+    def last_post_ms():
+        return channel.get_last_post_datetimes_by_views(views, user_ids=[user_id])["all"][user_id].timestamp() * 1000
+
+    assert last_post_ms() == second["create_at"]
+    channel.apply_event(post_event("post_deleted", fake_mattermost.delete_post(second["id"])))
+    assert last_post_ms() == first["create_at"]
+
+
+def test_async_channel_merges_posts_off_the_event_loop(fake_mattermost, driver_params, monkeypatch):
+    fake_mattermost.populate(members=3, posts=50, span_weeks=5, seed=1)
+    threads = []
+
+    def recorded(method):
+        def wrapper(self, *args, **kwargs):
+            threads.append(threading.get_ident())
+            return method(self, *args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(MattermostChannel, "_complete_post_fetch", recorded(MattermostChannel._complete_post_fetch))
+    monkeypatch.setattr(MattermostChannel, "_merge_posts", recorded(MattermostChannel._merge_posts))
+
+    async def run():
+        async with await AsyncMattermostChannel.create(driver_params, "main", "relaychannel", after_weeksago=10) as channel:
+            user_id = channel.user_ids[1]
+            refreshed = fake_mattermost.add_post(user_id, "refreshed", broadcast=False)
+            assert await channel.refresh() == 1
+            event = fake_mattermost.add_post(user_id, "event", broadcast=False)
+            assert await channel.apply_event(post_event("posted", event))
+            assert refreshed["id"] in channel.all_posts["posts"] and event["id"] in channel.all_posts["posts"]
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert len(threads) == 3
+    assert loop_thread not in threads
+
+
+def test_channel_whose_event_failed_is_refreshed(fake_mattermost, driver_params):
+    fake_mattermost.populate(members=3, posts=50, span_weeks=5, seed=1)
+    channel = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=10)
+    listener = ChannelEventListener(channel.mm_driver)
+    listener.add_channel(channel)
+    post = fake_mattermost.add_post(channel.user_ids[1], "missed", broadcast=False)
+    broken = {"event": "posted", "data": {"post": "{"}, "broadcast": {"channel_id": post["channel_id"]}}
+
+    with pytest.warns(UserWarning, match="Failed to apply the websocket event posted"):
+        asyncio.run(listener._handle_message(json.dumps(broken)))
+    assert post["id"] in channel.all_posts["posts"]
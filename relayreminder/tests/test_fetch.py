@@ -0,0 +1,65 @@
+import asyncio
+
+import relayreminder
+from relayreminder import AsyncMattermostChannel, MattermostChannel, SINCE_POST_LIMIT
+
+POSTS_ROUTE = "GET /api/v4/channels/{channel_id}/posts"
+
+
+def post_requests(fake):
+    with fake.lock:
+        return fake.request_counts.get(POSTS_ROUTE, 0)
+
+
+def channel_post_ids(fake, since_ms=0):
+    return {post["id"] for post in fake._sorted_posts(fake.channel["id"]) if post["update_at"] > since_ms}
+
+
+def test_since_fetch_is_a_single_request(fake_mattermost, driver_params):
+    fake_mattermost.populate(members=5, posts=300, span_weeks=20)
+    channel = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100)
+    assert post_requests(fake_mattermost) == 1
+    assert set(channel.all_posts["posts"]) == channel_post_ids(fake_mattermost)
+
+    fake_mattermost.add_post(channel.user_ids[1], "new post")
+    assert channel.refresh() == 1
+    assert post_requests(fake_mattermost) == 2
+
+
+def test_cut_since_response_continues_before_its_oldest_post(fake_mattermost, driver_params):
+    fake_mattermost.populate(members=5, posts=2500, span_weeks=50)
+    channel = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100, fetch_workers=3)
+    posts = channel.all_posts["posts"]
+    assert len(posts) > SINCE_POST_LIMIT
+    assert set(posts) == channel_post_ids(fake_mattermost)
+    create_ats = [post.create_at for post in posts.values()]
+    assert create_ats == sorted(create_ats, reverse=True)
+    # The 'since' request, the pages before it, and at most a window of pages more.
+    pages = -(-(len(posts) - SINCE_POST_LIMIT) // relayreminder.MAX_PAGE_SIZE)
+    assert 1 + pages <= post_requests(fake_mattermost) <= 1 + pages + channel.fetch_workers
+
+
+def test_async_fetch_makes_the_same_requests(fake_mattermost, driver_params):
+    fake_mattermost.populate(members=5, posts=2500, span_weeks=50)
+    channel = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100, fetch_workers=3)
+    sync_requests = post_requests(fake_mattermost)
+    # Whether the pages requested ahead reach the server depends on the timing.
+    pages = -(-(len(channel.all_posts["posts"]) - SINCE_POST_LIMIT) // relayreminder.MAX_PAGE_SIZE)
+
+    async def fetch():
+        async with await AsyncMattermostChannel.create(driver_params, "main", "relaychannel", after_weeksago=100, fetch_workers=3) as async_channel:
+            return async_channel.all_posts["posts"]
+
+    async_posts = asyncio.run(fetch())
+    assert list(async_posts) == list(channel.all_posts["posts"])
+    assert 1 + pages <= post_requests(fake_mattermost) - sync_requests <= 1 + pages + channel.fetch_workers
+
+
+def test_cut_since_response_between_posts_of_the_same_millisecond(fake_mattermost, driver_params):
+    fake_mattermost.populate(members=5, posts=100, span_weeks=20)
+    user_id = fake_mattermost.members[fake_mattermost.channel["id"]][1]
+    start = fake_mattermost._sorted_posts(fake_mattermost.channel["id"])[0]["create_at"] + 1
+    for i in range(SINCE_POST_LIMIT + 500):
+        fake_mattermost.add_post(user_id, "new post", start + i // 7, broadcast=False)
+    channel = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100)
+    assert set(channel.all_posts["posts"]) == channel_post_ids(fake_mattermost)
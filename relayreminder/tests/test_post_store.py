@@ -0,0 +1,79 @@
+import json
+
+from relayreminder import MattermostChannel, PostStore, SINCE_POST_LIMIT
+
+
+def server_post_ids(fake, include_deleted=True):
+    return {post["id"] for post in fake._sorted_posts(fake.channel["id"], include_deleted)}
+
+
+def posted_event(post):
+    return {"event": "posted", "data": {"post": json.dumps(post)}, "broadcast": {"channel_id": post["channel_id"]}}
+
+
+def test_sync_with_more_changes_than_a_since_response(fake_mattermost, driver_params, tmp_path):
+    fake_mattermost.populate(members=5, posts=200, span_weeks=20)
+    store = PostStore(str(tmp_path / "posts.sqlite3"))
+    channel = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100, post_store=store)
+    user_id = channel.user_ids[1]
+
+    start = max(post.update_at for post in channel.all_posts["posts"].values()) + 1
+    for i in range(SINCE_POST_LIMIT + 500):
+        fake_mattermost.add_post(user_id, "new post", start + i, broadcast=False)
+
+    for _ in range(2):
+        synced = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100, post_store=store)
+        assert set(synced.all_posts["posts"]) == server_post_ids(fake_mattermost)
+        assert store.get_sync_state(synced.channel_id)[1] == start + SINCE_POST_LIMIT + 499
+
+    for i in range(SINCE_POST_LIMIT + 1):
+        fake_mattermost.add_post(user_id, "newer post", start + SINCE_POST_LIMIT + 500 + i, broadcast=False)
+    synced.refresh()
+    assert set(synced.all_posts["posts"]) == server_post_ids(fake_mattermost)
+
+
+def test_event_posts_do_not_advance_the_sync_state(fake_mattermost, driver_params, tmp_path):
+    fake_mattermost.populate(members=5, posts=100, span_weeks=20)
+    store = PostStore(str(tmp_path / "posts.sqlite3"))
+    channel = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100, post_store=store)
+    sync_state = store.get_sync_state(channel.channel_id)
+    user_id = channel.user_ids[1]
+
+    missed = fake_mattermost.add_post(user_id, "missed by the event stream", broadcast=False)
+    received = fake_mattermost.add_post(user_id, "received", missed["create_at"] + 1, broadcast=False)
+    assert channel.apply_event(posted_event(received))
+    assert store.get_sync_state(channel.channel_id) == sync_state
+
+    restarted = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100, post_store=store)
+    assert {missed["id"], received["id"]} <= set(restarted.all_posts["posts"])
+    assert channel.refresh() == 2
+    assert missed["id"] in channel.all_posts["posts"]
+
+
+def test_event_posts_without_sync_state(fake_mattermost, driver_params, tmp_path):
+    fake_mattermost.populate(members=5, posts=100, span_weeks=20)
+    store = PostStore(str(tmp_path / "posts.sqlite3"))
+    channel = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100, post_store=store)
+    store.clear(channel.channel_id)
+
+    post = fake_mattermost.add_post(channel.user_ids[1], "new post", broadcast=False)
+    assert channel.apply_event(posted_event(post))
+    assert store.get_sync_state(channel.channel_id) is None
+    assert post["id"] in channel.all_posts["posts"]
+
+
+def test_windows_with_and_without_deleted_posts_keep_their_own_copies(fake_mattermost, driver_params, tmp_path):
+    # The relay channel of the slash-commands (100 weeks) and /relayadmin (all the history).
+    fake_mattermost.populate(members=5, posts=100, span_weeks=20)
+    deleted = fake_mattermost.add_post(fake_mattermost.members[fake_mattermost.channel["id"]][1], "deleted", broadcast=False)
+    fake_mattermost.delete_post(deleted["id"])
+    store = PostStore(str(tmp_path / "posts.sqlite3"))
+
+    for _ in range(2):
+        relay = MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100, post_store=store)
+        history = MattermostChannel(driver_params, "main", "relaychannel", post_store=store)
+        assert set(relay.all_posts["posts"]) == server_post_ids(fake_mattermost)
+        assert set(history.all_posts["posts"]) == server_post_ids(fake_mattermost, include_deleted=False)
+    assert store.get_sync_state(relay.channel_id, include_deleted=True)[0] > 0
+    assert store.get_sync_state(relay.channel_id, include_deleted=False)[0] <= 0
+
@@ -0,0 +1,76 @@
+import time
+
+import httpx
+import pytest
+
+import relayreminder
+from relayreminder import BACKGROUND, INTERACTIVE, MattermostChannel, RateLimiter
+
+
+def headers(limit, remaining, reset, **extra):
+    return httpx.Headers(dict({
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(reset),
+    }, **extra))
+
+
+def test_unlimited_until_reported():
+    limiter = RateLimiter()
+    assert all(limiter._try_acquire(BACKGROUND) == 0 for _ in range(100))
+
+
+def test_tokens_follow_the_reported_remaining():
+    limiter = RateLimiter(interactive_reserve=0.2)
+    limiter.update(200, headers(10, 3, 1))
+    # 3 tokens, 2 of them reserved for interactive requests.
+    assert limiter._try_acquire(BACKGROUND) == 0
+    assert limiter._try_acquire(BACKGROUND) > 0
+    assert limiter._try_acquire(INTERACTIVE) == 0
+
+    limiter.update(200, headers(10, 10, 0))
+    assert all(limiter._try_acquire(BACKGROUND) == 0 for _ in range(7))
+
+
+def test_unknown_rate_never_blocks():
+    limiter = RateLimiter()
+    # A full bucket tells no rate.
+    limiter.update(200, headers(8, 8, 0))
+    assert limiter.rate is None
+    assert all(limiter._try_acquire(BACKGROUND) == 0 for _ in range(20))
+
+
+def test_refill_at_the_estimated_rate():
+    limiter = RateLimiter(interactive_reserve=0)
+    limiter.update(200, headers(10, 0, 2))
+    assert limiter.rate == pytest.approx(5)
+    assert limiter._try_acquire(BACKGROUND) == pytest.approx(0.2, abs=0.05)
+    limiter.updated -= 1  # One second later
+    assert sum(limiter._try_acquire(BACKGROUND) == 0 for _ in range(10)) == 5
+
+
+def test_429_backoff_doubles_until_a_success():
+    limiter = RateLimiter(max_backoff=60)
+    limiter.update(429, headers(10, 0, 1, **{"Retry-After": "1"}))
+    assert limiter._try_acquire(INTERACTIVE) == pytest.approx(1, abs=0.05)
+    limiter.update(429, headers(10, 0, 1, **{"Retry-After": "1"}))
+    assert limiter._try_acquire(INTERACTIVE) == pytest.approx(2, abs=0.05)
+    limiter.blocked_until = 0
+    limiter.update(200, headers(10, 5, 1))
+    assert limiter.rejections == 0
+    assert limiter._try_acquire(INTERACTIVE) == 0
+
+
+def test_requests_pass_a_rate_limited_server(fake_mattermost, driver_params, monkeypatch):
+    limiter = RateLimiter()
+    monkeypatch.setattr(relayreminder.RateLimitedClient, "limiter", limiter)
+    fake_mattermost.populate(members=5, posts=50, span_weeks=20)
+    fake_mattermost.set_rate_limit(50, 8)
+    channel = MattermostChannel(driver_params, "main", "relaychannel")
+
+    start = time.monotonic()
+    for _ in range(40):
+        channel.mm_driver.users.get_user(channel.user_ids[0])
+    assert time.monotonic() - start < 10
+    assert limiter.capacity == 8
+    assert fake_mattermost.request_counts.get("GET /api/v4/users/{user_id}") == 40
@@ -0,0 +1,136 @@
+import argparse
+import os
+from bisect import bisect_right
+from datetime import datetime
+
+import pytest
+
+from relayreminder import MattermostChannel, ReminderAction, dispatch_reminders, load_tsv_data, plan_reminders, post_records
+
+MESSAGE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "messages.tsv")
+FOLLOWING_ROUTE = "DELETE /api/v4/users/{user_id}/teams/{team_id}/threads/{thread_id}/following"
+
+
+def reminder_args(**kwargs):
+    return argparse.Namespace(**dict({"initialize": False, "app_name": "RelayReminder", "mention_format": "{} さん"}, **kwargs))
+
+
+def baseline_calls(mm_channel, args, message_file):
+    """The requests of the reminder loop of main() before plan_reminders(), in order."""
+    calls = []
+    message_data = load_tsv_data(message_file)
+    message_passed_weeks_list = sorted(message_data.keys())
+    max_week_limit = message_passed_weeks_list[-1]
+    current_week_number = mm_channel.get_week_number(datetime.now())
+
+    for week, last_passed_weeks, matching_posts, user_ids in post_records(mm_channel, args.app_name):
+        passed_weeks = current_week_number - week
+        if passed_weeks <= last_passed_weeks:
+            continue
+        passed_weeks_k = bisect_right(message_passed_weeks_list, passed_weeks)
+        if passed_weeks_k == 0:
+            continue
+        passed_weeks_to_post = message_passed_weeks_list[passed_weeks_k-1]
+        if passed_weeks_to_post > last_passed_weeks or passed_weeks > max(max_week_limit, last_passed_weeks):
+            message_start = message_data[passed_weeks_to_post].format(passed_weeks)
+            mentions = '\n'.join([args.mention_format.format(f'@{mm_channel.get_username_by_id(user_id)}') for user_id in user_ids])
+            message = f"{message_start}\n{mentions}"
+            if matching_posts:
+                post = matching_posts[-1]
+                post_id = post['id']
+                root_id = post['root_id'] or post_id
+                calls.append(("unfollow", post_id, sorted(set(post['props']['users']) - set(user_ids))))
+            else:
+                root_id = None
+            calls.append(("post", message, {
+                "bot_app": args.app_name,
+                "type": "record",
+                "last_post_week": week,
+                "passed_weeks": passed_weeks,
+                "users": user_ids,
+            }, root_id))
+            if matching_posts:
+                calls.append(("unfollow", post_id, sorted(set(post['props']['users']) - set(user_ids))))
+    # Unfollowing nobody makes no request.
+    return [call for call in calls if call[0] == "post" or call[2]]
+
+
+def planned_calls(actions):
+    return [
+        ("post", action.message, action.props, action.root_id) if action.kind == "post" else ("unfollow", action.post_id, action.user_ids)
+        for action in actions
+    ]
+
+
+def reminder_channel_of(fake_mattermost):
+    fake_mattermost.populate(members=30, posts=300, span_weeks=104, record_weeks=30, seed=5)
+    return MattermostChannel(fake_mattermost.driver_params(), "main", "relaychannel", after_weeksago=100)
+
+
+def test_plan_matches_the_baseline(fake_mattermost):
+    reminder_channel = reminder_channel_of(fake_mattermost)
+    args = reminder_args()
+    actions = plan_reminders(reminder_channel, args, MESSAGE_FILE)
+    assert any(action.kind == "post" for action in actions)
+    assert planned_calls(actions) == baseline_calls(reminder_channel, args, MESSAGE_FILE)
+    for action in actions:
+        assert action.thread == (action.root_id if action.kind == "post" else reminder_channel.all_posts["posts"][action.post_id].root_id or action.post_id)
+
+
+def test_plan_to_initialize(fake_mattermost):
+    reminder_channel = reminder_channel_of(fake_mattermost)
+    actions = plan_reminders(reminder_channel, reminder_args(initialize=True), MESSAGE_FILE)
+    assert [(action.kind, action.thread, action.props["type"]) for action in actions] == [("post", None, "relaystop")]
+
+
+def test_dispatch_posts_each_reminder_once(fake_mattermost):
+    reminder_channel = reminder_channel_of(fake_mattermost)
+    actions = plan_reminders(reminder_channel, reminder_args(), MESSAGE_FILE)
+    posts_before = len(fake_mattermost.posts)
+    results = dispatch_reminders(reminder_channel, actions)
+    assert [result["action"] for result in results] == actions
+    assert all(result["ok"] and result["attempts"] == 1 for result in results)
+    assert len(fake_mattermost.posts) - posts_before == sum(action.kind == "post" for action in actions)
+
+    # Dispatching the plan again is deduplicated by pending_post_id.
+    dispatch_reminders(reminder_channel, actions)
+    assert len(fake_mattermost.posts) - posts_before == sum(action.kind == "post" for action in actions)
+
+
+def test_retried_post_is_looked_for_after_the_pending_post_id_expired(fake_mattermost):
+    reminder_channel = reminder_channel_of(fake_mattermost)
+    post = next(action for action in plan_reminders(reminder_channel, reminder_args(), MESSAGE_FILE) if action.kind == "post")
+    fake_mattermost.pending_post_ttl = 0
+    # The post is made, but its response is lost.
+    fake_mattermost.fail_requests("POST /api/v4/posts", after_handling=True)
+    posts_before = len(fake_mattermost.posts)
+
+    with pytest.warns(UserWarning, match="Failed to send a post"):
+        [result] = dispatch_reminders(reminder_channel, [post], retry_backoff=0)
+    assert result["ok"] and result["attempts"] == 2
+    assert len(fake_mattermost.posts) - posts_before == 1
+    assert fake_mattermost.request_counts["POST /api/v4/posts"] == 1
+
+
+def test_unfollow_is_retried_for_the_failed_users(fake_mattermost):
+    reminder_channel = reminder_channel_of(fake_mattermost)
+    record = next(post for post in reminder_channel.all_posts["posts"].values() if post.props.get("type") == "record")
+    user_ids = reminder_channel.user_ids[:6]
+    fake_mattermost.fail_requests(FOLLOWING_ROUTE, times=2)
+
+    with pytest.warns(UserWarning):
+        [result] = dispatch_reminders(reminder_channel, [ReminderAction("unfollow", record.root_id or record.id, post_id=record.id, user_ids=user_ids)], retry_backoff=0)
+    assert result["ok"] and result["attempts"] == 2
+    assert fake_mattermost.request_counts[FOLLOWING_ROUTE] == len(user_ids) + 2
+
+
+def test_dispatch_gives_up_after_max_attempts(fake_mattermost):
+    reminder_channel = reminder_channel_of(fake_mattermost)
+    record = next(post for post in reminder_channel.all_posts["posts"].values() if post.props.get("type") == "record")
+    fake_mattermost.fail_requests(FOLLOWING_ROUTE, times=100)
+
+    with pytest.warns(UserWarning) as warned:
+        [result] = dispatch_reminders(reminder_channel, [ReminderAction("unfollow", record.id, post_id=record.id, user_ids=reminder_channel.user_ids[:2])], max_attempts=3, retry_backoff=0)
+    assert any("Gave up" in str(warning.message) for warning in warned)
+    assert not result["ok"] and result["attempts"] == 3
+    assert fake_mattermost.request_counts[FOLLOWING_ROUTE] == 6
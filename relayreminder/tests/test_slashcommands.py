@@ -0,0 +1,139 @@
+import asyncio
+import http.server
+import json
+import queue
+import threading
+
+import pytest
+
+import relayreminder
+from conftest import SLASH_TOKEN
+from relayreminder import MattermostChannel, create_slashcommand_app, create_slashcommand_asgi_app
+
+
+def command_form(channel, user_id, text):
+    return {"token": SLASH_TOKEN, "channel_id": channel.channel_id, "user_id": user_id, "text": text}
+
+
+@pytest.fixture
+def response_urls():
+    """A server of the response_url of the commands: the JSON posted to its paths are put to the queue."""
+    received = queue.Queue()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.put((self.path, json.loads(self.rfile.read(int(self.headers["Content-Length"])))))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", received
+    server.shutdown()
+    server.server_close()
+
+
+def test_slow_commands_are_answered_to_their_response_url(fake_mattermost, driver_params, slashcommand_args, response_urls, monkeypatch):
+    fake_mattermost.populate(members=4, posts=50, span_weeks=5, seed=1)
+    channel = MattermostChannel(driver_params, "main", "relaychannel")
+    user_id = channel.get_id_by_username("user1")
+    base_url, received = response_urls
+    calls, release = [], threading.Event()
+
+    def slow_whenmylast_response(*args):
+        calls.append(args[2])
+        assert release.wait(10)
+        return whenmylast_response(*args)
+
+    whenmylast_response = relayreminder.whenmylast_response
+    monkeypatch.setattr(relayreminder, "whenmylast_response", slow_whenmylast_response)
+    args = slashcommand_args("--defer-after", "0.2", "--command-workers", "2")
+    client = create_slashcommand_app(args).test_client()
+
+    # The same command meanwhile joins the computation in progress.
+    for path in ["/first", "/second"]:
+        form = dict(command_form(channel, user_id, ""), response_url=base_url + path)
+        assert client.post("/whenmylast", data=form).json == {"response_type": "ephemeral", "text": args.deferred_message}
+    assert received.empty()
+    release.set()
+    deferred = dict(received.get(timeout=10) for _ in range(2))
+    assert deferred["/first"] == deferred["/second"] and calls == [user_id]
+
+    # Once done, a command is computed again and answered within --defer-after.
+    form = dict(command_form(channel, user_id, ""), response_url=base_url + "/third")
+    assert client.post("/whenmylast", data=form).json == deferred["/first"]
+    assert calls == [user_id, user_id] and received.empty()
+
+
+
+async def asgi_post(app, path, form):
+    body = "&".join(f"{name}={value}" for name, value in form.items()).encode()
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "method": "POST", "path": path}, receive, send)
+    return json.loads(sent[-1]["body"])
+
+
+async def asgi_shutdown(app):
+    async def receive():
+        return {"type": "lifespan.shutdown"}
+
+    async def send(message):
+        pass
+
+    await app({"type": "lifespan"}, receive, send)
+
+
+def test_same_async_commands_join_the_computation_in_progress(fake_mattermost, driver_params, slashcommand_args, monkeypatch):
+    fake_mattermost.populate(members=4, posts=50, span_weeks=5, seed=1)
+    channel = MattermostChannel(driver_params, "main", "relaychannel")
+    user_id = channel.get_id_by_username("user1")
+    calls, release = [], threading.Event()
+
+    def slow_whenmylast_response(*args):
+        calls.append(args[2])
+        assert release.wait(10)
+        return whenmylast_response(*args)
+
+    whenmylast_response = relayreminder.whenmylast_response
+    monkeypatch.setattr(relayreminder, "whenmylast_response", slow_whenmylast_response)
+    app = create_slashcommand_asgi_app(slashcommand_args("--asgi"))
+
+    async def run():
+        form = command_form(channel, user_id, "")
+        commands = [asyncio.ensure_future(asgi_post(app, "/whenmylast", form)) for _ in range(2)]
+        asyncio.get_running_loop().call_later(0.2, release.set)
+        first, second = await asyncio.gather(*commands)
+        assert first == second and calls == [user_id]
+        assert await asgi_post(app, "/whenmylast", form) == first and calls == [user_id, user_id]
+        await asgi_shutdown(app)
+
+    asyncio.run(run())
+
+
+def test_relayadmin_stops_in_a_row_are_both_kept(fake_mattermost, driver_params, slashcommand_args):
+    fake_mattermost.populate(members=4, posts=50, span_weeks=5, seed=1)
+    channel = MattermostChannel(driver_params, "main", "relaychannel")
+    admin_id = channel.get_id_by_username("user0")
+    # Two workers, each with its own channel snapshot.
+    args = slashcommand_args()
+    workers = [create_slashcommand_app(args).test_client() for _ in range(2)]
+    for worker in workers:
+        assert "Relay-posts now stop" in worker.post("/relayadmin", data=command_form(channel, admin_id, "status")).json["text"]
+
+    for worker, username in zip(workers, ["user1", "user2"]):
+        response = worker.post("/relayadmin", data=command_form(channel, admin_id, f"stop {username} 2099-01-01"))
+        assert response.status_code == 200
+
+    stop_data = MattermostChannel(driver_params, "main", "relaychannel").stop_data
+    for username in ["user1", "user2"]:
+        assert stop_data[channel.get_id_by_username(username)] == "2099-01-01"
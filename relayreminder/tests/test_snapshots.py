@@ -0,0 +1,167 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from relayreminder import RELAY_CHANNEL_KEY, AsyncChannelSnapshots, ChannelSnapshots, MattermostChannel
+
+
+def view_posts(channel, post_ids):
+    posts = channel.all_posts["posts"]
+    return {post_id: posts[post_id].to_dict() for post_id in post_ids}
+
+
+def snapshot_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".snap"))
+
+
+def test_snapshot_published_by_one_worker_is_read_by_another(fake_mattermost, driver_params, tmp_path, monkeypatch):
+    fake_mattermost.populate(members=6, posts=300, span_weeks=20, record_weeks=5, seed=3)
+    # The publishing and the reading are driven by the test, not by the refresh threads.
+    monkeypatch.setattr(ChannelSnapshots, "_start", lambda self: None)
+
+    def factory(key):
+        return MattermostChannel(driver_params, "main", "relaychannel", after_weeksago=100)
+
+    publisher = ChannelSnapshots(factory, refresh_interval=0, snapshot_dir=str(tmp_path), driver_params=driver_params)
+    reader = ChannelSnapshots(factory, refresh_interval=0, snapshot_dir=str(tmp_path), driver_params=driver_params)
+
+    # Nothing is published yet: the reader asks for it and answers with a channel of its own.
+    own = reader.get(RELAY_CHANNEL_KEY)
+    assert reader.channels[RELAY_CHANNEL_KEY] is own
+
+    assert publisher._serve_requests() == set()
+    assert publisher.publishing and not reader.store.try_lead()
+    publisher._publish()
+    channel = publisher.channels[RELAY_CHANNEL_KEY]
+
+    snapshot = reader.get(RELAY_CHANNEL_KEY)
+    assert snapshot is not own and RELAY_CHANNEL_KEY not in reader.channels
+    assert snapshot.post_count() == channel.post_count()
+    assert snapshot.users == channel.users
+    assert snapshot.get_last_post_datetimes_by_views() == channel.get_last_post_datetimes_by_views()
+    assert snapshot.stop_data == channel.stop_data
+    assert snapshot.join_table.join_times == channel.join_table.join_times
+    assert view_posts(snapshot, snapshot.all_posts["posts"]) == view_posts(channel, snapshot.all_posts["posts"])
+    assert reader.get(RELAY_CHANNEL_KEY) is snapshot
+
+    # A new generation replaces the mapped one; the previous file is kept for the readers opening it.
+    user_id = channel.user_ids[1]
+    post = fake_mattermost.add_post(user_id, "new post", broadcast=False)
+    assert channel.refresh() == 1
+    publisher._publish()
+    publisher._publish()  # Unchanged: not published again.
+    assert len(snapshot_files(tmp_path)) == 2
+
+    newer = reader.get(RELAY_CHANNEL_KEY)
+    assert newer is not snapshot and newer.version != snapshot.version
+    assert newer.post_count() == snapshot.post_count() + 1
+    last_posts = newer.get_last_post_datetimes_by_views(user_ids=[user_id])
+    assert last_posts == channel.get_last_post_datetimes_by_views(user_ids=[user_id])
+    assert last_posts["all"][user_id].timestamp() * 1000 == post["create_at"]
+
+    # The latest state is fetched from the server, not read from the mapped snapshot.
+    fake_mattermost.add_post(user_id, "newer post", broadcast=False)
+    latest = reader.latest(RELAY_CHANNEL_KEY)
+    assert latest.post_count() == newer.post_count() + 1 and RELAY_CHANNEL_KEY not in reader.channels
+
+
+def test_channels_are_created_outside_the_lock():
+    slow_started, slow_release = threading.Event(), threading.Event()
+    created = []
+
+    def factory(key):
+        created.append(key)
+        if key == ("slow",):
+            slow_started.set()
+            slow_release.wait(10)
+        return object()
+
+    snapshots = ChannelSnapshots(factory, refresh_interval=0)
+    with ThreadPoolExecutor(3) as executor:
+        slow = [executor.submit(snapshots.get, ("slow",)) for _ in range(2)]
+        assert slow_started.wait(10)
+        # Another key is not blocked by the creation in progress.
+        assert executor.submit(snapshots.get, ("fast",)).result(timeout=10) is snapshots.channels[("fast",)]
+        slow_release.set()
+        assert slow[0].result(timeout=10) is slow[1].result(timeout=10) is snapshots.channels[("slow",)]
+    assert sorted(created) == [("fast",), ("slow",)]
+
+
+def test_idle_channels_are_dropped_but_the_kept_ones():
+    created = []
+
+    def factory(key):
+        created.append(key)
+        return object()
+
+    snapshots = ChannelSnapshots(factory, refresh_interval=0, idle_timeout=60, kept_keys=[RELAY_CHANNEL_KEY])
+    snapshots._start = lambda: None
+    relay, other = snapshots.get(RELAY_CHANNEL_KEY), snapshots.get(("channel-id", "other"))
+    snapshots._evict()
+    assert snapshots.get(("channel-id", "other")) is other
+
+    for key in snapshots.used:
+        snapshots.used[key] -= 120
+    snapshots._evict()
+    assert list(snapshots.channels) == [RELAY_CHANNEL_KEY]
+    assert snapshots.get(RELAY_CHANNEL_KEY) is relay
+    assert snapshots.get(("channel-id", "other")) is not other
+    assert created == [RELAY_CHANNEL_KEY, ("channel-id", "other"), ("channel-id", "other")]
+
+
+def test_idle_snapshot_is_withdrawn_by_the_publisher(fake_mattermost, driver_params, tmp_path, monkeypatch):
+    fake_mattermost.populate(members=3, posts=50, span_weeks=5, seed=1)
+    monkeypatch.setattr(ChannelSnapshots, "_start", lambda self: None)
+    key = ("channel-id", fake_mattermost.channel["id"])
+
+    def factory(key):
+        return MattermostChannel(driver_params, channel_id=key[1], after_weeksago=10)
+
+    params = dict(refresh_interval=0, snapshot_dir=str(tmp_path), driver_params=driver_params, idle_timeout=60)
+    publisher, reader = ChannelSnapshots(factory, **params), ChannelSnapshots(factory, **params)
+    reader.get(key)
+    publisher._serve_requests()
+    publisher._publish()
+    snapshot = reader.get(key)
+    assert key in reader.store.mapped and snapshot_files(tmp_path)
+
+    # Used by the reader only: it asks again now and then, which keeps the snapshot at the publisher.
+    publisher.used[key] -= 120
+    reader.requested[key] -= 40
+    assert reader.get(key) is snapshot
+    publisher._serve_requests()
+    publisher._evict()
+    assert key in publisher.channels
+
+    publisher.used[key] -= 120
+    publisher._evict()
+    assert key not in publisher.channels and snapshot_files(tmp_path) == []
+    # The reader answers with a channel of its own and asks for the snapshot again.
+    own = reader.get(key)
+    assert own is not snapshot and key not in reader.store.mapped
+    publisher._serve_requests()
+    assert key in publisher.channels
+
+
+def test_idle_async_channels_are_closed():
+    class Channel:
+        closed = False
+
+        async def close(self):
+            self.closed = True
+
+    async def factory(key):
+        return Channel()
+
+    async def run():
+        snapshots = AsyncChannelSnapshots(factory, refresh_interval=0, idle_timeout=60, kept_keys=[RELAY_CHANNEL_KEY])
+        relay, other = await snapshots.get(RELAY_CHANNEL_KEY), await snapshots.get(("channel-id", "other"))
+        for key in snapshots.used:
+            snapshots.used[key] -= 120
+        await snapshots._evict()
+        assert list(snapshots.channels) == [RELAY_CHANNEL_KEY]
+        assert other.closed and not relay.closed
+        await snapshots.close()
+
+    asyncio.run(run())